@@ -0,0 +1,407 @@
+"""Result cache for the `/metrics` and `/insights` endpoints.
+
+Entries are keyed by `(endpoint, unit_id, start, end, extra filters)` and
+remember the day range they cover, so writes can invalidate exactly the
+unit/day pairs they touch. Ranges that ended before today get a long TTL;
+anything that includes today (or is open-ended) gets the endpoint's short TTL.
+
+The default backend is an in-process bounded LRU. Setting `CACHE_URL` to a
+`redis://` URL shares entries between workers (requires the `redis` package).
+
+Commit hooks only invalidate the cache of the process that wrote. Jobs that
+rewrite past days (the rollup runs on the leader only) call
+`publish_invalidation`, which moves a shared generation kept in
+`rollup_estado`; each worker re-reads it at most every
+`CACHE_GENERATION_SECONDS` and entries of an older generation stop matching.
+Writes on another worker to a closed range therefore reach the other
+workers' LRUs once the next rollup pass recomputes those days, instead of
+after `CACHE_TTL_PAST`. The generation is also part of the ETag watermark,
+and other per-worker state (columnar snapshot, stream replay) subscribes to
+its changes with `on_generation_change`; the text repair backfill publishes
+one for every batch that rewrote rows.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Protocol, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .database import ReadSession, fetch_one_async
+from .models import Pedido, RollupEstado
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") not in ("0", "false", "False")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL_DEFAULT = int(os.getenv("CACHE_TTL_DEFAULT", "60"))
+CACHE_TTL_PAST = int(os.getenv("CACHE_TTL_PAST", "3600"))
+CACHE_GENERATION_SECONDS = float(os.getenv("CACHE_GENERATION_SECONDS", "5"))
+
+# Linha de `rollup_estado` cuja marca é a geração compartilhada do cache
+GENERATION_STATE = "cache_resultados"
+
+# TTL curto (segundos) para intervalos que incluem hoje
+ENDPOINT_TTLS: Dict[str, int] = {
+    "metrics/daily-overview": 15,
+    "metrics/daily-cumulative-revenue": 15,
+    "metrics/daily-accept-time-by-hour": 15,
+    "metrics/daily-cancellations-by-hour": 15,
+    "metrics/monthly-revenue": 300,
+    "insights/negative-feedbacks": 30,
+}
+
+
+@dataclass(frozen=True)
+class CacheEntryMeta:
+    unit_id: Optional[int]
+    start: Optional[date]
+    end: Optional[date]
+
+    def overlaps(self, unit_id: Optional[int], day: date) -> bool:
+        # Entradas sem unidade agregam todas as unidades
+        if self.unit_id is not None and unit_id is not None and self.unit_id != unit_id:
+            return False
+        if self.start is not None and day < self.start:
+            return False
+        if self.end is not None and day > self.end:
+            return False
+        return True
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Optional[Any]: ...
+
+    def set(self, key: str, value: Any, ttl: int, meta: CacheEntryMeta) -> None: ...
+
+    def entries(self, unit_id: Optional[int]) -> Iterator[Tuple[str, CacheEntryMeta]]:
+        """Entries that may involve `unit_id`, including all-unit entries."""
+        ...
+
+    def delete(self, keys: Iterable[str]) -> None: ...
+
+    def clear(self) -> None: ...
+
+
+class LRUBackend:
+    """Bounded in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data: "OrderedDict[str, Tuple[float, Any, CacheEntryMeta]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: Any, ttl: int, meta: CacheEntryMeta) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value, meta)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def entries(self, unit_id: Optional[int]) -> Iterator[Tuple[str, CacheEntryMeta]]:
+        with self._lock:
+            snapshot = [(k, v[2]) for k, v in self._data.items()]
+        return iter(snapshot)
+
+    def delete(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"not JSON serializable: {type(value)!r}")
+
+
+class RedisBackend:
+    """Shared backend; each unit keeps a set of its keys for invalidation."""
+
+    def __init__(self, url: str, prefix: str = "ifood:cache:"):
+        import redis  # dependência opcional
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def _index(self, unit_id: Optional[int]) -> str:
+        return f"{self._prefix}idx:{'all' if unit_id is None else unit_id}"
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._redis.get(self._prefix + key)
+        return json.loads(raw)["v"] if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: int, meta: CacheEntryMeta) -> None:
+        payload = {
+            "v": value,
+            "m": [meta.unit_id, meta.start and meta.start.isoformat(), meta.end and meta.end.isoformat()],
+        }
+        pipe = self._redis.pipeline()
+        pipe.setex(self._prefix + key, ttl, json.dumps(payload, default=_json_default))
+        pipe.sadd(self._index(meta.unit_id), key)
+        pipe.execute()
+
+    def entries(self, unit_id: Optional[int]) -> Iterator[Tuple[str, CacheEntryMeta]]:
+        indexes = {self._index(None), self._index(unit_id)} if unit_id is not None else None
+        if indexes is None:
+            indexes = {k.decode() for k in self._redis.scan_iter(f"{self._prefix}idx:*")}
+        for index in indexes:
+            for raw_key in self._redis.smembers(index):
+                key = raw_key.decode()
+                raw = self._redis.get(self._prefix + key)
+                if raw is None:
+                    self._redis.srem(index, key)  # expirou
+                    continue
+                u, s, e = json.loads(raw)["m"]
+                yield key, CacheEntryMeta(u, s and date.fromisoformat(s), e and date.fromisoformat(e))
+
+    def delete(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if keys:
+            self._redis.delete(*(self._prefix + k for k in keys))
+
+    def clear(self) -> None:
+        for key in self._redis.scan_iter(f"{self._prefix}*"):
+            self._redis.delete(key)
+
+
+class ResultCache:
+    def __init__(self, backend: CacheBackend, enabled: bool = CACHE_ENABLED):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.invalidations = 0
+        self.generation: Optional[str] = None
+        self._generation_read_at: Optional[float] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    @staticmethod
+    def key(endpoint: str, meta: CacheEntryMeta, extra: Dict[str, Any]) -> str:
+        parts = [endpoint, str(meta.unit_id), str(meta.start), str(meta.end)]
+        parts += [f"{k}={extra[k]}" for k in sorted(extra)]
+        return "|".join(parts)
+
+    @staticmethod
+    def ttl_for(endpoint: str, meta: CacheEntryMeta, today: Optional[date] = None) -> int:
+        today = today or date.today()
+        if meta.end is not None and meta.end < today:
+            return CACHE_TTL_PAST
+        return ENDPOINT_TTLS.get(endpoint, CACHE_TTL_DEFAULT)
+
+    def _stored_key(self, key: str) -> str:
+        return f"{self.generation}|{key}" if self.generation else key
+
+    async def sync_generation_async(self, db: ReadSession) -> None:
+        """Re-read the shared generation, at most every `CACHE_GENERATION_SECONDS`."""
+        now = time.monotonic()
+        if self._generation_read_at is not None and now - self._generation_read_at < CACHE_GENERATION_SECONDS:
+            return
+        row = await fetch_one_async(
+            db, "SELECT watermark FROM rollup_estado WHERE nome = :nome", {"nome": GENERATION_STATE}
+        )
+        self.set_generation(str(row["watermark"]) if row and row["watermark"] is not None else None, now)
+
+    def set_generation(self, generation: Optional[str], read_at: Optional[float] = None) -> None:
+        first_read = self._generation_read_at is None
+        self._generation_read_at = time.monotonic() if read_at is None else read_at
+        if generation == self.generation:
+            return
+        # As entradas antigas deixam de casar e saem pela ordem do LRU (ou pelo TTL no Redis)
+        self.generation = generation
+        if first_read:
+            return
+        for listener in self._listeners:
+            try:
+                listener()
+            except Exception:
+                logger.exception("falha ao aplicar a nova geração do cache")
+
+    def on_generation_change(self, listener: Callable[[], None]) -> None:
+        """Call `listener` whenever another process publishes an invalidation."""
+        self._listeners.append(listener)
+
+    def get_or_compute(
+        self,
+        endpoint: str,
+        meta: CacheEntryMeta,
+        compute: Callable[[], Any],
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        if not self.enabled:
+            return compute()
+        key = self._stored_key(self.key(endpoint, meta, extra or {}))
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            logger.exception("cache indisponível; consultando o banco")
+            return compute()
+        if value is not None:
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+            return value
+        self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+        value = compute()
+        try:
+            self.backend.set(key, value, self.ttl_for(endpoint, meta), meta)
+        except Exception:
+            logger.exception("falha ao gravar no cache")
+        return value
+
+    async def get_or_compute_async(
+        self,
+        endpoint: str,
+        meta: CacheEntryMeta,
+        compute: Callable[[], Awaitable[Any]],
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """Same as `get_or_compute` for async handlers; `compute` returns an awaitable."""
+        if not self.enabled:
+            return await compute()
+        key = self._stored_key(self.key(endpoint, meta, extra or {}))
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            logger.exception("cache indisponível; consultando o banco")
+            return await compute()
+        if value is not None:
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+            return value
+        self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+        value = await compute()
+        try:
+            self.backend.set(key, value, self.ttl_for(endpoint, meta), meta)
+        except Exception:
+            logger.exception("falha ao gravar no cache")
+        return value
+
+    def invalidate(self, pairs: Iterable[Tuple[Optional[int], date]]) -> int:
+        """Drop every entry whose unit/range covers one of the (unit, day) pairs."""
+        by_unit: Dict[Optional[int], set] = {}
+        for unit_id, day in pairs:
+            by_unit.setdefault(unit_id, set()).add(day)
+        stale: List[str] = []
+        for unit_id, days in by_unit.items():
+            for key, meta in self.backend.entries(unit_id):
+                if any(meta.overlaps(unit_id, d) for d in days):
+                    stale.append(key)
+        self.backend.delete(stale)
+        self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self.generation = None
+        self._generation_read_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "invalidations": self.invalidations,
+            "generation": self.generation,
+            "evictions": getattr(self.backend, "evictions", 0),
+            "entries": len(self.backend) if hasattr(self.backend, "__len__") else None,
+        }
+
+
+def _make_backend() -> CacheBackend:
+    url = os.getenv("CACHE_URL")
+    if url and url.startswith("redis"):
+        try:
+            return RedisBackend(url)
+        except ImportError:
+            logger.warning("CACHE_URL definido, mas o pacote 'redis' não está instalado; usando LRU local")
+    return LRUBackend()
+
+
+result_cache = ResultCache(_make_backend())
+
+
+def publish_invalidation(db: Session) -> None:
+    """Move the shared generation so every worker drops its cached results; takes effect when `db` commits."""
+    state = db.get(RollupEstado, GENERATION_STATE)
+    if state is None:
+        state = RollupEstado(nome=GENERATION_STATE)
+        db.add(state)
+    # Microssegundos: duas publicações no mesmo segundo ainda geram marcas diferentes
+    state.watermark = datetime.now(timezone.utc)
+
+
+def _order_day(value: Any) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+
+def install_invalidation_hooks() -> None:
+    """Invalidate cached results for orders written through the ORM.
+
+    Touched (unit, day) pairs are collected on flush and dropped only after
+    the transaction commits, so a rollback leaves the cache alone.
+    """
+    if event.contains(Session, "after_flush", _collect_order_changes):
+        return
+    event.listen(Session, "after_flush", _collect_order_changes)
+    event.listen(Session, "after_commit", _invalidate_after_commit)
+    event.listen(Session, "after_rollback", _discard_on_rollback)
+
+
+def _collect_order_changes(session: Session, flush_context) -> None:
+    pairs = session.info.setdefault("cache_dirty", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Pedido):
+            continue
+        attrs = inspect(obj).attrs
+        # Inclui os valores antigos: um pedido movido afeta a unidade/dia de origem também
+        units = {obj.id_unidade, *attrs.id_unidade.history.deleted}
+        days = {_order_day(obj.data_pedido) or date.today(), *map(_order_day, attrs.data_pedido.history.deleted)}
+        pairs.update((u, d) for u in units for d in days if d is not None)
+
+
+def mark_orders_changed(session: Session, pairs: Iterable[Tuple[Optional[int], date]]) -> None:
+    """Register (unit, day) pairs written outside the ORM (bulk Core statements).
+
+    They are invalidated with the ORM changes when the session commits.
+    """
+    session.info.setdefault("cache_dirty", set()).update(pairs)
+
+
+def _discard_on_rollback(session: Session) -> None:
+    session.info.pop("cache_dirty", None)
+
+
+def _invalidate_after_commit(session: Session) -> None:
+    pairs = session.info.pop("cache_dirty", None)
+    if pairs:
+        result_cache.invalidate(pairs)
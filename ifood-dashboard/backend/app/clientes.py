@@ -0,0 +1,172 @@
+"""First order of each customer, kept in `clientes_primeiro_pedido`.
+
+The new vs. returning split of the daily pages and the cohort insights join
+the day's orders with this table instead of scanning the whole order
+history for `MIN(data_pedido)` on every request. Like the daily rollup, an
+incremental job follows a watermark on `pedidos.updated_at` (with the same
+`ROLLUP_LAG_SECONDS` overlap, see app/rollup.py): each run recomputes the
+first order only for the customers whose orders changed.
+The table is loaded once with:
+
+    python -m app.clientes backfill
+
+Until the backfill has run, the queries fall back to scanning `pedidos`
+(see `ready`).
+"""
+import argparse
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import ReadSession, SessionLocal, fetch_one_async
+from .rollup import as_date, changed_since, current_watermark, upsert
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "clientes_primeiro_pedido"
+BATCH_SIZE = int(os.getenv("CLIENTES_BATCH_SIZE", "1000"))
+
+Pedido = models.Pedido
+Tabela = models.ClientePrimeiroPedido
+
+
+def _first_orders(db: Session, customers: Optional[Sequence[int]] = None):
+    """Earliest order of each customer (ties broken by id), as result rows."""
+    ordem = func.row_number().over(partition_by=Pedido.id_cliente, order_by=(Pedido.data_pedido, Pedido.id))
+    ranked = select(
+        Pedido.id_cliente, Pedido.id, Pedido.id_unidade, Pedido.data_pedido, ordem.label("ordem")
+    ).where(Pedido.id_cliente.is_not(None), Pedido.data_pedido.is_not(None))
+    if customers is not None:
+        ranked = ranked.where(Pedido.id_cliente.in_(customers))
+    ranked = ranked.subquery()
+    return db.execute(
+        select(ranked.c.id_cliente, ranked.c.id, ranked.c.id_unidade, ranked.c.data_pedido).where(ranked.c.ordem == 1)
+    )
+
+
+def _as_row(r) -> Dict[str, Any]:
+    return {
+        "id_cliente": r.id_cliente,
+        "id_pedido": r.id,
+        "id_unidade": r.id_unidade,
+        "primeiro_pedido_em": r.data_pedido,
+        "primeira_data": as_date(r.data_pedido),
+    }
+
+
+def _store(db: Session, rows: List[Dict[str, Any]]) -> None:
+    upsert(db, Tabela.__table__, rows, ["id_cliente"])
+
+
+def refresh(db: Session, customers: Sequence[int]) -> int:
+    """Recompute the first order of `customers`; return how many rows changed."""
+    rows = [_as_row(r) for r in _first_orders(db, customers)]
+    _store(db, rows)
+    # Cliente sem nenhum pedido restante sai da tabela
+    gone = set(customers) - {r["id_cliente"] for r in rows}
+    if gone:
+        db.execute(delete(Tabela).where(Tabela.id_cliente.in_(gone)))
+    return len(rows) + len(gone)
+
+
+def _get_state(db: Session) -> Optional[models.RollupEstado]:
+    return db.get(models.RollupEstado, STATE_NAME)
+
+
+def backfill(db: Session) -> int:
+    """Load the first order of every customer, upserting `BATCH_SIZE` rows at a time.
+
+    The watermark is taken before the scan, so orders written meanwhile are
+    picked up by the next incremental run. Safe to run again.
+    """
+    watermark = current_watermark(db)
+    result = _first_orders(db).yield_per(BATCH_SIZE)
+    total = 0
+    for batch in result.partitions():
+        rows = [_as_row(r) for r in batch]
+        _store(db, rows)
+        total += len(rows)
+    state = _get_state(db)
+    if state is None:
+        state = models.RollupEstado(nome=STATE_NAME)
+        db.add(state)
+    if state.watermark is None:
+        state.watermark = watermark
+    db.commit()
+    return total
+
+
+def run_incremental(db: Session) -> int:
+    """Refresh the customers whose orders changed since the watermark.
+
+    Returns the number of customers refreshed. Does nothing before the
+    backfill: a partial table would classify old customers as new.
+    """
+    state = _get_state(db)
+    if state is None or state.watermark is None:
+        return 0
+    # Relê a janela de sobreposição: recalcular um cliente de novo não muda nada
+    new_watermark = max(current_watermark(db), state.watermark)
+    dirty = list(
+        db.execute(
+            select(Pedido.id_cliente).where(changed_since(state.watermark), Pedido.id_cliente.is_not(None)).distinct()
+        ).scalars()
+    )
+    for i in range(0, len(dirty), BATCH_SIZE):
+        refresh(db, dirty[i : i + BATCH_SIZE])
+    state.watermark = new_watermark
+    db.commit()
+    if dirty:
+        logger.info("%s: %d cliente(s) atualizado(s)", STATE_NAME, len(dirty))
+    return len(dirty)
+
+
+def ready(db: Session) -> bool:
+    """True once the backfill has run and the table can replace the history scan."""
+    state = _get_state(db)
+    return state is not None and state.watermark is not None
+
+
+async def ready_async(db: ReadSession) -> bool:
+    state = await fetch_one_async(
+        db, "SELECT watermark FROM rollup_estado WHERE nome = :nome", {"nome": STATE_NAME}
+    )
+    return state is not None and state["watermark"] is not None
+
+
+def run_incremental_job() -> None:
+    """Scheduler entry point: runs one incremental pass on its own session."""
+    db = SessionLocal()
+    try:
+        run_incremental(db)
+    except Exception:
+        # O wrapper de app/scheduling.py registra o erro no log e no histórico
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.clientes", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="carrega o primeiro pedido de todos os clientes")
+    sub.add_parser("run", help="executa uma passada incremental")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "backfill":
+            print(f"{backfill(db)} cliente(s) carregado(s)")
+        else:
+            print(f"{run_incremental(db)} cliente(s) atualizado(s)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    _main()
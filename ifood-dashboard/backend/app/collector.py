@@ -0,0 +1,268 @@
+"""Incremental collector for the iFood order API.
+
+One pooled keep-alive `httpx.AsyncClient` is shared by every run. Units are
+collected concurrently, each one following its own cursor (persisted in
+`coleta_cursores`) page by page; a semaphore bounds how many page requests
+are in flight across all units. Timeouts, connection errors, 429 and 5xx are
+retried with exponential backoff and jitter (honouring `Retry-After`).
+Pages are written through the bulk path of `app.ingest`, so a page fetched
+twice (e.g. after a crash before the cursor was saved) only updates the same
+orders again.
+
+The API is expected to answer `GET /merchants/{unit_id}/orders?cursor=&limit=`
+with `{"orders": [...], "cursor": "...", "has_more": bool}`, each order in
+the `/ingest/pedidos` format. `benchmarks/ifood_stub.py` serves that locally:
+
+    python -m benchmarks.ifood_stub --port 8900 --orders 20000 --error-rate 0.05
+    IFOOD_API_URL=http://127.0.0.1:8900 python -m app.collector run
+
+Configuration:
+- IFOOD_API_URL: base URL of the API; unset disables the scheduled job.
+- IFOOD_API_TOKEN: bearer token sent on every request.
+- COLLECTOR_CONCURRENCY: page requests in flight, all units together (default 4).
+- COLLECTOR_PAGE_SIZE: orders per page (default 500).
+- COLLECTOR_MAX_RETRIES, COLLECTOR_BACKOFF_BASE, COLLECTOR_BACKOFF_MAX:
+  retries per request and the backoff curve, in seconds (5, 0.5, 30).
+- COLLECTOR_INTERVAL_MINUTES: interval of the scheduled job (default 30).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import ingest, models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+IFOOD_API_URL = os.getenv("IFOOD_API_URL")
+IFOOD_API_TOKEN = os.getenv("IFOOD_API_TOKEN")
+COLLECTOR_CONCURRENCY = int(os.getenv("COLLECTOR_CONCURRENCY", "4"))
+COLLECTOR_PAGE_SIZE = int(os.getenv("COLLECTOR_PAGE_SIZE", "500"))
+COLLECTOR_MAX_RETRIES = int(os.getenv("COLLECTOR_MAX_RETRIES", "5"))
+COLLECTOR_BACKOFF_BASE = float(os.getenv("COLLECTOR_BACKOFF_BASE", "0.5"))
+COLLECTOR_BACKOFF_MAX = float(os.getenv("COLLECTOR_BACKOFF_MAX", "30"))
+COLLECTOR_INTERVAL_MINUTES = int(os.getenv("COLLECTOR_INTERVAL_MINUTES", "30"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CollectorError(Exception):
+    """A page could not be fetched or stored; the unit's cursor stays where it was."""
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class Collector:
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        concurrency: int = COLLECTOR_CONCURRENCY,
+        page_size: int = COLLECTOR_PAGE_SIZE,
+        max_retries: int = COLLECTOR_MAX_RETRIES,
+        backoff_base: float = COLLECTOR_BACKOFF_BASE,
+        backoff_max: float = COLLECTOR_BACKOFF_MAX,
+        timeout: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ):
+        self.base_url = base_url
+        self.token = token
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.session_factory = session_factory
+        self.retries = 0
+        self._transport = transport
+        self._sleep = sleep
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        # Criado no primeiro uso: cliente e semáforo ficam presos ao event loop atual
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency, max_keepalive_connections=self.concurrency, keepalive_expiry=60
+                ),
+                transport=self._transport,
+            )
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._slots = None
+
+    def _delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        cap = min(self.backoff_max, self.backoff_base * 2**attempt)
+        # Jitter: unidades que falharam juntas não voltam todas no mesmo instante
+        return random.uniform(cap / 2, cap)
+
+    async def fetch_page(self, unit_id: int, cursor: Optional[str]) -> Dict[str, Any]:
+        client = self._http()
+        params: Dict[str, Any] = {"limit": self.page_size}
+        if cursor:
+            params["cursor"] = cursor
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self._slots:
+                    resp = await client.get(f"/merchants/{unit_id}/orders", params=params)
+            except httpx.TransportError as exc:
+                error = f"{type(exc).__name__}: {exc}"
+            else:
+                if resp.status_code == 200:
+                    return resp.json()
+                if resp.status_code not in RETRYABLE_STATUS:
+                    raise CollectorError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+                error = f"HTTP {resp.status_code}"
+                retry_after = _retry_after(resp)
+            if attempt == self.max_retries:
+                raise CollectorError(f"{error} (after {attempt + 1} attempts)")
+            self.retries += 1
+            await self._sleep(self._delay(attempt, retry_after))
+        raise AssertionError("unreachable")
+
+    def _load_cursor(self, unit_id: int) -> Optional[str]:
+        with self.session_factory() as db:
+            state = db.get(models.ColetaCursor, unit_id)
+            return state.cursor if state else None
+
+    def _save_state(self, db: Session, unit_id: int, **values: Any) -> None:
+        state = db.get(models.ColetaCursor, unit_id)
+        if state is None:
+            state = models.ColetaCursor(id_unidade=unit_id, pedidos_coletados=0)
+            db.add(state)
+        for name, value in values.items():
+            setattr(state, name, value)
+        db.commit()
+
+    def _store_page(self, unit_id: int, orders: List[Dict[str, Any]], cursor: Optional[str]) -> int:
+        """Write one page and then advance the cursor; return the orders written."""
+        with self.session_factory() as db:
+            valid, errors = ingest.validate(db, orders, unit_id)
+            if errors:
+                logger.warning("coleta unidade %s: %d pedido(s) rejeitado(s): %s", unit_id, len(errors), errors[:3])
+            failed = [lote["erro"] for lote in ingest.ingest(db, valid) if "erro" in lote]
+            if failed:
+                raise CollectorError(f"ingestion failed: {failed[0]}")
+            state = db.get(models.ColetaCursor, unit_id)
+            total = (state.pedidos_coletados or 0) if state else 0
+            self._save_state(db, unit_id, cursor=cursor, pedidos_coletados=total + len(valid), ultimo_erro=None)
+            return len(valid)
+
+    def _record_error(self, unit_id: int, error: str) -> None:
+        with self.session_factory() as db:
+            self._save_state(db, unit_id, ultimo_erro=error[:500])
+
+    async def collect_unit(self, unit_id: int) -> int:
+        """Follow the unit's cursor until the API has no more pages."""
+        cursor = await run_in_threadpool(self._load_cursor, unit_id)
+        written = 0
+        while True:
+            page = await self.fetch_page(unit_id, cursor)
+            orders = page.get("orders") or []
+            next_cursor = page.get("cursor") or cursor
+            if orders or next_cursor != cursor:
+                written += await run_in_threadpool(self._store_page, unit_id, orders, next_cursor)
+            cursor = next_cursor
+            if not page.get("has_more") or not orders:
+                return written
+
+    async def _collect_safe(self, unit_id: int) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        try:
+            written = await self.collect_unit(unit_id)
+            error = None
+        except Exception as exc:
+            written, error = 0, str(exc)
+            logger.warning("coleta unidade %s falhou: %s", unit_id, error)
+            await run_in_threadpool(self._record_error, unit_id, error)
+        return {"pedidos": written, "erro": error, "segundos": round(time.perf_counter() - t0, 2)}
+
+    def _units(self) -> List[int]:
+        with self.session_factory() as db:
+            return list(db.execute(select(models.Unidade.id).order_by(models.Unidade.id)).scalars())
+
+    async def run(self, units: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, Any]]:
+        """Collect every unit (or `units`) concurrently; one result per unit.
+
+        A failing unit does not stop the others; its error is kept in
+        `coleta_cursores.ultimo_erro` and the next run resumes from its cursor.
+        """
+        units = list(units) if units is not None else await run_in_threadpool(self._units)
+        results = await asyncio.gather(*(self._collect_safe(u) for u in units))
+        return dict(zip(units, results))
+
+
+collector: Optional[Collector] = Collector(IFOOD_API_URL, IFOOD_API_TOKEN) if IFOOD_API_URL else None
+
+
+async def run_job() -> None:
+    """Scheduler entry point; does nothing when IFOOD_API_URL is not set."""
+    if collector is None:
+        return
+    results = await collector.run()
+    total = sum(r["pedidos"] for r in results.values())
+    failed = [u for u, r in results.items() if r["erro"]]
+    logger.info("coleta: %d pedido(s) de %d unidade(s); falhas: %s", total, len(results), failed or "nenhuma")
+
+
+async def shutdown() -> None:
+    if collector is not None:
+        await collector.aclose()
+
+
+def _main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.collector", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="executa uma coleta")
+    run.add_argument("--unit", type=int, action="append", help="só estas unidades (pode repetir)")
+    args = parser.parse_args(argv)
+    if collector is None:
+        parser.error("defina IFOOD_API_URL")
+
+    async def once() -> Dict[int, Dict[str, Any]]:
+        try:
+            return await collector.run(args.unit)
+        finally:
+            await collector.aclose()
+
+    t0 = time.perf_counter()
+    results = asyncio.run(once())
+    elapsed = time.perf_counter() - t0
+    total = sum(r["pedidos"] for r in results.values())
+    for unit, result in results.items():
+        print(f"unidade {unit}: {result['pedidos']} pedido(s) em {result['segundos']}s" + (f" - {result['erro']}" if result["erro"] else ""))
+    print(f"{total} pedido(s) em {elapsed:.1f}s ({total / elapsed:.0f}/s), {collector.retries} nova(s) tentativa(s)")
+
+
+if __name__ == "__main__":
+    _main()
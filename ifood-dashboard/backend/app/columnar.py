@@ -0,0 +1,383 @@
+"""In-process columnar snapshot of recent orders for the hour/weekday breakdowns.
+
+`orders-heatmap`, `weekly-orders`, `daily-accept-time-by-hour` and
+`daily-cancellations-by-hour` group raw `pedidos` by hour, weekday or ISO
+week on every call. With `COLUMNAR_ENABLED=1` each worker keeps the last
+`COLUMNAR_DAYS` days of orders as NumPy arrays (unit id, status and reason
+as integer codes, `data_pedido` as epoch microseconds, accept time in
+minutes) and answers those routes with vectorized group-bys. Requests whose
+range starts before the window run their SQL as before.
+
+Before answering, the snapshot reads the last `pedidos.updated_at` and the
+number of rows at it (index `ix_pedidos_updated_at`, migration m0009); when
+either moved, only the rows changed since the previous mark are read and
+merged by id. Deleted orders, and updates hidden behind an older
+`updated_at` (a long Postgres transaction), are picked up by the full
+rebuild every `COLUMNAR_REBUILD_MINUTES`. `COLUMNAR_MAX_MB` bounds the
+arrays: when the window does not fit, its oldest days are dropped and those
+ranges go to SQL. A new cache generation (`app.cache`, published e.g. by
+the text repair backfill, which keeps `updated_at`) discards the snapshot.
+
+NumPy is an optional dependency; without it the engine stays off.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import String, func, select, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import result_cache
+from .database import ReadSession, Table
+from .queries import CANCELADO, SEM_MOTIVO, Filtros
+from .singleflight import singleflight
+
+try:  # dependência opcional
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_ENABLED = os.getenv("COLUMNAR_ENABLED", "0") in ("1", "true", "True")
+COLUMNAR_DAYS = int(os.getenv("COLUMNAR_DAYS", "90"))
+COLUMNAR_MAX_MB = float(os.getenv("COLUMNAR_MAX_MB", "64"))
+COLUMNAR_REBUILD_MINUTES = float(os.getenv("COLUMNAR_REBUILD_MINUTES", "60"))
+
+# id (8) + unidade (4) + data_pedido (8) + minutos até o aceite (4) + status (2) + motivo (2)
+ROW_BYTES = 28
+HOUR_US = 3_600_000_000
+DAY_US = 24 * HOUR_US
+
+p = models.Pedido.__table__
+# Timestamps como texto: no SQLite o NumPy converte direto, sem o parser do SQLAlchemy
+# (Postgres devolve datetime do driver, que o NumPy aceita igual)
+_COLUMNS = (
+    p.c.id,
+    p.c.id_unidade,
+    type_coerce(p.c.data_pedido, String),
+    type_coerce(p.c.data_aceite, String),
+    p.c.status,
+    p.c.motivo_cancelamento,
+)
+
+
+class Codes:
+    """Append-only value <-> int16 code dictionary, shared by consecutive snapshots."""
+
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+        self._codes: Dict[Optional[str], int] = {}
+
+    def encode(self, values: Iterable[Optional[str]], size: int) -> "np.ndarray":
+        out = np.empty(size, dtype=np.int16)
+        for i, value in enumerate(values):
+            code = self._codes.get(value)
+            if code is None:
+                code = self._codes[value] = len(self.values)
+                self.values.append(value)
+            out[i] = code
+        return out
+
+    def code(self, value: Optional[str]) -> int:
+        return self._codes.get(value, -1)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Immutable arrays, one entry per order; a refresh builds a new instance."""
+
+    ids: "np.ndarray"
+    unit: "np.ndarray"  # int32, -1 sem unidade
+    placed: "np.ndarray"  # int64, microssegundos desde 1970 (data_pedido)
+    accept_minutes: "np.ndarray"  # float32, NaN sem aceite
+    status: "np.ndarray"
+    reason: "np.ndarray"  # motivo com o mesmo COALESCE do SQL
+    statuses: Codes
+    reasons: Codes
+    window_start: datetime
+    watermark: Optional[datetime]
+    at_watermark: int
+    built_at: float
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.ids, self.unit, self.placed, self.accept_minutes, self.status, self.reason))
+
+    def select(self, params: Dict[str, Any], start: str, end: str) -> "np.ndarray":
+        """Boolean mask for `start <= data_pedido < end` and the unit filter, as in `app.queries`."""
+        mask = np.ones(len(self), dtype=bool)
+        if start in params:
+            mask &= self.placed >= _epoch_us(params[start])
+        if end in params:
+            mask &= self.placed < _epoch_us(params[end])
+        if "unit_id" in params:
+            mask &= self.unit == params["unit_id"]
+        return mask
+
+
+def _epoch_us(value: datetime) -> int:
+    return int(np.datetime64(value, "us").astype(np.int64))
+
+
+def _hour(placed: "np.ndarray") -> "np.ndarray":
+    return (placed // HOUR_US) % 24
+
+
+def _weekday(placed: "np.ndarray") -> "np.ndarray":
+    # 1970-01-01 foi quinta-feira; 0 = domingo, como EXTRACT(DOW)
+    return (placed // DAY_US + 4) % 7
+
+
+# ---------------------------
+# Agregações (mesmos nomes e formatos das consultas de app/queries.py)
+# ---------------------------
+
+Breakdown = Callable[[Snapshot, Dict[str, Any]], Any]
+BREAKDOWNS: Dict[str, Breakdown] = {}
+
+
+def breakdown(name: str) -> Callable[[Breakdown], Breakdown]:
+    def register(fn: Breakdown) -> Breakdown:
+        BREAKDOWNS[name] = fn
+        return fn
+
+    return register
+
+
+@breakdown("insights/orders-heatmap")
+def orders_heatmap(s: Snapshot, params: Dict[str, Any]) -> Table:
+    placed = s.placed[s.select(params, "start", "end")]
+    counts = np.bincount(_weekday(placed) * 24 + _hour(placed), minlength=7 * 24)
+    return Table(["dow", "hora", "qtd"], [(int(k // 24), int(k % 24), int(counts[k])) for k in np.flatnonzero(counts)])
+
+
+@breakdown("metrics/weekly-orders")
+def weekly_orders(s: Snapshot, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # weekly-orders não filtra por unidade
+    days = s.placed[s.select({k: v for k, v in params.items() if k != "unit_id"}, "start", "end")] // DAY_US
+    # Semana ISO: a quinta-feira da semana define o ano e o número
+    thursday = days - (days + 3) % 7 + 3
+    year = thursday.astype("datetime64[D]").astype("datetime64[Y]")
+    week = (thursday - year.astype("datetime64[D]").astype(np.int64)) // 7 + 1
+    keys, counts = np.unique((year.astype(np.int64) + 1970) * 100 + week, return_counts=True)
+    return [{"semana": f"{k // 100}-{k % 100:02d}", "total_pedidos": int(n)} for k, n in zip(keys.tolist(), counts.tolist())]
+
+
+@breakdown("metrics/daily-accept-time-by-hour")
+def daily_accept_time_by_hour(s: Snapshot, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    mask = s.select(params, "day_start", "day_end") & ~np.isnan(s.accept_minutes)
+    hours = _hour(s.placed[mask])
+    totals = np.bincount(hours, weights=s.accept_minutes[mask].astype(np.float64), minlength=24)
+    counts = np.bincount(hours, minlength=24)
+    return [{"hora": int(h), "tempo_medio": float(totals[h] / counts[h])} for h in np.flatnonzero(counts)]
+
+
+@breakdown("metrics/daily-cancellations-by-hour")
+def daily_cancellations_by_hour(s: Snapshot, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    mask = s.select(params, "day_start", "day_end") & (s.status == s.statuses.code(CANCELADO))
+    width = max(len(s.reasons.values), 1)
+    keys, counts = np.unique(_hour(s.placed[mask]) * width + s.reason[mask], return_counts=True)
+    rows = [
+        {"hora": int(k // width), "motivo": s.reasons.values[k % width], "qtd": int(n)}
+        for k, n in zip(keys.tolist(), counts.tolist())
+    ]
+    return sorted(rows, key=lambda r: (r["hora"], r["motivo"]))
+
+
+# ---------------------------
+# Snapshot
+# ---------------------------
+
+class ColumnarEngine:
+    def __init__(
+        self,
+        enabled: bool = COLUMNAR_ENABLED,
+        days: int = COLUMNAR_DAYS,
+        max_mb: float = COLUMNAR_MAX_MB,
+        rebuild_minutes: float = COLUMNAR_REBUILD_MINUTES,
+    ):
+        if enabled and np is None:
+            logger.warning("COLUMNAR_ENABLED sem numpy instalado: consultas continuam no banco")
+        self.enabled = enabled and np is not None
+        self.days = days
+        self.max_rows = int(max_mb * 2**20) // ROW_BYTES
+        self.rebuild_seconds = rebuild_minutes * 60
+        self.answered = 0
+        self.fallbacks = 0
+        self.builds = 0
+        self.refreshes = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot(self) -> Optional[Snapshot]:
+        return self._snapshot
+
+    def window_start(self, today: Optional[date] = None) -> datetime:
+        return datetime.combine((today or date.today()) - timedelta(days=self.days), datetime.min.time())
+
+    async def run(self, db: ReadSession, name: str, f: Filtros) -> Optional[Any]:
+        """Answer the registered breakdown `name` from the snapshot; None when the caller must run the SQL."""
+        if not self.enabled or name not in BREAKDOWNS:
+            return None
+        params = f.params()
+        lower = params.get("start", params.get("day_start"))
+        if not self._covers(lower, self._snapshot):
+            self.fallbacks += 1
+            return None
+        snapshot = await singleflight.do(("columnar-refresh", id(self)), lambda: self._refresh_async(db))
+        if not self._covers(lower, snapshot):
+            self.fallbacks += 1
+            return None
+        self.answered += 1
+        return await run_in_threadpool(BREAKDOWNS[name], snapshot, params)
+
+    def _covers(self, lower: Optional[datetime], snapshot: Optional[Snapshot]) -> bool:
+        # Sem início (histórico inteiro) ou com fuso: fica com o SQL
+        if lower is None or lower.tzinfo is not None:
+            return False
+        return lower >= (snapshot.window_start if snapshot is not None else self.window_start())
+
+    async def _refresh_async(self, db: ReadSession) -> Snapshot:
+        if isinstance(db, AsyncSession):
+            return await db.run_sync(self.refresh)
+        return await run_in_threadpool(self.refresh, db)
+
+    def refresh(self, db: Session) -> Snapshot:
+        """Bring the snapshot up to date with `pedidos` (building it when due) and return it."""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.monotonic() - snapshot.built_at >= self.rebuild_seconds:
+                snapshot = self._build(db)
+            else:
+                snapshot = self._apply_changes(db, snapshot)
+                if len(snapshot) > self.max_rows:
+                    snapshot = self._build(db)
+            self._snapshot = snapshot
+            return snapshot
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshot = None
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "answered": self.answered,
+            "fallbacks": self.fallbacks,
+            "builds": self.builds,
+            "refreshes": self.refreshes,
+            "rows": len(snapshot) if snapshot is not None else 0,
+            "bytes": snapshot.nbytes if snapshot is not None else 0,
+        }
+
+    def _mark(self, db: Session) -> Tuple[Optional[datetime], int]:
+        # O SQLite grava updated_at com resolução de segundos: conta também quantas linhas estão na marca.
+        # A contagem compara com o valor gravado (subconsulta), não com o datetime devolvido pelo driver
+        last = select(func.max(p.c.updated_at)).scalar_subquery()
+        at_last = select(func.count()).where(p.c.updated_at >= last).scalar_subquery()
+        watermark, at_watermark = db.execute(select(last, at_last)).one()
+        return watermark, at_watermark if watermark is not None else 0
+
+    def _build(self, db: Session) -> Snapshot:
+        t0 = time.perf_counter()
+        watermark, at_watermark = self._mark(db)
+        window_start = self.window_start()
+        rows = db.execute(
+            select(*_COLUMNS).where(p.c.data_pedido >= window_start).order_by(p.c.data_pedido.desc()).limit(self.max_rows + 1)
+        ).all()
+        statuses, reasons = Codes(), Codes()
+        arrays = _arrays(rows, statuses, reasons)
+        if len(rows) > self.max_rows:
+            # Não cabe no orçamento: a janela começa no primeiro dia completo que coube
+            window_start = _EPOCH + timedelta(days=int(arrays["placed"][-1] // DAY_US) + 1)
+            arrays = _take(arrays, arrays["placed"] >= _epoch_us(window_start))
+            logger.warning("columnar: janela reduzida para %s por COLUMNAR_MAX_MB", window_start.date())
+        snapshot = Snapshot(
+            **arrays,
+            statuses=statuses,
+            reasons=reasons,
+            window_start=window_start,
+            watermark=watermark,
+            at_watermark=at_watermark,
+            built_at=time.monotonic(),
+        )
+        self.builds += 1
+        logger.info(
+            "columnar: %d pedido(s) desde %s, %.1f MB em %.2fs",
+            len(snapshot), window_start.date(), snapshot.nbytes / 2**20, time.perf_counter() - t0,
+        )
+        return snapshot
+
+    def _apply_changes(self, db: Session, snapshot: Snapshot) -> Snapshot:
+        watermark, at_watermark = self._mark(db)
+        if watermark == snapshot.watermark and at_watermark == snapshot.at_watermark:
+            return snapshot
+        # Relê desde um segundo antes da marca anterior (escritas no mesmo segundo, texto
+        # "HH:MM:SS" contra "HH:MM:SS.ffffff" no SQLite); a troca por id é idempotente
+        query = select(*_COLUMNS)
+        if snapshot.watermark is not None:
+            query = query.where(p.c.updated_at >= snapshot.watermark - timedelta(seconds=1))
+        changed = _arrays(db.execute(query).all(), snapshot.statuses, snapshot.reasons)
+        kept = _take(_fields(snapshot), ~np.isin(snapshot.ids, changed["ids"]))
+        # Pedidos movidos para antes da janela (ou sem data) saem do snapshot
+        fresh = _take(changed, changed["placed"] >= _epoch_us(snapshot.window_start))
+        self.refreshes += 1
+        return replace(
+            snapshot,
+            **{name: np.concatenate([kept[name], fresh[name]]) for name in _FIELDS},
+            watermark=watermark,
+            at_watermark=at_watermark,
+        )
+
+
+_FIELDS = ("ids", "unit", "placed", "accept_minutes", "status", "reason")
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _fields(snapshot: Snapshot) -> Dict[str, "np.ndarray"]:
+    return {name: getattr(snapshot, name) for name in _FIELDS}
+
+
+def _take(arrays: Dict[str, "np.ndarray"], mask: "np.ndarray") -> Dict[str, "np.ndarray"]:
+    return {name: values[mask] for name, values in arrays.items()}
+
+
+def _arrays(rows: List[Any], statuses: Codes, reasons: Codes) -> Dict[str, "np.ndarray"]:
+    n = len(rows)
+    ids, units, placed, accepted, status, reason = zip(*rows) if rows else ((),) * 6
+    placed = np.array(placed, dtype="datetime64[us]")
+    accepted = np.array(accepted, dtype="datetime64[us]")
+    minutes = (accepted - placed).astype(np.int64) / 60e6
+    minutes[np.isnat(accepted)] = np.nan
+    placed = placed.astype(np.int64)
+    # Sem data vira o menor int64: fica fora de qualquer intervalo
+    return {
+        "ids": np.array(ids, dtype=np.int64),
+        "unit": np.fromiter((-1 if u is None else u for u in units), dtype=np.int32, count=n),
+        "placed": placed,
+        "accept_minutes": minutes.astype(np.float32),
+        "status": statuses.encode(status, n),
+        "reason": reasons.encode((SEM_MOTIVO if r is None else r for r in reason), n),
+    }
+
+
+engine = ColumnarEngine()
+
+
+def _discard_snapshot() -> None:
+    engine.clear()
+
+
+result_cache.on_generation_change(_discard_snapshot)
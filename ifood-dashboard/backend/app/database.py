@@ -1,21 +1,75 @@
+import asyncio
 import os
 from dotenv import load_dotenv
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import SingletonThreadPool, StaticPool
+from starlette.concurrency import run_in_threadpool
+
+from .instrumentation import instrument_engine, observe_rows
+from .singleflight import query_key, singleflight
 
 # Carrega variáveis do .env (para execuções fora do Docker Compose)
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ifood.db")
 
+
+
+def pool_options(url: str) -> Dict[str, Any]:
+    """Pool settings from the environment; SQLite keeps SQLAlchemy's defaults."""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "-1")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") in ("1", "true", "True"),
+    }
+
+
 connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+engine = create_engine(DATABASE_URL, connect_args=connect_args, **pool_options(DATABASE_URL))
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# DB_ASYNC=1 troca as rotas de leitura para um engine assíncrono
+# (asyncpg no Postgres, aiosqlite no SQLite); o padrão continua síncrono.
+DB_ASYNC = os.getenv("DB_ASYNC", "0") in ("1", "true", "True")
+
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto the matching async driver."""
+    scheme, sep, rest = url.partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+def make_async_engine(url: str = DATABASE_URL) -> AsyncEngine:
+    new_engine = create_async_engine(async_url(url), **pool_options(url))
+    instrument_engine(new_engine.sync_engine, name="async")
+    return new_engine
+
+
+async_engine: Optional[AsyncEngine] = make_async_engine() if DB_ASYNC else None
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False) if async_engine is not None else None
+
+# Sessão de leitura: síncrona (via threadpool) ou assíncrona, conforme DB_ASYNC
+ReadSession = Union[Session, AsyncSession]
+SqlQuery = Tuple[str, Optional[Dict[str, Any]]]
+
 
 def fetch_all(db: Session, sql: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """Execute raw SQL and return a list of dictionaries.
@@ -27,6 +81,7 @@ def fetch_all(db: Session, sql: str, params: Optional[Dict[str, Any]] = None) ->
     rows: List[Dict[str, Any]] = []
     for row in result.fetchall():
         rows.append(dict(row._mapping))
+    observe_rows(sql, len(rows))
     return rows
 
 
@@ -35,3 +90,98 @@ def fetch_one(db: Session, sql: str, params: Optional[Dict[str, Any]] = None) ->
     result = db.execute(text(sql), params or {})
     row = result.fetchone()
     return dict(row._mapping) if row else None
+
+
+def _copy_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [dict(row) for row in rows]
+
+
+async def fetch_all_async(db: ReadSession, sql: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """`fetch_all` for async routes.
+
+    An `AsyncSession` is awaited directly; a sync `Session` runs in the
+    threadpool so the event loop is never blocked. Identical queries that
+    are already running are not executed again: the caller waits for the
+    running one and gets a copy of its rows (see `app.singleflight`).
+    """
+    return await singleflight.do(query_key(sql, params), lambda: _fetch_all_async(db, sql, params), _copy_rows)
+
+
+async def _fetch_all_async(db: ReadSession, sql: str, params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if isinstance(db, AsyncSession):
+        result = await db.execute(text(sql), params or {})
+        rows = [dict(row._mapping) for row in result.fetchall()]
+        observe_rows(sql, len(rows))
+        return rows
+    return await run_in_threadpool(fetch_all, db, sql, params)
+
+
+class Table(NamedTuple):
+    """Query result as column names plus the raw row tuples, without per-row dicts."""
+
+    columns: List[str]
+    rows: List[Tuple[Any, ...]]
+
+
+def fetch_table(db: Session, sql: str, params: Optional[Dict[str, Any]] = None) -> Table:
+    result = db.execute(text(sql), params or {})
+    rows = [tuple(row) for row in result.fetchall()]
+    observe_rows(sql, len(rows))
+    return Table(list(result.keys()), rows)
+
+
+async def fetch_table_async(db: ReadSession, sql: str, params: Optional[Dict[str, Any]] = None) -> Table:
+    """`fetch_all_async` returning a `Table`; rows are tuples, so waiters share them as is."""
+    return await singleflight.do(("table",) + query_key(sql, params), lambda: _fetch_table_async(db, sql, params))
+
+
+async def _fetch_table_async(db: ReadSession, sql: str, params: Optional[Dict[str, Any]]) -> Table:
+    if isinstance(db, AsyncSession):
+        result = await db.execute(text(sql), params or {})
+        rows = [tuple(row) for row in result.fetchall()]
+        observe_rows(sql, len(rows))
+        return Table(list(result.keys()), rows)
+    return await run_in_threadpool(fetch_table, db, sql, params)
+
+
+async def fetch_one_async(db: ReadSession, sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    if isinstance(db, AsyncSession):
+        result = await db.execute(text(sql), params or {})
+        row = result.fetchone()
+        return dict(row._mapping) if row else None
+    return await run_in_threadpool(fetch_one, db, sql, params)
+
+
+async def rollback_async(db: ReadSession) -> None:
+    if isinstance(db, AsyncSession):
+        await db.rollback()
+    else:
+        await run_in_threadpool(db.rollback)
+
+
+def _single_connection(engine: AsyncEngine) -> bool:
+    return isinstance(engine.sync_engine.pool, (StaticPool, SingletonThreadPool))
+
+
+async def fetch_many(db: ReadSession, *queries: SqlQuery) -> List[List[Dict[str, Any]]]:
+    """Run independent queries, concurrently when the driver allows it.
+
+    With an async engine each query gets its own pooled connection and they
+    are awaited together with `asyncio.gather`. Sync sessions (and engines
+    pinned to a single connection, like in-memory SQLite) run them in order.
+    """
+    if isinstance(db, AsyncSession) and not _single_connection(db.bind):
+        engine: AsyncEngine = db.bind
+
+        async def run(sql: str, params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            async with engine.connect() as conn:
+                result = await conn.execute(text(sql), params or {})
+                rows = [dict(row._mapping) for row in result.fetchall()]
+                observe_rows(sql, len(rows))
+                return rows
+
+        async def run_shared(sql: str, params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            return await singleflight.do(query_key(sql, params), lambda: run(sql, params), _copy_rows)
+
+        return list(await asyncio.gather(*(run_shared(sql, params) for sql, params in queries)))
+    return [await fetch_all_async(db, sql, params) for sql, params in queries]
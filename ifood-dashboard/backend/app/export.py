@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+import os
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Result
+from sqlalchemy.orm import Session
+from starlette.types import Receive, Scope, Send
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+RowTransform = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def _json_default(value: Any) -> Any:
+    # Mesmo formato que o jsonable_encoder do FastAPI devolveria
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _iter_csv(columns: Sequence[str], rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row.get(c) for c in columns])
+        if buf.tell() >= 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _iter_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    lines: List[str] = []
+    for row in rows:
+        lines.append(json.dumps(row, default=_json_default, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+class _Release:
+    """Close the export's result and connection once, whichever path gets there first."""
+
+    def __init__(self, result: Result, conn: Connection):
+        self._result = result
+        self._conn = conn
+        self._done = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> None:
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        try:
+            self._result.close()
+        finally:
+            self._conn.close()
+
+
+class _ExportResponse(StreamingResponse):
+    """Streaming response that always releases its connection once it has been sent or has failed.
+
+    The generator's `finally` alone is not enough: a body that never starts
+    (client gone before the first chunk, a middleware failing on the
+    headers) is only finalized by the garbage collector.
+    """
+
+    def __init__(self, content: Iterator[str], release: _Release, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await run_in_threadpool(self._release)
+
+
+def stream_query(
+    db: Session,
+    sql: str,
+    params: Optional[Dict[str, Any]],
+    fmt: str,
+    filename: str,
+    transform: Optional[RowTransform] = None,
+    chunk_size: Optional[int] = None,
+) -> StreamingResponse:
+    """Run `sql` through a server-side cursor and stream it as CSV or NDJSON.
+
+    The statement is executed before the response starts, so SQL errors still
+    surface as regular HTTP errors. Rows are then pulled `chunk_size` at a time
+    on a dedicated connection, keeping memory flat for exports of any size.
+    The request session is not used because FastAPI closes it before the
+    body is streamed; the connection goes back to the pool when the response
+    ends, even if the body was never iterated.
+    """
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"unsupported export format: {fmt}")
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    conn = db.get_bind().connect()
+    try:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(sql), params or {})
+    except Exception:
+        conn.close()
+        raise
+    columns = list(result.keys())
+    release = _Release(result, conn)
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        try:
+            for partition in result.partitions(chunk_size):
+                for row in partition:
+                    item = dict(row._mapping)
+                    yield transform(item) if transform else item
+        finally:
+            release()
+
+    body = _iter_csv(columns, rows()) if fmt == "csv" else _iter_ndjson(rows())
+    return _ExportResponse(
+        body,
+        release,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
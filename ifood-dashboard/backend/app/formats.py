@@ -0,0 +1,106 @@
+"""Response formats for the chart endpoints.
+
+Chart endpoints return a `Table` (column names plus row tuples) and pick
+the representation from the `Accept` header:
+
+- `application/json` (default): the usual list of row objects, encoded by
+  orjson when it is installed instead of going through `jsonable_encoder`;
+- `application/vnd.ifood.columnar+json`: `{"columns": [...], "data": {col: [...]}}`;
+- `application/vnd.apache.arrow.stream`: Arrow IPC stream (needs `pyarrow`).
+
+`Decimal` values are written as numbers, the same way `jsonable_encoder`
+writes them (integers stay integers).
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Sequence
+
+from fastapi import HTTPException, Request, status
+from fastapi.encoders import decimal_encoder
+from fastapi.responses import Response
+
+from .database import Table
+
+try:  # dependências opcionais
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+JSON = "application/json"
+COLUMNAR = "application/vnd.ifood.columnar+json"
+ARROW = "application/vnd.apache.arrow.stream"
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return decimal_encoder(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"not JSON serializable: {type(value)!r}")
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def negotiate(request: Request) -> str:
+    """Best supported media type in the `Accept` header; JSON rows by default."""
+    accept = request.headers.get("accept", "")
+    offered = []
+    for part in accept.split(","):
+        media, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        offered.append((q, media.strip().lower()))
+    for q, media in sorted(offered, key=lambda x: -x[0]):
+        if q > 0 and media in (JSON, COLUMNAR, ARROW):
+            return media
+    return JSON
+
+
+def columnar(table: Table) -> Dict[str, Any]:
+    values: Sequence[Sequence[Any]] = list(zip(*table.rows)) if table.rows else [()] * len(table.columns)
+    return {"columns": table.columns, "data": {c: list(v) for c, v in zip(table.columns, values)}}
+
+
+def records(table: Table) -> List[Dict[str, Any]]:
+    return [dict(zip(table.columns, row)) for row in table.rows]
+
+
+def arrow_ipc(table: Table) -> bytes:
+    if pyarrow is None:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="Arrow output is not available")
+    data = columnar(table)["data"]
+    # O Arrow não infere tipo de Decimal misturado com int; converte para float
+    for column, values in data.items():
+        if any(isinstance(v, Decimal) for v in values):
+            data[column] = [float(v) if v is not None else None for v in values]
+    sink = pyarrow.BufferOutputStream()
+    batch = pyarrow.table(data)
+    with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_table(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def render(table: Table, media_type: str) -> Response:
+    """Serialize `table` as `media_type` (see `negotiate`)."""
+    headers = {"Vary": "Accept"}
+    if media_type == ARROW:
+        return Response(arrow_ipc(table), media_type=ARROW, headers=headers)
+    if media_type == COLUMNAR:
+        return Response(dumps(columnar(table)), media_type=COLUMNAR, headers=headers)
+    return Response(dumps(records(table)), media_type=JSON, headers=headers)
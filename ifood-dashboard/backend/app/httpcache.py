@@ -0,0 +1,157 @@
+"""HTTP caching for the analytics routes: ETags, 304s and compression.
+
+Every `/metrics`, `/insights` and `/dashboard` response carries a weak ETag
+built from the request (route, filters, unit, `Accept`) and a data
+watermark: order count and last `updated_at` in the unit/period, plus the
+last update of the rollup rows (and of `clientes_primeiro_pedido` for the
+cohorts), see the `watermark` queries in `app.queries`. The watermark is
+an index-only range count (migration m0007), read before the aggregate; when `If-None-Match`
+matches, the route answers `304 Not Modified` without running it. A result
+served from `result_cache` reuses the ETag stored with it.
+
+Closed periods (ending before today) get `Cache-Control: private,
+max-age=HTTP_CACHE_MAX_AGE`; the others `private, no-cache`, so the browser
+always revalidates but a 304 is all it downloads.
+
+`CompressionMiddleware` compresses responses above `COMPRESSION_MIN_SIZE`
+bytes with brotli (optional `brotli` package) or gzip, per `Accept-Encoding`.
+"""
+import hashlib
+import os
+from contextvars import ContextVar
+from datetime import date
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi import Request
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:  # dependência opcional
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+HTTP_ETAG_ENABLED = os.getenv("HTTP_ETAG_ENABLED", "1") not in ("0", "false", "False")
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "900"))
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+current_request: ContextVar[Optional[Request]] = ContextVar("current_request", default=None)
+
+_STATE_KEY = "http_cache_headers"
+
+
+class NotModified(Exception):
+    """The client's copy is current; answered with a bodiless 304."""
+
+    def __init__(self, headers: Dict[str, str]):
+        super().__init__("not modified")
+        self.headers = headers
+
+
+async def bind_request(request: Request) -> None:
+    """App-wide dependency: exposes the request to `_cached` in `main.py`."""
+    current_request.set(request)
+
+
+def version(key: str, watermark: Optional[Dict[str, Any]]) -> str:
+    """Data version of a cached result: its cache key plus the watermark read before computing it."""
+    marks = "|".join(f"{k}={v}" for k, v in sorted((watermark or {}).items()))
+    return hashlib.sha1(f"{key}|{marks}".encode()).hexdigest()
+
+
+def etag(request: Request, data_version: str) -> str:
+    # O formato (Accept) muda o corpo; a codificação não: ETag fraca
+    raw = f"{data_version}|{request.headers.get('accept', '')}"
+    return 'W/"' + hashlib.sha1(raw.encode()).hexdigest()[:32] + '"'
+
+
+def cache_control(end: Optional[date], today: Optional[date] = None) -> str:
+    if end is not None and end < (today or date.today()):
+        return f"private, max-age={HTTP_CACHE_MAX_AGE}"
+    return "private, no-cache"
+
+
+def _matches(if_none_match: str, tag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Comparação fraca (RFC 9110): ignora o prefixo W/
+    opaque = tag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == opaque for t in if_none_match.split(","))
+
+
+def check(request: Request, tag: str, end: Optional[date]) -> None:
+    """Raise NotModified when `If-None-Match` has `tag`, else schedule the headers for the response."""
+    headers = {"ETag": tag, "Cache-Control": cache_control(end)}
+    if _matches(request.headers.get("if-none-match", ""), tag):
+        raise NotModified(headers)
+    setattr(request.state, _STATE_KEY, headers)
+
+
+class CacheHeadersMiddleware:
+    """Adds the headers scheduled by `check` to the response (including `Response` objects)."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                extra = scope.get("state", {}).get(_STATE_KEY)
+                if extra:
+                    headers = MutableHeaders(raw=message["headers"])
+                    for name, value in extra.items():
+                        headers[name] = value
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int = BROTLI_QUALITY):
+        super().__init__(app, minimum_size)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        out = self._compressor.process(body)
+        return out + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+def _accepted(accept_encoding: str) -> Iterable[str]:
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            yield coding.strip().lower()
+
+
+class CompressionMiddleware:
+    """gzip/brotli above `minimum_size`; brotli wins when both are accepted."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accepted = set(_accepted(Headers(scope=scope).get("accept-encoding", "")))
+        if brotli is not None and "br" in accepted:
+            responder = BrotliResponder(self.app, self.minimum_size)
+        elif "gzip" in accepted:
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=GZIP_LEVEL)
+        else:
+            await self.app(scope, receive, send)
+            return
+        await responder(scope, receive, send)
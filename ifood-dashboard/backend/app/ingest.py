@@ -0,0 +1,415 @@
+"""Bulk ingestion of orders with their items and feedback.
+
+`POST /ingest/pedidos` takes a JSON array or NDJSON (one order per line).
+Rows are validated together, then written in batches of `INGEST_BATCH_SIZE`
+orders, each batch in its own transaction. `id_externo` (the order id on the
+source platform) is the idempotency key: sending an order again updates it
+and replaces its items and feedback instead of duplicating it.
+
+On Postgres with psycopg2 a batch is `COPY`-ed into a temporary staging
+table and merged with `INSERT ... SELECT ... ON CONFLICT`; elsewhere (SQLite,
+other drivers) the upsert runs as one `executemany`. Rows written here bump
+`pedidos.updated_at`, so the rollup and first-order jobs pick them up, and
+the result cache of the touched unit/days is invalidated on commit.
+"""
+import io
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from typing_extensions import Annotated, NotRequired, TypedDict
+
+from pydantic import AfterValidator, Field, TypeAdapter, ValidationError
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import models, textfix
+from .cache import mark_orders_changed
+
+try:  # dependência opcional
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+# Erros de validação devolvidos na resposta (o total sempre vem em `rejeitados`)
+MAX_REPORTED_ERRORS = 100
+
+NDJSON = "application/x-ndjson"
+
+Pedido = models.Pedido
+
+
+class InvalidPayload(ValueError):
+    """The body is not a JSON array of objects nor NDJSON."""
+
+
+# Texto livre gravado já corrigido (ver app/textfix.py)
+CleanText = Annotated[str, AfterValidator(textfix.normalize)]
+
+
+# TypedDicts em vez de BaseModel: validar o lote sem instanciar um objeto por
+# pedido/item custa metade do tempo
+class ItemIn(TypedDict):
+    id_produto: int
+    quantidade: NotRequired[Annotated[int, Field(ge=1)]]
+    preco_unitario: NotRequired[Annotated[Decimal, Field(ge=0)]]
+
+
+class FeedbackIn(TypedDict):
+    nota: NotRequired[Optional[Annotated[int, Field(ge=1, le=5)]]]
+    tipo_feedback: NotRequired[Optional[str]]
+    comentario: NotRequired[Optional[CleanText]]
+
+
+class PedidoIn(TypedDict):
+    id_externo: Annotated[str, Field(min_length=1, max_length=64)]
+    id_unidade: int
+    id_cliente: NotRequired[Optional[int]]
+    id_regiao_entrega: NotRequired[Optional[int]]
+    data_pedido: datetime
+    status: str
+    # Sem valor informado, soma dos itens
+    valor_total: NotRequired[Optional[Annotated[Decimal, Field(ge=0)]]]
+    motivo_cancelamento: NotRequired[Optional[CleanText]]
+    origem_cancelamento: NotRequired[Optional[str]]
+    data_aceite: NotRequired[Optional[datetime]]
+    data_saida_entrega: NotRequired[Optional[datetime]]
+    data_entrega: NotRequired[Optional[datetime]]
+    itens: NotRequired[List[ItemIn]]
+    feedback: NotRequired[Optional[FeedbackIn]]
+
+
+_PEDIDO = TypeAdapter(PedidoIn)
+_PEDIDOS = TypeAdapter(List[PedidoIn])
+_ORDER_COLUMNS = [
+    "id_externo", "id_cliente", "id_unidade", "id_regiao_entrega", "data_pedido", "status", "valor_total",
+    "motivo_cancelamento", "origem_cancelamento", "data_aceite", "data_saida_entrega", "data_entrega",
+]
+_ITEM_COLUMNS = ["id_pedido", "id_produto", "quantidade", "preco_unitario"]
+_FEEDBACK_COLUMNS = ["id_pedido", "nota", "tipo_feedback", "comentario"]
+
+
+def _as_array(body: bytes, content_type: Optional[str]) -> bytes:
+    if (content_type or "").split(";")[0].strip() == NDJSON:
+        return b"[" + b",".join(line for line in body.splitlines() if line.strip()) + b"]"
+    return body
+
+
+def _error(index: int, message: str) -> Dict[str, Any]:
+    return {"indice": index, "erro": message}
+
+
+def _validate_rows(rows: Sequence[Any]) -> Tuple[List[Optional[PedidoIn]], List[Dict[str, Any]]]:
+    # Só no caso com erro vale validar linha a linha para apontar quais
+    parsed: List[Optional[PedidoIn]] = []
+    errors = []
+    for i, row in enumerate(rows):
+        try:
+            parsed.append(_PEDIDO.validate_python(row))
+        except ValidationError as exc:
+            first = exc.errors()[0]
+            errors.append(_error(i, f"{'.'.join(map(str, first['loc']))}: {first['msg']}"))
+            parsed.append(None)
+    return parsed, errors
+
+
+def parse_payload(body: bytes, content_type: Optional[str]) -> Tuple[List[Optional[PedidoIn]], List[Dict[str, Any]]]:
+    """Decode and validate a JSON array or NDJSON body.
+
+    Returns one entry per received row (None where it was rejected) and the
+    validation errors. The whole body is validated in one pass straight from
+    the bytes; only when that fails is it decoded again to locate the bad rows.
+    """
+    data = _as_array(body, content_type)
+    try:
+        return list(_PEDIDOS.validate_json(data)), []
+    except ValidationError:
+        pass
+    loads = orjson.loads if orjson is not None else json.loads
+    try:
+        rows = loads(data)
+    except ValueError as exc:
+        raise InvalidPayload(f"invalid JSON: {exc}") from None
+    if not isinstance(rows, list):
+        raise InvalidPayload("expected a JSON array of orders or NDJSON")
+    return _validate_rows(rows)
+
+
+def validate(
+    db: Session,
+    rows: Sequence[Any],
+    unit_id: Optional[int] = None,
+) -> Tuple[List[PedidoIn], List[Dict[str, Any]]]:
+    """Validate rows given as Python objects; see `check` for what is returned."""
+    try:
+        parsed: List[Optional[PedidoIn]] = list(_PEDIDOS.validate_python(rows))
+        errors: List[Dict[str, Any]] = []
+    except ValidationError:
+        parsed, errors = _validate_rows(rows)
+    return check(db, parsed, errors, unit_id)
+
+
+def check(
+    db: Session,
+    parsed: Sequence[Optional[PedidoIn]],
+    errors: List[Dict[str, Any]],
+    unit_id: Optional[int] = None,
+) -> Tuple[List[PedidoIn], List[Dict[str, Any]]]:
+    """Keep the orders that can be written; return them and one error per rejected row.
+
+    Orders must reference existing units and products and, when `unit_id` is
+    given (user bound to a unit), belong to it, both as sent and as already
+    stored under the same `id_externo`: the upsert would otherwise move
+    another unit's order and replace its items. A repeated `id_externo`
+    keeps the last occurrence, as a later upsert would.
+    """
+    errors = list(errors)
+    units = set(db.execute(select(models.Unidade.id)).scalars())
+    products = set(db.execute(select(models.Produto.id)).scalars())
+    stored = _stored_units(db, [p["id_externo"] for p in parsed if p is not None]) if unit_id is not None else {}
+    latest: Dict[str, Tuple[int, PedidoIn]] = {}
+    for i, pedido in enumerate(parsed):
+        if pedido is None:
+            continue
+        if unit_id is not None and pedido["id_unidade"] != unit_id:
+            errors.append(_error(i, "id_unidade: outside the user's unit"))
+        elif stored.get(pedido["id_externo"], unit_id) != unit_id:
+            errors.append(_error(i, "id_externo: order belongs to another unit"))
+        elif pedido["id_unidade"] not in units:
+            errors.append(_error(i, f"id_unidade: unknown unit {pedido['id_unidade']}"))
+        elif any(item["id_produto"] not in products for item in pedido.get("itens", ())):
+            errors.append(_error(i, "itens.id_produto: unknown product"))
+        else:
+            latest[pedido["id_externo"]] = (i, pedido)
+    valid = [pedido for _, pedido in sorted(latest.values(), key=lambda entry: entry[0])]
+    errors.sort(key=lambda e: e["indice"])
+    return valid, errors
+
+
+def _stored_units(db: Session, keys: List[str]) -> Dict[str, Optional[int]]:
+    """`id_externo` -> `id_unidade` of the orders already stored, in chunks (SQLite bind limit)."""
+    keys = list(dict.fromkeys(keys))
+    out: Dict[str, Optional[int]] = {}
+    for start in range(0, len(keys), 500):
+        chunk = keys[start : start + 500]
+        out.update(db.execute(select(Pedido.id_externo, Pedido.id_unidade).where(Pedido.id_externo.in_(chunk))).all())
+    return out
+
+
+def _naive(value: Optional[datetime]) -> Optional[datetime]:
+    # As colunas são sem fuso: guarda a hora local informada pela origem
+    return value.replace(tzinfo=None) if value is not None and value.tzinfo is not None else value
+
+
+def _order_row(p: PedidoIn) -> Tuple[Any, ...]:
+    """Values of `_ORDER_COLUMNS`, in order."""
+    valor = p.get("valor_total")
+    if valor is None:
+        valor = sum((_quantidade(i) * _preco(i) for i in p.get("itens", ())), Decimal(0))
+    return (
+        p["id_externo"], p.get("id_cliente"), p["id_unidade"], p.get("id_regiao_entrega"),
+        _naive(p["data_pedido"]), p["status"], valor, p.get("motivo_cancelamento"), p.get("origem_cancelamento"),
+        _naive(p.get("data_aceite")), _naive(p.get("data_saida_entrega")), _naive(p.get("data_entrega")),
+    )
+
+
+def _quantidade(item: ItemIn) -> int:
+    return item.get("quantidade", 1)
+
+
+def _preco(item: ItemIn) -> Decimal:
+    return item.get("preco_unitario", Decimal(0))
+
+
+def _copy_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    text = value.isoformat() if isinstance(value, (date, datetime)) else str(value)
+    return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy(db: Session, table: str, columns: List[str], rows: Iterable[Tuple[Any, ...]]) -> None:
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(map(_copy_value, row)))
+        buf.write("\n")
+    buf.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+    finally:
+        cursor.close()
+
+
+def _sqlite_rows(rows: List[Tuple[Any, ...]], columns: List[str]) -> List[Tuple[Any, ...]]:
+    # Mesmo formato gravado pelos tipos DateTime/Numeric do SQLAlchemy no SQLite;
+    # conversão só nas colunas que precisam, sem checar tipo valor a valor
+    datetimes = [i for i, c in enumerate(columns) if c.startswith("data_")]
+    numerics = [i for i, c in enumerate(columns) if c in ("valor_total", "preco_unitario")]
+    if not datetimes and not numerics:
+        return rows
+    out = []
+    for row in rows:
+        row = list(row)
+        for i in datetimes:
+            if row[i] is not None:
+                row[i] = row[i].isoformat(" ", "microseconds")
+        for i in numerics:
+            if row[i] is not None:
+                row[i] = float(row[i])
+        out.append(tuple(row))
+    return out
+
+
+def _write_mode(db: Session) -> str:
+    dialect = db.get_bind().dialect
+    if dialect.name == "postgresql" and dialect.driver == "psycopg2":
+        return "copy"
+    if dialect.name == "sqlite":
+        return "executemany"
+    if dialect.name == "postgresql":
+        return "core"
+    raise RuntimeError(f"ingestion not supported on {dialect.name}")
+
+
+def _upsert_orders(db: Session, mode: str, rows: List[Tuple[Any, ...]]) -> None:
+    columns = ", ".join(_ORDER_COLUMNS)
+    updates = [c for c in _ORDER_COLUMNS if c != "id_externo"]
+    assignments = ", ".join(f"{c} = excluded.{c}" for c in updates)
+    conn = db.connection()
+    if mode == "copy":
+        # Staging só com as colunas recebidas e sem restrições; esvazia no commit do lote
+        conn.exec_driver_sql(
+            f"CREATE TEMP TABLE IF NOT EXISTS ingest_pedidos ON COMMIT DELETE ROWS "
+            f"AS SELECT {columns} FROM pedidos WITH NO DATA"
+        )
+        _copy(db, "ingest_pedidos", _ORDER_COLUMNS, rows)
+        conn.exec_driver_sql(
+            f"INSERT INTO pedidos ({columns}) SELECT {columns} FROM ingest_pedidos "
+            f"ON CONFLICT (id_externo) DO UPDATE SET {assignments}, updated_at = now()"
+        )
+    elif mode == "executemany":
+        # Direto no driver: sem o processamento de parâmetros por linha do SQLAlchemy
+        marks = ", ".join("?" for _ in _ORDER_COLUMNS)
+        conn.exec_driver_sql(
+            f"INSERT INTO pedidos ({columns}) VALUES ({marks}) "
+            f"ON CONFLICT (id_externo) DO UPDATE SET {assignments}, updated_at = CURRENT_TIMESTAMP",
+            _sqlite_rows(rows, _ORDER_COLUMNS),
+        )
+    else:
+        from sqlalchemy.dialects.postgresql import insert as upsert
+
+        stmt = upsert(Pedido.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id_externo"], set_={**{c: stmt.excluded[c] for c in updates}, "updated_at": func.now()}
+        )
+        db.execute(stmt, [dict(zip(_ORDER_COLUMNS, row)) for row in rows])
+
+
+def _insert_children(db: Session, mode: str, model, columns: List[str], rows: List[Tuple[Any, ...]]) -> None:
+    if not rows:
+        return
+    if mode == "copy":
+        _copy(db, model.__tablename__, columns, rows)
+    elif mode == "executemany":
+        db.connection().exec_driver_sql(
+            f"INSERT INTO {model.__tablename__} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            _sqlite_rows(rows, columns),
+        )
+    else:
+        db.execute(insert(model.__table__), [dict(zip(columns, row)) for row in rows])
+
+
+def _order_day(value: Any) -> Optional[date]:
+    if value is None:
+        return None
+    return value.date() if isinstance(value, datetime) else date.fromisoformat(str(value)[:10])
+
+
+def write_batch(db: Session, batch: List[PedidoIn]) -> Dict[str, Any]:
+    """Upsert one batch of orders and replace their items and feedback; commits."""
+    mode = _write_mode(db)
+    keys = [p["id_externo"] for p in batch]
+    before = {
+        r.id_externo: r
+        for r in db.execute(
+            select(Pedido.id_externo, Pedido.id, Pedido.id_unidade, Pedido.data_pedido).where(Pedido.id_externo.in_(keys))
+        )
+    }
+    rows = [_order_row(p) for p in batch]
+    _upsert_orders(db, mode, rows)
+    ids = dict(db.execute(select(Pedido.id_externo, Pedido.id).where(Pedido.id_externo.in_(keys))).all())
+
+    # Reenvio substitui itens e avaliação do pedido
+    replaced = [r.id for r in before.values()]
+    if replaced:
+        db.execute(delete(models.ItemPedido).where(models.ItemPedido.id_pedido.in_(replaced)))
+        db.execute(delete(models.Feedback).where(models.Feedback.id_pedido.in_(replaced)))
+    itens = [
+        (ids[p["id_externo"]], i["id_produto"], _quantidade(i), _preco(i))
+        for p in batch
+        for i in p.get("itens", ())
+    ]
+    feedbacks = [
+        (ids[p["id_externo"]], f.get("nota"), f.get("tipo_feedback"), f.get("comentario"))
+        for p in batch
+        if (f := p.get("feedback")) is not None
+    ]
+    _insert_children(db, mode, models.ItemPedido, _ITEM_COLUMNS, itens)
+    _insert_children(db, mode, models.Feedback, _FEEDBACK_COLUMNS, feedbacks)
+
+    unidade, data_pedido = _ORDER_COLUMNS.index("id_unidade"), _ORDER_COLUMNS.index("data_pedido")
+    touched = {(r[unidade], _order_day(r[data_pedido])) for r in rows}
+    touched |= {(r.id_unidade, _order_day(r.data_pedido)) for r in before.values()}
+    mark_orders_changed(db, {(u, d) for u, d in touched if d is not None})
+    db.commit()
+    return {
+        "pedidos": len(batch),
+        "novos": len(batch) - len(before),
+        "atualizados": len(before),
+        "itens": len(itens),
+        "feedbacks": len(feedbacks),
+    }
+
+
+def ingest(db: Session, pedidos: List[PedidoIn], batch_size: int = INGEST_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Write validated orders batch by batch; one result per batch.
+
+    A failing batch is rolled back and reported; the following ones still run.
+    """
+    results = []
+    for number, start in enumerate(range(0, len(pedidos), batch_size), start=1):
+        batch = pedidos[start : start + batch_size]
+        t0 = time.perf_counter()
+        try:
+            result = write_batch(db, batch)
+        except Exception as exc:
+            db.rollback()
+            logger.exception("ingestão: lote %d falhou", number)
+            result = {"pedidos": len(batch), "erro": str(getattr(exc, "orig", exc))}
+        result.update(lote=number, ms=round((time.perf_counter() - t0) * 1000, 1))
+        results.append(result)
+    return results
+
+
+def ingest_payload(
+    db: Session, body: bytes, content_type: Optional[str], unit_id: Optional[int] = None
+) -> Dict[str, Any]:
+    """Parse, validate and write a request body; return the ingestion report."""
+    parsed, errors = parse_payload(body, content_type)
+    pedidos, errors = check(db, parsed, errors, unit_id)
+    lotes = ingest(db, pedidos)
+    return {
+        "recebidos": len(parsed),
+        "aceitos": sum(lote["pedidos"] for lote in lotes if "erro" not in lote),
+        "rejeitados": len(errors),
+        "erros": errors[:MAX_REPORTED_ERRORS],
+        "lotes": lotes,
+    }
@@ -0,0 +1,284 @@
+"""SQL instrumentation and the internal Prometheus endpoint.
+
+Engine events time every statement and label it with the HTTP route that
+issued it (`endpoint`) and a query name (`query`). Handlers name their
+queries with `query_name(...)`; anything else is named after its verb and
+first table, e.g. `select pedidos`. Pool checkout waits, pool timeouts and
+pool occupancy are tracked per engine. `registry.render()` produces the
+Prometheus text format served at `/internal/metrics`.
+
+Configuration:
+- SLOW_QUERY_MS: log statements slower than this, with bound parameters
+  (default 500; 0 disables).
+- SLOW_QUERY_EXPLAIN: also log the plan of slow SELECTs (default off).
+"""
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "0") in ("1", "true", "True")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="-")
+current_query: ContextVar[Optional[str]] = ContextVar("current_query", default=None)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels) + "}"
+
+
+def sample(name: str, value: float, **labels: str) -> str:
+    return f"{name}{format_labels(tuple(labels.items()))} {value}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> [contagem por bucket..., soma, total]
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(tuple(sorted(labels.items())))
+        return int(series[-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, total in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', repr(float(bound))),))} {total}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+
+# Coletores produzem linhas já formatadas na hora da leitura (gauges)
+Collector = Callable[[], Iterable[str]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            try:
+                lines += list(collector())
+            except Exception:
+                logger.exception("coletor de métricas falhou")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+QUERY_DURATION = registry.register(
+    Histogram("db_query_duration_seconds", "SQL statement execution time by endpoint and query name")
+)
+QUERY_ROWS = registry.register(Histogram("db_query_rows", "Rows returned by analytics queries", ROW_BUCKETS))
+QUERY_ERRORS = registry.register(Counter("db_query_errors_total", "SQL statements that raised"))
+SLOW_QUERIES = registry.register(Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS"))
+POOL_WAIT = registry.register(Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection"))
+POOL_TIMEOUTS = registry.register(Counter("db_pool_timeouts_total", "Checkouts that gave up waiting for a connection"))
+
+
+@contextmanager
+def query_name(name: str) -> Iterator[None]:
+    """Label the statements executed inside the block with `name`."""
+    token = current_query.set(name)
+    try:
+        yield
+    finally:
+        current_query.reset(token)
+
+
+async def tag_endpoint(request: Request) -> None:
+    """App-wide dependency: records the matched route for the query labels."""
+    route = request.scope.get("route")
+    current_endpoint.set(getattr(route, "path", None) or request.url.path)
+
+
+# Verbo + primeira tabela após FROM/INTO (ou logo após o verbo, como em UPDATE)
+_VERB_TABLE = re.compile(r"^\s*(\w+)\b(?:.*?\b(?:from|into)\s+|\s+)([\w.\"]+)", re.I | re.S)
+
+
+def default_query_name(statement: str) -> str:
+    match = _VERB_TABLE.match(statement)
+    if match is None:
+        return statement.strip().split(None, 1)[0].lower() if statement.strip() else "-"
+    return f"{match.group(1).lower()} {match.group(2).strip(chr(34)).lower()}"
+
+
+def _labels(statement: str) -> Dict[str, str]:
+    return {"endpoint": current_endpoint.get(), "query": current_query.get() or default_query_name(statement)}
+
+
+def observe_rows(statement: str, rows: int) -> None:
+    QUERY_ROWS.observe(rows, **_labels(statement))
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if conn.info.get("explaining"):
+        return
+    labels = _labels(statement)
+    QUERY_DURATION.observe(elapsed, **labels)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(**labels)
+        logger.warning(
+            "consulta lenta (%.0f ms) endpoint=%s query=%s\n%s\nparams=%r",
+            elapsed * 1000, labels["endpoint"], labels["query"], statement.strip(), parameters,
+        )
+        if SLOW_QUERY_EXPLAIN and not executemany:
+            _log_plan(conn, statement, parameters)
+
+
+def _on_error(context) -> None:
+    stack = context.connection.info.get("query_start") if context.connection is not None else None
+    if stack:
+        stack.pop()
+    QUERY_ERRORS.inc(**_labels(context.statement or ""))
+
+
+def _log_plan(conn, statement: str, parameters) -> None:
+    if not statement.lstrip().lower().startswith(("select", "with")):
+        return
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    conn.info["explaining"] = True
+    try:
+        plan = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+        logger.warning("plano:\n%s", "\n".join(" | ".join(str(c) for c in row) for row in plan))
+    except Exception:
+        logger.debug("EXPLAIN falhou", exc_info=True)
+    finally:
+        conn.info.pop("explaining", None)
+
+
+def _time_checkouts(pool, name: str) -> None:
+    # O pool não tem evento "antes do checkout"; mede a espera em volta do _do_get
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        except Exception as exc:
+            if isinstance(exc, PoolTimeout):
+                POOL_TIMEOUTS.inc(engine=name)
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start, engine=name)
+
+    pool._do_get = timed_do_get
+
+
+# Engines instrumentadas: um único coletor, um `# TYPE` por família com uma amostra por engine
+_pools: List[Tuple[str, Engine]] = []
+
+
+def _pool_metrics() -> Iterable[str]:
+    for metric, attr in (
+        ("db_pool_size", "size"),
+        ("db_pool_checked_out", "checkedout"),
+        ("db_pool_overflow", "overflow"),
+        ("db_pool_checked_in", "checkedin"),
+    ):
+        samples = [
+            sample(metric, fn(), engine=name) for name, engine in _pools if (fn := getattr(engine.pool, attr, None)) is not None
+        ]
+        if samples:
+            yield f"# TYPE {metric} gauge"
+            yield from samples
+
+
+registry.add_collector(_pool_metrics)
+
+
+def instrument_engine(engine: Engine, name: str = "default") -> None:
+    """Attach the timing hooks and pool metrics to `engine` (idempotent).
+
+    For an `AsyncEngine`, pass its `sync_engine`.
+    """
+    if event.contains(engine, "before_cursor_execute", _before_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+    event.listen(engine, "handle_error", _on_error)
+    if hasattr(engine.pool, "_do_get"):
+        _time_checkouts(engine.pool, name)
+    _pools.append((name, engine))
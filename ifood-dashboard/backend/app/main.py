@@ -1,47 +1,105 @@
+import hmac
 import os
 from datetime import datetime, timedelta
-import io
-import csv
+from dataclasses import replace
+from typing import Awaitable, Callable, NamedTuple
 import jwt
-import bcrypt
-import httpx
-from fastapi import Depends, FastAPI, HTTPException, status, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, status, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
-from slowapi.util import get_remote_address
 
-from . import models
-from .database import SessionLocal, fetch_all
+from . import clientes, collector, columnar, formats, httpcache, ingest, models, queries, rollup, scheduling, stream
+from .ratelimit import RateLimitExceeded, limiter, retry_after_header
+from .cache import CacheEntryMeta, install_invalidation_hooks, result_cache
+from .database import (
+    AsyncSessionLocal,
+    ReadSession,
+    SessionLocal,
+    Table,
+    fetch_all,
+    fetch_all_async,
+    fetch_many,
+    fetch_one,
+    fetch_one_async,
+    fetch_table_async,
+)
+from .export import stream_query
+from .textfix import install_normalization_hooks
+from .instrumentation import query_name, registry, sample, tag_endpoint
+from .security import HashPoolSaturated, password_hasher
+from .singleflight import SingleFlightTimeout, singleflight
+from .principal import AUTH_EMBED_CLAIMS, Principal, install_user_change_hooks, principal_cache
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from .queries import Filtros, InvalidFilter
+
+
+app = FastAPI(dependencies=[Depends(tag_endpoint), Depends(httpcache.bind_request)])
+app.add_middleware(httpcache.CacheHeadersMiddleware)
+app.add_middleware(httpcache.CompressionMiddleware)
+
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "5/minute")
+RATE_LIMIT_API = os.getenv("RATE_LIMIT_API", "10/minute")
+
+
+@app.exception_handler(RateLimitExceeded)
+async def _rate_limited(request: Request, exc: RateLimitExceeded):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many requests, try again later"},
+        headers={"Retry-After": retry_after_header(exc)},
+    )
 
 
-def _fix_mojibake(s: str) -> str:
-    """Best-effort fix for common UTF-8/Latin-1 mojibake.
+@app.exception_handler(HashPoolSaturated)
+async def _hash_pool_saturated(request: Request, exc: HashPoolSaturated):
+    # Pico de logins: rejeita rápido em vez de enfileirar e travar o restante da API
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Authentication is busy, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(stream.StreamSaturated)
+async def _stream_saturated(request: Request, exc: stream.StreamSaturated):
+    # O EventSource do navegador tenta de novo sozinho
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many open streams, try again shortly"},
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.exception_handler(InvalidFilter)
+async def _invalid_filter(request: Request, exc: InvalidFilter):
+    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(exc)})
 
-    If text contains sequences like 'Ãº' (typical when UTF-8 bytes were
-    misread as Latin-1), try to recover by re-encoding.
-    Kept narrow in scope and only applied where needed.
-    """
-    if not isinstance(s, str):
-        return s
-    if "Ã" in s or "�" in s:
-        try:
-            return s.encode("latin-1").decode("utf-8")
-        except Exception:
-            return s
-    return s
 
-app = FastAPI()
+@app.exception_handler(ingest.InvalidPayload)
+async def _invalid_payload(request: Request, exc: ingest.InvalidPayload):
+    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(exc)})
+
+
+@app.exception_handler(httpcache.NotModified)
+async def _not_modified(request: Request, exc: httpcache.NotModified):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=exc.headers)
+
+
+@app.exception_handler(SingleFlightTimeout)
+async def _singleflight_timeout(request: Request, exc: SingleFlightTimeout):
+    # A consulta compartilhada ainda está rodando; o cliente tenta de novo em seguida
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Query is taking longer than expected, try again shortly"},
+        headers={"Retry-After": "5"},
+    )
 
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 # CORS: quando allow_credentials=True, evite "*" para garantir preflight limpo.
 frontend_origin = os.getenv("FRONTEND_ORIGIN", "http://localhost:3000")
@@ -59,25 +117,96 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 scheduler = AsyncIOScheduler()
-
-
-async def coletar_dados_ifood():
-    """Tarefa fictícia que demonstraria a coleta de dados do iFood."""
-    async with httpx.AsyncClient() as client:
-        # Este é um placeholder; a integração real do iFood requer credenciais
-        await client.get("https://example.com/ifood")
+install_invalidation_hooks()
+install_user_change_hooks()
+install_normalization_hooks()
 
 
 @app.on_event("startup")
 async def schedule_jobs():
-    scheduler.add_job(coletar_dados_ifood, "interval", minutes=30)
-    scheduler.start()
+    # Todo worker agenda, mas só o líder executa (ver app/scheduling.py)
+    # Sem IFOOD_API_URL a coleta não roda (ver app/collector.py)
+    scheduling.add_job(scheduler, "coleta", collector.run_job, collector.COLLECTOR_INTERVAL_MINUTES)
+    scheduling.add_job(scheduler, "rollup", rollup.run_incremental_job, rollup.ROLLUP_INTERVAL_MINUTES)
+    scheduling.add_job(scheduler, "clientes", clientes.run_incremental_job, rollup.ROLLUP_INTERVAL_MINUTES)
+    scheduling.start(scheduler)
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    # Libera o loop atual; um novo startup (ex.: outro TestClient) agenda de novo
+    await scheduling.stop(scheduler)
+    password_hasher.shutdown()
+    await collector.shutdown()
+    await stream.hub.close()
 
 
 @app.get("/healthz")
 def healthz():
     return {"status": "ok"}
 
+
+INTERNAL_METRICS_TOKEN = os.getenv("INTERNAL_METRICS_TOKEN")
+
+
+def _app_metrics():
+    stats = result_cache.stats()
+    yield "# TYPE result_cache_requests_total counter"
+    for outcome, counts in (("hit", stats["hits"]), ("miss", stats["misses"])):
+        for endpoint, total in sorted(counts.items()):
+            yield sample("result_cache_requests_total", total, endpoint=endpoint, outcome=outcome)
+    yield "# TYPE result_cache_invalidations_total counter"
+    yield sample("result_cache_invalidations_total", stats["invalidations"])
+    yield "# TYPE principal_cache_requests_total counter"
+    yield sample("principal_cache_requests_total", principal_cache.hits, outcome="hit")
+    yield sample("principal_cache_requests_total", principal_cache.misses, outcome="miss")
+    flights = singleflight.stats()
+    yield "# TYPE singleflight_executions_total counter"
+    yield sample("singleflight_executions_total", flights["executions"])
+    yield "# TYPE singleflight_coalesced_total counter"
+    yield sample("singleflight_coalesced_total", flights["coalesced"])
+    yield "# TYPE singleflight_timeouts_total counter"
+    yield sample("singleflight_timeouts_total", flights["timeouts"])
+    yield "# TYPE password_hash_rejected_total counter"
+    yield sample("password_hash_rejected_total", password_hasher.rejected)
+    yield "# TYPE rate_limit_requests_total counter"
+    for outcome, counts in (("allowed", limiter.allowed), ("rejected", limiter.rejected)):
+        for name, total in sorted(counts.items()):
+            yield sample("rate_limit_requests_total", total, limit=name, outcome=outcome)
+    columns = columnar.engine.stats()
+    yield "# TYPE columnar_requests_total counter"
+    yield sample("columnar_requests_total", columns["answered"], outcome="answered")
+    yield sample("columnar_requests_total", columns["fallbacks"], outcome="fallback")
+    yield "# TYPE columnar_refreshes_total counter"
+    yield sample("columnar_refreshes_total", columns["builds"], kind="build")
+    yield sample("columnar_refreshes_total", columns["refreshes"], kind="incremental")
+    yield "# TYPE columnar_snapshot_rows gauge"
+    yield sample("columnar_snapshot_rows", columns["rows"])
+    yield "# TYPE columnar_snapshot_bytes gauge"
+    yield sample("columnar_snapshot_bytes", columns["bytes"])
+    streams = stream.hub.stats()
+    yield "# TYPE stream_subscribers gauge"
+    yield sample("stream_subscribers", streams["subscribers"])
+    yield "# TYPE stream_feeds gauge"
+    yield sample("stream_feeds", streams["feeds"])
+    yield "# TYPE stream_polls_total counter"
+    yield sample("stream_polls_total", streams["polls"])
+    yield "# TYPE stream_rejected_total counter"
+    yield sample("stream_rejected_total", streams["rejected"])
+    yield "# TYPE scheduler_leader gauge"
+    yield sample("scheduler_leader", int(scheduling.leader.is_leader))
+
+
+registry.add_collector(_app_metrics)
+
+
+@app.get("/internal/metrics", include_in_schema=False)
+def internal_metrics(authorization: str | None = Header(None)):
+    """Métricas no formato texto do Prometheus (consultas SQL, pool e caches)."""
+    if INTERNAL_METRICS_TOKEN and authorization != f"Bearer {INTERNAL_METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
@@ -99,66 +228,141 @@ def get_db():
     finally:
         db.close()
 
+async def get_read_db(db: Session = Depends(get_db)):
+    """Session for the analytics routes: async when DB_ASYNC is on, else the request session."""
+    if AsyncSessionLocal is None:
+        yield db
+        return
+    async with AsyncSessionLocal() as session:
+        yield session
+
+def _find_user(db: Session, email: str) -> models.Login | None:
+    return db.query(models.Login).filter(models.Login.email == email).first()
+
+
 def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(models.Login).filter(models.Login.email == email).first()
+    user = _find_user(db, email)
+    if not user:
+        return None
+    if not password_hasher.verify(password, user.password_hash):
+        return None
+    if password_hasher.needs_rehash(user.password_hash):
+        user.password_hash = password_hasher.hash(password)
+        db.commit()
+    return user
+
+
+async def authenticate_user_async(db: Session, email: str, password: str):
+    """Versão assíncrona: o bcrypt roda no pool de processos, fora do threadpool."""
+    user = await run_in_threadpool(_find_user, db, email)
     if not user:
         return None
-    if not bcrypt.checkpw(password.encode(), user.password_hash.encode()):
+    if not await password_hasher.verify_async(password, user.password_hash):
         return None
+    if password_hasher.needs_rehash(user.password_hash):
+        # Atualiza o custo do hash de forma transparente; se o pool estiver cheio, fica para o próximo login
+        try:
+            user.password_hash = await password_hasher.hash_async(password)
+            await run_in_threadpool(db.commit)
+        except HashPoolSaturated:
+            pass
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire, "iat": now})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+
+def _token_for(user: models.Login) -> str:
+    claims = Principal.from_user(user).claims() if AUTH_EMBED_CLAIMS else {}
+    return create_access_token({"sub": user.email, **claims})
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    """Resolve o usuário do token, consultando o banco só quando necessário.
+
+    Ordem: cache por token -> claims assinadas (`uid`/`role`/`unit`) -> tabela login.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    email: str = payload.get("sub")
+    if email is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if principal_cache.sync_due():
+        # Mudanças de papel/unidade feitas por outros processos
+        await run_in_threadpool(principal_cache.sync, db)
+    key = principal_cache.key(token, payload)
+    principal = principal_cache.get(key)
+    if principal is not None:
+        return principal
+    if principal_cache.claims_trusted(payload):
+        principal = Principal.from_claims(payload)
+    if principal is None:
         user = db.query(models.Login).filter(models.Login.email == email).first()
         if user is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-        return user
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        principal = Principal.from_user(user)
+    principal_cache.put(key, principal, expires_at=payload.get("exp", 0))
+    return principal
+
+
+def limit_by_address(name: str, rate: str):
+    """Dependency: `rate` per client address, for the routes without a user."""
+
+    async def dependency(request: Request) -> None:
+        await limiter.check_async(name, request.client.host if request.client else "-", rate)
+
+    return Depends(dependency)
+
+
+def limit_by_user(name: str, rate: str):
+    """Dependency: `rate` per authenticated user (the principal is resolved once per request)."""
+
+    async def dependency(current_user: Principal = Depends(get_current_user)) -> None:
+        await limiter.check_async(name, f"user:{current_user.id}", rate)
 
+    return Depends(dependency)
 
-def _user_unit_id(user: models.Login | None) -> int | None:
+
+def _user_unit_id(user: Principal | None) -> int | None:
     try:
         return int(user.id_unidade) if getattr(user, "id_unidade", None) is not None else None
     except Exception:
         return None
 
-@limiter.limit("5/minute")
-@app.post("/auth/login", response_model=Token)
-def login(request: Request, data: LoginRequest, db: Session = Depends(get_db)):
-    user = authenticate_user(db, data.email, data.password)
+@app.post("/auth/login", response_model=Token, dependencies=[limit_by_address("login", RATE_LIMIT_LOGIN)])
+async def login(data: LoginRequest, db: Session = Depends(get_db)):
+    user = await authenticate_user_async(db, data.email, data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
-    access_token = create_access_token({"sub": user.email})
+    access_token = _token_for(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@limiter.limit("5/minute")
-@app.post("/auth/token", response_model=Token)
-def login_oauth(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@app.post("/auth/token", response_model=Token, dependencies=[limit_by_address("login", RATE_LIMIT_LOGIN)])
+async def login_oauth(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """OAuth2 password flow compatible endpoint for Swagger Authorize.
 
     Uses `username` as email to authenticate and returns a bearer token.
     """
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
-    access_token = create_access_token({"sub": user.email})
+    access_token = _token_for(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/auth/register")
-def register(data: RegisterRequest, db: Session = Depends(get_db)):
-    hashed_password = bcrypt.hashpw(data.password.encode(), bcrypt.gensalt()).decode()
+async def register(data: RegisterRequest, db: Session = Depends(get_db)):
+    hashed_password = await password_hasher.hash_async(data.password)
+    return await run_in_threadpool(_create_user, db, data, hashed_password)
+
+
+def _create_user(db: Session, data: RegisterRequest, hashed_password: str) -> dict:
     user = models.Login(
         name=data.name,
         email=data.email,
@@ -177,9 +381,8 @@ def register(data: RegisterRequest, db: Session = Depends(get_db)):
         )
     return {"id": user.id, "email": user.email, "name": user.name}
 
-@limiter.limit("10/minute")
-@app.get("/lojas")
-def get_lojas(request: Request, db: Session = Depends(get_db), current_user: models.Login = Depends(get_current_user)):
+@app.get("/lojas", dependencies=[limit_by_user("lojas", RATE_LIMIT_API)])
+def get_lojas(db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     # Leitura direta via SQL, sem depender do ORM
     sql = """
         SELECT id, nome, cidade, estado, data_abertura
@@ -188,397 +391,599 @@ def get_lojas(request: Request, db: Session = Depends(get_db), current_user: mod
     """
     return fetch_all(db, sql)
 
-@limiter.limit("10/minute")
-@app.get("/pedidos")
-def get_pedidos(request: Request, db: Session = Depends(get_db), current_user: models.Login = Depends(get_current_user)):
-    # Leitura direta via SQL, sem depender do ORM
-    sql = """
-        SELECT id, id_cliente, id_unidade, id_regiao_entrega,
-               data_pedido, status, valor_total,
-               motivo_cancelamento, origem_cancelamento,
-               data_aceite, data_saida_entrega, data_entrega,
-               created_at, updated_at
-        FROM pedidos
-        ORDER BY data_pedido DESC
-    """
-    return fetch_all(db, sql)
-
 
-@app.get("/metrics/monthly-revenue")
-def get_monthly_revenue(
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
-):
-    # Tenta lidar com views que usam 'total_faturamento' (padrão) ou 'faturamento_total'
-    try:
-        rows = fetch_all(db, "SELECT unidade, mes, total_faturamento FROM faturamento_mensal_unidades")
-    except Exception:
-        rows = fetch_all(db, "SELECT unidade, mes, faturamento_total AS total_faturamento FROM faturamento_mensal_unidades")
-    out = []
-    for m in rows:
-        out.append(
-            {
-                "unidade": m.get("unidade"),
-                "mes": m.get("mes"),
-                "faturamento_total": float(m.get("total_faturamento") or 0.0),
-            }
-        )
-    return out
+_PEDIDO_COLUMNS = """
+        p.id, p.id_cliente, p.id_unidade, p.id_regiao_entrega,
+        p.data_pedido, p.status, p.valor_total,
+        p.motivo_cancelamento, p.origem_cancelamento,
+        p.data_aceite, p.data_saida_entrega, p.data_entrega,
+        p.created_at, p.updated_at
+"""
 
 
-@app.get("/metrics/orders-by-status")
-def get_orders_by_status(
-    start_date: str | None = None,
-    end_date: str | None = None,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
-):
+def _pedidos_conditions(
+    current_user: Principal,
+    status_pedido: str | None,
+    id_unidade: int | None,
+    start_date: str | None,
+    end_date: str | None,
+) -> tuple[list[str], dict[str, object]]:
     conditions: list[str] = []
     params: dict[str, object] = {}
     unit_id = _user_unit_id(current_user)
     if unit_id is not None:
+        if id_unidade is not None and id_unidade != unit_id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unit not allowed for this user")
+        id_unidade = unit_id
+    if id_unidade is not None:
         conditions.append("p.id_unidade = :unit_id")
-        params["unit_id"] = unit_id
+        params["unit_id"] = id_unidade
+    if status_pedido:
+        conditions.append("p.status = :status")
+        params["status"] = status_pedido
+    # Intervalo semiaberto na própria coluna: usa o índice (id_unidade, data_pedido)
     if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
+        conditions.append("p.data_pedido >= :start")
+        params["start"] = queries.lower_bound(start_date, "start_date")
     if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
+        conditions.append("p.data_pedido < :end")
+        params["end"] = queries.upper_bound(end_date, "end_date")
+    return conditions, params
+
+
+@app.get("/pedidos", dependencies=[limit_by_user("pedidos", RATE_LIMIT_API)])
+def get_pedidos(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    status_pedido: str | None = Query(None, alias="status"),
+    id_unidade: int | None = None,
+    start_date: str | None = None,
+    end_date: str | None = None,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Lista pedidos paginados por cursor (keyset) em `(data_pedido, id)`.
+
+    Cada página custa o mesmo que a primeira: o cursor devolvido em
+    `next_cursor` posiciona a próxima consulta direto no índice, sem OFFSET.
+    """
+    conditions, params = _pedidos_conditions(current_user, status_pedido, id_unidade, start_date, end_date)
+    params["limit"] = limit + 1
+    if cursor:
+        try:
+            params["cursor_ts"], params["cursor_id"] = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        conditions.append("(p.data_pedido, p.id) < (:cursor_ts, :cursor_id)")
     where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
-    query = f"""
-        SELECT p.status, COUNT(*) AS total
+    sql = f"""
+        SELECT {_PEDIDO_COLUMNS}
         FROM pedidos p
         {where_clause}
-        GROUP BY p.status
-        ORDER BY p.status
+        ORDER BY p.data_pedido DESC, p.id DESC
+        LIMIT :limit
     """
-    return fetch_all(db, query, params)
-
-
-@app.get("/metrics/top-selling-products")
-def get_top_selling_products(
+    rows = fetch_all(db, sql, queries.bind_values(params, db.get_bind().dialect.name))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["data_pedido"], last["id"])
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+@app.get("/pedidos/export")
+def export_pedidos(
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    status_pedido: str | None = Query(None, alias="status"),
+    id_unidade: int | None = None,
     start_date: str | None = None,
     end_date: str | None = None,
     db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
-    conditions = ["p.status = 'Entregue'"]
-    params: dict[str, str] = {}
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
+    """Exporta todos os pedidos do filtro em CSV/NDJSON, em streaming."""
+    conditions, params = _pedidos_conditions(current_user, status_pedido, id_unidade, start_date, end_date)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""
+        SELECT {_PEDIDO_COLUMNS}
+        FROM pedidos p
+        {where_clause}
+        ORDER BY p.data_pedido DESC, p.id DESC
+    """
+    return stream_query(db, sql, queries.bind_values(params, db.get_bind().dialect.name), fmt, "pedidos")
+
+
+@app.get("/pedidos/{pedido_id}/export")
+def export_pedido(
+    pedido_id: int,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    conditions, params = _pedidos_conditions(current_user, None, None, None, None)
+    conditions.append("p.id = :pedido_id")
+    params["pedido_id"] = pedido_id
     where_clause = " AND ".join(conditions)
-    query = f"""
-        SELECT pr.nome, SUM(ip.quantidade) AS total_vendido
-        FROM itens_pedido ip
-        JOIN produtos pr ON pr.id = ip.id_produto
-        JOIN pedidos p ON p.id = ip.id_pedido
-        WHERE {where_clause}
-        GROUP BY pr.nome
-        ORDER BY total_vendido DESC
-        LIMIT 5
+    if fetch_one(db, f"SELECT p.id FROM pedidos p WHERE {where_clause}", params) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido not found")
+    sql = f"SELECT {_PEDIDO_COLUMNS} FROM pedidos p WHERE {where_clause}"
+    return stream_query(db, sql, params, fmt, f"pedido_{pedido_id}")
+
+
+# Ingestão: só papéis de integração ou a credencial de serviço (`INGEST_TOKEN`)
+INGEST_ROLES = {r.strip() for r in os.getenv("INGEST_ROLES", "admin,ingest").split(",") if r.strip()}
+INGEST_TOKEN = os.getenv("INGEST_TOKEN")
+
+
+async def get_ingest_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal | None:
+    """Caller allowed to ingest orders: `None` for the service credential (any unit)."""
+    if INGEST_TOKEN and hmac.compare_digest(token.encode(), INGEST_TOKEN.encode()):
+        return None
+    principal = await get_current_user(token, db)
+    if principal.role not in INGEST_ROLES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Ingestion requires an ingest role")
+    return principal
+
+
+@app.post("/ingest/pedidos")
+async def ingest_pedidos(
+    request: Request,
+    db: Session = Depends(get_db),
+    caller: Principal | None = Depends(get_ingest_principal),
+):
+    """Ingere pedidos (array JSON ou NDJSON) em lotes, idempotente por `id_externo`.
+
+    Exige papel em `INGEST_ROLES` ou a credencial `INGEST_TOKEN`. Usuário
+    vinculado a uma unidade só envia pedidos dela, inclusive os já gravados.
+    """
+    body = await request.body()
+    result = await run_in_threadpool(
+        ingest.ingest_payload, db, body, request.headers.get("content-type"), _user_unit_id(caller)
+    )
+    # Streams abertos recebem os pedidos novos sem esperar o próximo ciclo
+    stream.hub.wake()
+    return result
+
+
+# ---------------------------
+# Consultas analíticas
+# ---------------------------
+#
+# O SQL de cada endpoint de /metrics, /insights e /dashboard fica registrado em
+# `app.queries` com o nome do endpoint; `_sql(db, nome, f)` compila para o banco
+# da sessão. O handler executa com `fetch_all_async` e a rota de exportação
+# reaproveita o mesmo SQL em streaming.
+
+def _sql(db: ReadSession | Session, name: str, f: Filtros) -> tuple[str, dict]:
+    """SQL of the registered query `name` (see `app.queries`) for the session's database."""
+    return queries.build(name, f, db.get_bind().dialect.name)
+
+
+async def _breakdown(db: ReadSession, name: str, f: Filtros, fetch=fetch_all_async):
+    """Hour/weekday breakdowns: from the in-memory snapshot when it covers `f` (see `app.columnar`), else the SQL."""
+    result = await columnar.engine.run(db, name, f)
+    return result if result is not None else await fetch(db, *_sql(db, name, f))
+
+
+async def _cached(
+    db: ReadSession,
+    endpoint: str,
+    f: Filtros,
+    compute: Callable[[], Awaitable[object]],
+    open_ended: bool = False,
+    watermark: str = "watermark",
+):
+    """Serve `await compute()` through the result cache, keyed by the endpoint and filters.
+
+    `open_ended` marks results that also depend on orders after `end_date`.
+    The response gets an ETag from the `watermark` query (see `app.httpcache`);
+    a matching `If-None-Match` ends the request with 304 before `compute` runs.
     """
-    return fetch_all(db, query, params)
+    meta = CacheEntryMeta(
+        unit_id=f.unit_id,
+        start=rollup.parse_day(f.start_date or f.date),
+        end=None if open_ended else rollup.parse_day(f.end_date or f.date),
+    )
+    extra = {"start": f.start_date, "end": f.end_date, "date": f.date, "limit": f.limit}
+    request = httpcache.current_request.get()
+    # Invalidações publicadas por outros processos (rollup no líder): ver `app.cache`
+    await result_cache.sync_generation_async(db)
+
+    if not httpcache.HTTP_ETAG_ENABLED or request is None:
+
+        async def named_compute():
+            with query_name(endpoint):
+                return await compute()
+
+        return await result_cache.get_or_compute_async(endpoint, meta, named_compute, extra)
+
+    async def versioned_compute():
+        # Marca d'água lida antes do agregado: se mudar no meio, a próxima ETag difere
+        with query_name(f"{endpoint}@watermark"):
+            mark = await fetch_one_async(db, *_sql(db, watermark, replace(f, end_date=None) if open_ended else f))
+        data_version = httpcache.version(result_cache.key(endpoint, meta, extra), mark)
+        httpcache.check(request, httpcache.etag(request, data_version), meta.end)
+        with query_name(endpoint):
+            return {"versao": data_version, "dados": await compute()}
+
+    entry = await result_cache.get_or_compute_async(endpoint, meta, versioned_compute, extra)
+    # Resultado do cache: vale a versão gravada com ele (o cache é invalidado nas escritas)
+    httpcache.check(request, httpcache.etag(request, entry["versao"]), meta.end)
+    return entry["dados"]
+
+
+# Quando o intervalo inteiro já está consolidado no rollup `metricas_diarias`
+# (ver `rollup.covers`), os endpoints usam a variante `<nome>@rollup`.
+
+async def _rollup_covers(db: ReadSession, f: Filtros) -> bool:
+    return await rollup.covers_async(db, rollup.parse_day(f.start_date), rollup.parse_day(f.end_date))
+
+
+async def _variant(db: ReadSession, name: str, f: Filtros) -> str:
+    return f"{name}@rollup" if await _rollup_covers(db, f) else name
+
+
+async def _clientes_variant(db: ReadSession, name: str) -> str:
+    # Sem o backfill de clientes_primeiro_pedido, o primeiro pedido sai do histórico
+    return name if await clientes.ready_async(db) else f"{name}@historico"
+
+
+async def _monthly_variant(db: ReadSession, f: Filtros) -> str:
+    # faturamento_mensal só serve os meses que o rollup diário cobre desde o dia 1
+    first_month = f.params().get("month_start")
+    covered = await rollup.months_covered_async(db, first_month)
+    return "metrics/monthly-revenue" if covered else "metrics/monthly-revenue@pedidos"
+
+
+@app.get("/metrics/monthly-revenue")
+async def get_monthly_revenue(
+    start_date: str | None = None,
+    end_date: str | None = None,
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Faturamento por unidade e mês (`YYYY-MM`) dos meses que o período toca."""
+    # Cache, invalidação e ETag pelos meses inteiros que a resposta soma, não pelos dias pedidos
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date).whole_months()
+
+    async def compute():
+        rows = await fetch_all_async(db, *_sql(db, await _monthly_variant(db, f), f))
+        return [{**r, "faturamento_total": float(r["faturamento_total"] or 0)} for r in rows]
+
+    return await _cached(db, "metrics/monthly-revenue", f, compute, watermark="watermark@monthly")
+
+
+@app.get("/metrics/orders-by-status")
+async def get_orders_by_status(
+    start_date: str | None = None,
+    end_date: str | None = None,
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date)
+    name = await _variant(db, "metrics/orders-by-status", f)
+    return await _cached(db, "metrics/orders-by-status", f, lambda: fetch_all_async(db, *_sql(db, name, f)))
+
+
+@app.get("/metrics/top-selling-products")
+async def get_top_selling_products(
+    start_date: str | None = None,
+    end_date: str | None = None,
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    f = Filtros(start_date=start_date, end_date=end_date)
+    return await _cached(
+        db,
+        "metrics/top-selling-products",
+        f,
+        lambda: fetch_all_async(db, *_sql(db, "metrics/top-selling-products", f)),
+        watermark="watermark@detalhes",
+    )
 
 
 @app.get("/metrics/average-ratings")
-def get_average_ratings(
+async def get_average_ratings(
     start_date: str | None = None,
     end_date: str | None = None,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    conditions: list[str] = []
-    params: dict[str, str] = {}
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
-    where_clause = " AND ".join(conditions)
-    if where_clause:
-        where_clause = "WHERE " + where_clause
-    query = f"""
-        SELECT u.nome AS unidade, AVG(f.nota) AS media_nota
-        FROM feedbacks f
-        JOIN pedidos p ON p.id = f.id_pedido
-        JOIN unidades u ON u.id = p.id_unidade
-        {where_clause}
-        GROUP BY u.nome
-        ORDER BY u.nome
-    """
-    return fetch_all(db, query, params)
+    f = Filtros(start_date=start_date, end_date=end_date)
+    name = await _variant(db, "metrics/average-ratings", f)
+    return await _cached(
+        db, "metrics/average-ratings", f, lambda: fetch_all_async(db, *_sql(db, name, f)), watermark="watermark@detalhes"
+    )
 
 
 @app.get("/metrics/weekly-orders")
-def get_weekly_orders(
+async def get_weekly_orders(
     start_date: str | None = None,
     end_date: str | None = None,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    conditions: list[str] = []
-    params: dict[str, str] = {}
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
-    where_clause = " AND ".join(conditions)
-    if where_clause:
-        where_clause = "WHERE " + where_clause
-    query = f"""
-        SELECT to_char(date_trunc('week', p.data_pedido), 'IYYY-IW') AS semana,
-               COUNT(*) AS total_pedidos
-        FROM pedidos p
-        {where_clause}
-        GROUP BY semana
-        ORDER BY semana
-    """
-    return fetch_all(db, query, params)
+    f = Filtros(start_date=start_date, end_date=end_date)
+    return await _cached(db, "metrics/weekly-orders", f, lambda: _breakdown(db, "metrics/weekly-orders", f))
 
 
 @app.get("/metrics/top-products-revenue")
-def get_top_products_revenue(
+async def get_top_products_revenue(
     start_date: str | None = None,
     end_date: str | None = None,
     limit: int = 5,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    conditions = ["p.status = 'Entregue'"]
-    params: dict[str, object] = {"limit": limit}
-    unit_id = _user_unit_id(current_user)
-    if unit_id is not None:
-        conditions.append("p.id_unidade = :unit_id")
-        params["unit_id"] = unit_id
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
-    where_clause = " AND ".join(conditions)
-    query = f"""
-        SELECT pr.nome AS produto,
-               SUM(ip.quantidade * ip.preco_unitario) AS receita
-        FROM itens_pedido ip
-        JOIN produtos pr ON pr.id = ip.id_produto
-        JOIN pedidos p   ON p.id = ip.id_pedido
-        WHERE {where_clause}
-        GROUP BY pr.nome
-        ORDER BY receita DESC
-        LIMIT :limit
-    """
-    rows = fetch_all(db, query, params)
-    # Corrige nomes com acentuações quebradas (ex.: "HambÃºrguer")
-    for r in rows:
-        if "produto" in r:
-            r["produto"] = _fix_mojibake(r["produto"])
-    return rows
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date, limit=limit)
+    return await _cached(
+        db,
+        "metrics/top-products-revenue",
+        f,
+        lambda: fetch_all_async(db, *_sql(db, "metrics/top-products-revenue", f)),
+        watermark="watermark@detalhes",
+    )
 
 
 @app.get("/metrics/daily-revenue")
-def get_daily_revenue(
+async def get_daily_revenue(
+    request: Request,
     start_date: str,
     end_date: str,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not start_date or not end_date:
         raise HTTPException(status_code=400, detail="start_date and end_date are required (YYYY-MM-DD)")
-    conditions = ["p.status = 'Entregue'", "p.data_pedido >= :start_date", "p.data_pedido <= :end_date"]
-    params: dict[str, object] = {"start_date": start_date, "end_date": end_date}
-    unit_id = _user_unit_id(current_user)
-    if unit_id is not None:
-        conditions.append("p.id_unidade = :unit_id")
-        params["unit_id"] = unit_id
-    where_clause = " AND ".join(conditions)
-    query = f"""
-        SELECT DATE(p.data_pedido) AS dia,
-               SUM(p.valor_total) AS faturamento,
-               AVG(p.valor_total) AS ticket_medio
-        FROM pedidos p
-        WHERE {where_clause}
-        GROUP BY DATE(p.data_pedido)
-        ORDER BY dia
-    """
-    return fetch_all(db, query, params)
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date)
+    name = await _variant(db, "metrics/daily-revenue", f)
+    table = await _cached(db, "metrics/daily-revenue", f, lambda: fetch_table_async(db, *_sql(db, name, f)))
+    return formats.render(Table(*table), formats.negotiate(request))
 
 
 @app.get("/metrics/cancellation-cost")
-def get_cancellation_cost(
+async def get_cancellation_cost(
     start_date: str | None = None,
     end_date: str | None = None,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    conditions = ["p.status = 'Cancelado'"]
-    params: dict[str, object] = {}
-    unit_id = _user_unit_id(current_user)
-    if unit_id is not None:
-        conditions.append("p.id_unidade = :unit_id")
-        params["unit_id"] = unit_id
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
-    where_clause = " AND ".join(conditions)
-    query = f"""
-        SELECT COALESCE(SUM(p.valor_total), 0) AS custo_cancelamento
-        FROM pedidos p
-        WHERE {where_clause}
-    """
-    row = fetch_all(db, query, params)
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date)
+    name = await _variant(db, "metrics/cancellation-cost", f)
+    row = await _cached(db, "metrics/cancellation-cost", f, lambda: fetch_all_async(db, *_sql(db, name, f)))
     return row[0] if row else {"custo_cancelamento": 0}
 
 
 @app.get("/metrics/daily-overview")
-def get_daily_overview(
+async def get_daily_overview(
     date: str,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not date:
         raise HTTPException(status_code=400, detail="date is required (YYYY-MM-DD)")
-    params: dict[str, object] = {"d": date}
-    unit_id = _user_unit_id(current_user)
-    unit_filter = ""
-    if unit_id is not None:
-        unit_filter = "AND p.id_unidade = :unit_id"
-        params["unit_id"] = unit_id
-
-    # KPIs
-    kpis_sql = f"""
-        SELECT
-            COUNT(*) AS total_pedidos,
-            SUM(CASE WHEN p.status='Entregue' THEN p.valor_total ELSE 0 END) AS faturamento_dia,
-            AVG(EXTRACT(EPOCH FROM (p.data_aceite - p.data_pedido)) / 60.0) AS tempo_medio_aceite,
-            AVG(CASE WHEN p.status='Entregue' AND p.data_aceite IS NOT NULL AND p.data_entrega IS NOT NULL
-                     THEN EXTRACT(EPOCH FROM (p.data_entrega - p.data_aceite)) / 60.0 END) AS tempo_medio_entrega
-        FROM pedidos p
-        WHERE DATE(p.data_pedido) = :d {unit_filter}
-    """
-    kpis = fetch_all(db, kpis_sql, params)
-    kpis = kpis[0] if kpis else {"total_pedidos": 0, "faturamento_dia": 0, "tempo_medio_aceite": None, "tempo_medio_entrega": None}
+    f = Filtros(unit_id=_user_unit_id(current_user), date=date)
+    return await _cached(db, "metrics/daily-overview", f, lambda: _daily_overview(db, f))
 
-    # Pedidos por status
-    status_sql = f"""
-        SELECT p.status, COUNT(*) AS total
-        FROM pedidos p
-        WHERE DATE(p.data_pedido)=:d {unit_filter}
-        GROUP BY p.status
-    """
-    por_status = fetch_all(db, status_sql, params)
-
-    # Clientes novos vs recorrentes
-    # Novos vs recorrentes sem depender de clientes.data_cadastro (nem sempre existe)
-    clientes_sql = f"""
-        WITH primeiros_pedidos AS (
-            SELECT id_cliente, MIN(DATE(data_pedido)) AS primeira_data
-            FROM pedidos
-            WHERE id_cliente IS NOT NULL
-            GROUP BY id_cliente
-        )
-        SELECT
-            SUM(CASE WHEN pp.primeira_data = :d THEN 1 ELSE 0 END) AS novos,
-            SUM(CASE WHEN pp.primeira_data < :d THEN 1 ELSE 0 END) AS recorrentes
-        FROM pedidos p
-        JOIN primeiros_pedidos pp ON pp.id_cliente = p.id_cliente
-        WHERE DATE(p.data_pedido)=:d {unit_filter}
-    """
-    clientes = fetch_all(db, clientes_sql, params)
-    clientes = clientes[0] if clientes else {"novos": 0, "recorrentes": 0}
+
+async def _daily_overview(db: ReadSession, f: Filtros) -> dict:
+    # KPIs, pedidos por status e clientes novos vs recorrentes: consultas independentes
+    kpis, por_status, novos_recorrentes = await fetch_many(
+        db,
+        _sql(db, "metrics/daily-overview:kpis", f),
+        _sql(db, "metrics/daily-overview:status", f),
+        _sql(db, await _clientes_variant(db, "metrics/daily-overview:clientes"), f),
+    )
+    kpis = kpis[0] if kpis else {"total_pedidos": 0, "faturamento_dia": 0, "tempo_medio_aceite": None, "tempo_medio_entrega": None}
+    novos_recorrentes = novos_recorrentes[0] if novos_recorrentes else {"novos": 0, "recorrentes": 0}
 
     return {
         **kpis,
         "por_status": por_status,
-        "clientes": clientes,
+        "clientes": novos_recorrentes,
     }
 
 
 @app.get("/metrics/daily-cumulative-revenue")
-def get_daily_cumulative_revenue(
+async def get_daily_cumulative_revenue(
+    request: Request,
     date: str,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not date:
         raise HTTPException(status_code=400, detail="date is required (YYYY-MM-DD)")
-    params: dict[str, object] = {"d": date}
-    unit_id = _user_unit_id(current_user)
-    unit_filter = ""
-    if unit_id is not None:
-        unit_filter = "AND p.id_unidade = :unit_id"
-        params["unit_id"] = unit_id
-    sql = f"""
-        SELECT p.data_pedido AS ts, p.valor_total
-        FROM pedidos p
-        WHERE DATE(p.data_pedido)=:d AND p.status='Entregue' {unit_filter}
-        ORDER BY p.data_pedido
-    """
-    rows = fetch_all(db, sql, params)
+    f = Filtros(unit_id=_user_unit_id(current_user), date=date)
     # acumulado será calculado no frontend (mantém compatibilidade com drivers)
-    return rows
+    table = await _cached(db, "metrics/daily-cumulative-revenue", f, lambda: fetch_table_async(db, *_sql(db, "metrics/daily-cumulative-revenue", f)))
+    return formats.render(Table(*table), formats.negotiate(request))
 
 
 @app.get("/metrics/daily-accept-time-by-hour")
-def get_daily_accept_time_by_hour(
+async def get_daily_accept_time_by_hour(
     date: str,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not date:
         raise HTTPException(status_code=400, detail="date is required (YYYY-MM-DD)")
-    params: dict[str, object] = {"d": date}
-    unit_id = _user_unit_id(current_user)
-    unit_filter = ""
-    if unit_id is not None:
-        unit_filter = "AND p.id_unidade = :unit_id"
-        params["unit_id"] = unit_id
-    sql = f"""
-        SELECT EXTRACT(HOUR FROM p.data_pedido) AS hora,
-               AVG(EXTRACT(EPOCH FROM (p.data_aceite - p.data_pedido)) / 60.0) AS tempo_medio
-        FROM pedidos p
-        WHERE DATE(p.data_pedido)=:d AND p.data_aceite IS NOT NULL {unit_filter}
-        GROUP BY EXTRACT(HOUR FROM p.data_pedido)
-        ORDER BY hora
-    """
-    return fetch_all(db, sql, params)
+    f = Filtros(unit_id=_user_unit_id(current_user), date=date)
+    return await _cached(db, "metrics/daily-accept-time-by-hour", f, lambda: _breakdown(db, "metrics/daily-accept-time-by-hour", f))
 
 
 @app.get("/metrics/daily-cancellations-by-hour")
-def get_daily_cancellations_by_hour(
+async def get_daily_cancellations_by_hour(
     date: str,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not date:
         raise HTTPException(status_code=400, detail="date is required (YYYY-MM-DD)")
-    params: dict[str, object] = {"d": date}
-    unit_id = _user_unit_id(current_user)
-    unit_filter = ""
-    if unit_id is not None:
-        unit_filter = "AND p.id_unidade = :unit_id"
-        params["unit_id"] = unit_id
-    sql = f"""
-        SELECT EXTRACT(HOUR FROM p.data_pedido) AS hora,
-               COALESCE(p.motivo_cancelamento, 'Sem motivo') AS motivo,
-               COUNT(*) AS qtd
-        FROM pedidos p
-        WHERE DATE(p.data_pedido)=:d AND p.status='Cancelado' {unit_filter}
-        GROUP BY EXTRACT(HOUR FROM p.data_pedido), COALESCE(p.motivo_cancelamento, 'Sem motivo')
-        ORDER BY hora, motivo
+    f = Filtros(unit_id=_user_unit_id(current_user), date=date)
+    return await _cached(db, "metrics/daily-cancellations-by-hour", f, lambda: _breakdown(db, "metrics/daily-cancellations-by-hour", f))
+
+
+# ---------------------------
+# Bundles por página
+# ---------------------------
+#
+# Uma requisição por tela: os pedidos do período são lidos uma única vez e
+# todos os painéis saem desse mesmo resultado. Os endpoints individuais acima
+# continuam disponíveis.
+
+def _as_datetime(value):
+    # Sem tipo declarado, o SQLite devolve timestamps como texto
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def _minutes(start, end) -> float | None:
+    if start is None or end is None:
+        return None
+    return (end - start).total_seconds() / 60.0
+
+
+def _avg(values: list) -> float | None:
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+async def _daily_bundle(db: ReadSession, f: Filtros) -> dict:
+    recorrentes_sql = _sql(db, await _clientes_variant(db, "dashboard/daily:recorrentes"), f)
+    rows, returning_rows = await fetch_many(db, _sql(db, "dashboard/daily:pedidos", f), recorrentes_sql)
+    returning = {r["id_cliente"] for r in returning_rows}
+
+    por_status: dict[str, int] = {}
+    cumulativo, aceite_por_hora, cancel_por_hora = [], {}, {}
+    aceites, entregas, faturamento = [], [], None
+    novos = recorrentes = 0
+    for r in rows:
+        ts, aceite = _as_datetime(r["data_pedido"]), _as_datetime(r["data_aceite"])
+        por_status[r["status"]] = por_status.get(r["status"], 0) + 1
+        minutos_aceite = _minutes(ts, aceite)
+        aceites.append(minutos_aceite)
+        if minutos_aceite is not None:
+            aceite_por_hora.setdefault(ts.hour, []).append(minutos_aceite)
+        if r["status"] == "Entregue":
+            faturamento = (faturamento or 0) + (r["valor_total"] or 0)
+            entregas.append(_minutes(aceite, _as_datetime(r["data_entrega"])))
+            cumulativo.append({"ts": r["data_pedido"], "valor_total": r["valor_total"]})
+        elif r["status"] == "Cancelado":
+            key = (ts.hour, r["motivo_cancelamento"] or "Sem motivo")
+            cancel_por_hora[key] = cancel_por_hora.get(key, 0) + 1
+        if r["id_cliente"] is not None:
+            if r["id_cliente"] in returning:
+                recorrentes += 1
+            else:
+                novos += 1
+
+    return {
+        "total_pedidos": len(rows),
+        "faturamento_dia": faturamento,
+        "tempo_medio_aceite": _avg(aceites),
+        "tempo_medio_entrega": _avg(entregas),
+        "por_status": [{"status": s, "total": t} for s, t in por_status.items()],
+        "clientes": {"novos": novos, "recorrentes": recorrentes},
+        "cumulativo": cumulativo,
+        "aceite_por_hora": [{"hora": h, "tempo_medio": _avg(v)} for h, v in sorted(aceite_por_hora.items())],
+        "cancelamentos_por_hora": [
+            {"hora": h, "motivo": m, "qtd": q} for (h, m), q in sorted(cancel_por_hora.items())
+        ],
+    }
+
+
+async def _monthly_bundle(db: ReadSession, f: Filtros) -> dict:
+    ratings_filter = Filtros(start_date=f.start_date, end_date=f.end_date)
+    top_sql = _sql(db, "metrics/top-products-revenue", replace(f, limit=f.limit or 5))
+    if await _rollup_covers(db, f):
+        por_status, diario, custo, avaliacoes, top = await fetch_many(
+            db,
+            _sql(db, "metrics/orders-by-status@rollup", f),
+            _sql(db, "metrics/daily-revenue@rollup", f),
+            _sql(db, "metrics/cancellation-cost@rollup", f),
+            _sql(db, "metrics/average-ratings@rollup", ratings_filter),
+            top_sql,
+        )
+        custo = custo[0]["custo_cancelamento"]
+    else:
+        pedidos, avaliacoes, top = await fetch_many(
+            db,
+            _sql(db, "dashboard/monthly:pedidos", f),
+            _sql(db, "metrics/average-ratings", ratings_filter),
+            top_sql,
+        )
+        por_status_map: dict[str, int] = {}
+        entregues: dict[object, list] = {}
+        custo = 0
+        for r in pedidos:
+            por_status_map[r["status"]] = por_status_map.get(r["status"], 0) + r["total"]
+            if r["status"] == "Entregue":
+                acc = entregues.setdefault(r["dia"], [0, 0])
+                acc[0] += r["valor"]
+                acc[1] += r["total"]
+            elif r["status"] == "Cancelado":
+                custo += r["valor"]
+        por_status = [
+            {"status": s, "total": t} for s, t in sorted(por_status_map.items(), key=lambda x: (x[0] is None, x[0] or ""))
+        ]
+        diario = [
+            {"dia": d, "faturamento": v, "ticket_medio": v / n}
+            for d, (v, n) in sorted(entregues.items(), key=lambda x: str(x[0]))
+        ]
+    return {
+        "por_status": por_status,
+        "avaliacoes": avaliacoes,
+        "top_produtos": top,
+        "faturamento_diario": diario,
+        "custo_cancelamento": custo,
+    }
+
+
+@app.get("/dashboard/daily")
+async def get_dashboard_daily(
+    date: str,
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Todos os painéis da página diária em uma única resposta."""
+    if not date:
+        raise HTTPException(status_code=400, detail="date is required (YYYY-MM-DD)")
+    f = Filtros(unit_id=_user_unit_id(current_user), date=date)
+    return await _cached(db, "dashboard/daily", f, lambda: _daily_bundle(db, f))
+
+
+@app.get("/stream/daily")
+async def stream_daily(
+    last_event_id: str | None = Header(None),
+    current_user: Principal = Depends(get_current_user),
+):
+    """KPIs de hoje em Server-Sent Events: `snapshot` na conexão, depois `delta` a cada mudança.
+
+    Uma leitura de pedidos por unidade serve todos os streams dela (ver `app.stream`).
     """
-    return fetch_all(db, sql, params)
+    subscription = await stream.hub.subscribe(_user_unit_id(current_user), last_event_id)
+    return StreamingResponse(
+        stream.hub.events(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/dashboard/monthly")
+async def get_dashboard_monthly(
+    start_date: str,
+    end_date: str,
+    limit: int = 5,
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Todos os painéis da página mensal em uma única resposta."""
+    if not start_date or not end_date:
+        raise HTTPException(status_code=400, detail="start_date and end_date are required (YYYY-MM-DD)")
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date, limit=limit)
+    return await _cached(db, "dashboard/monthly", f, lambda: _monthly_bundle(db, f), watermark="watermark@detalhes")
 
 
 # ---------------------------
@@ -586,125 +991,149 @@ def get_daily_cancellations_by_hour(
 # ---------------------------
 
 @app.get("/insights/top-cancelled-products")
-def get_top_cancelled_products(
+async def get_top_cancelled_products(
     start_date: str | None = None,
     end_date: str | None = None,
     limit: int = 5,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     """Retorna produtos mais envolvidos em pedidos cancelados.
 
     - Considera a soma das quantidades canceladas e o valor potencial perdido
       (quantidade * preço unitário) por produto.
     """
-    conditions = ["p.status = 'Cancelado'"]
-    params: dict[str, object] = {"limit": limit}
-    unit_id = _user_unit_id(current_user)
-    if unit_id is not None:
-        conditions.append("p.id_unidade = :unit_id")
-        params["unit_id"] = unit_id
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
-    where_clause = " AND ".join(conditions)
-    query = f"""
-        SELECT pr.nome AS produto,
-               SUM(ip.quantidade) AS qtd_cancelada,
-               SUM(ip.quantidade * ip.preco_unitario) AS perda_total
-        FROM itens_pedido ip
-        JOIN produtos pr ON pr.id = ip.id_produto
-        JOIN pedidos p   ON p.id = ip.id_pedido
-        WHERE {where_clause}
-        GROUP BY pr.nome
-        ORDER BY qtd_cancelada DESC, perda_total DESC
-        LIMIT :limit
-    """
-    rows = fetch_all(db, query, params)
-    for r in rows:
-        if "produto" in r:
-            r["produto"] = _fix_mojibake(r["produto"])
-    return rows
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date, limit=limit)
+    return await _cached(
+        db,
+        "insights/top-cancelled-products",
+        f,
+        lambda: fetch_all_async(db, *_sql(db, "insights/top-cancelled-products", f)),
+        watermark="watermark@detalhes",
+    )
 
 
 @app.get("/insights/orders-heatmap")
-def get_orders_heatmap(
+async def get_orders_heatmap(
+    request: Request,
     start_date: str | None = None,
     end_date: str | None = None,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     """Mapa de calor de pedidos por dia da semana (0-dom) e hora (0-23)."""
-    conditions: list[str] = []
-    params: dict[str, object] = {}
-    unit_id = _user_unit_id(current_user)
-    if unit_id is not None:
-        conditions.append("p.id_unidade = :unit_id")
-        params["unit_id"] = unit_id
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
-    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
-    # dow: 0=Sunday em PostgreSQL
-    query = f"""
-        SELECT EXTRACT(DOW FROM p.data_pedido) AS dow,
-               EXTRACT(HOUR FROM p.data_pedido) AS hora,
-               COUNT(*) AS qtd
-        FROM pedidos p
-        {where_clause}
-        GROUP BY EXTRACT(DOW FROM p.data_pedido), EXTRACT(HOUR FROM p.data_pedido)
-        ORDER BY dow, hora
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date)
+    table = await _cached(db, "insights/orders-heatmap", f, lambda: _breakdown(db, "insights/orders-heatmap", f, fetch_table_async))
+    return formats.render(Table(*table), formats.negotiate(request))
+
+
+@app.get("/insights/customer-cohorts")
+async def get_customer_cohorts(
+    start_date: str | None = None,
+    end_date: str | None = None,
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Retenção por coorte: clientes distintos por mês do primeiro pedido e mês de atividade.
+
+    `start_date`/`end_date` filtram as coortes (data do primeiro pedido).
     """
-    return fetch_all(db, query, params)
+    if not await clientes.ready_async(db):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Customer first orders not loaded yet (python -m app.clientes backfill)",
+        )
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date)
+    return await _cached(
+        db,
+        "insights/customer-cohorts",
+        f,
+        lambda: fetch_all_async(db, *_sql(db, "insights/customer-cohorts", f)),
+        open_ended=True,
+        watermark="watermark@clientes",
+    )
 
 
 @app.get("/insights/negative-feedbacks")
-def get_negative_feedbacks(
+async def get_negative_feedbacks(
     start_date: str | None = None,
     end_date: str | None = None,
     limit: int = 50,
-    db: Session = Depends(get_db),
-    current_user: models.Login = Depends(get_current_user),
+    db: ReadSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     """Lista feedbacks negativos (nota <= 2 ou tipo 'Reclamação')."""
-    conditions = ["(f.nota <= 2 OR LOWER(f.tipo_feedback) = LOWER('Reclamação') OR f.tipo_feedback ILIKE 'Reclam%')"]
-    params: dict[str, object] = {"limit": limit}
-    unit_id = _user_unit_id(current_user)
-    if unit_id is not None:
-        conditions.append("p.id_unidade = :unit_id")
-        params["unit_id"] = unit_id
-    if start_date:
-        conditions.append("p.data_pedido >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        conditions.append("p.data_pedido <= :end_date")
-        params["end_date"] = end_date
-    where_clause = " AND ".join(conditions)
-    query = f"""
-        SELECT f.id,
-               f.nota,
-               f.tipo_feedback,
-               COALESCE(f.comentario, '') AS comentario,
-               p.id AS id_pedido,
-               p.data_pedido,
-               COALESCE(p.motivo_cancelamento, '') AS motivo_cancelamento
-        FROM feedbacks f
-        JOIN pedidos p ON p.id = f.id_pedido
-        WHERE {where_clause}
-        ORDER BY f.nota ASC, p.data_pedido DESC
-        LIMIT :limit
+    f = Filtros(unit_id=_user_unit_id(current_user), start_date=start_date, end_date=end_date, limit=limit)
+    return await _cached(
+        db,
+        "insights/negative-feedbacks",
+        f,
+        lambda: fetch_all_async(db, *_sql(db, "insights/negative-feedbacks", f)),
+        watermark="watermark@detalhes",
+    )
+
+
+# ---------------------------
+# Exportação em streaming
+# ---------------------------
+
+class _ExportSpec(NamedTuple):
+    default_limit: int | None = None
+    requires: tuple[str, ...] = ()
+
+
+# Chave = nome da consulta em `app.queries`. O daily-overview não entra: ele
+# agrega três consultas em um único objeto.
+_EXPORTS: dict[str, _ExportSpec] = {
+    "metrics/monthly-revenue": _ExportSpec(),
+    "metrics/orders-by-status": _ExportSpec(),
+    "metrics/top-selling-products": _ExportSpec(),
+    "metrics/average-ratings": _ExportSpec(),
+    "metrics/weekly-orders": _ExportSpec(),
+    "metrics/top-products-revenue": _ExportSpec(default_limit=5),
+    "metrics/daily-revenue": _ExportSpec(requires=("start_date", "end_date")),
+    "metrics/cancellation-cost": _ExportSpec(),
+    "metrics/daily-cumulative-revenue": _ExportSpec(requires=("date",)),
+    "metrics/daily-accept-time-by-hour": _ExportSpec(requires=("date",)),
+    "metrics/daily-cancellations-by-hour": _ExportSpec(requires=("date",)),
+    "insights/top-cancelled-products": _ExportSpec(default_limit=5),
+    "insights/orders-heatmap": _ExportSpec(),
+    "insights/customer-cohorts": _ExportSpec(),
+    "insights/negative-feedbacks": _ExportSpec(default_limit=50),
+}
+
+
+@app.get("/export/{scope}/{name}")
+def export_metric(
+    scope: str,
+    name: str,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    start_date: str | None = None,
+    end_date: str | None = None,
+    date: str | None = None,
+    limit: int | None = None,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Exporta o resultado de qualquer `/metrics/*` ou `/insights/*` em streaming.
+
+    Aceita os mesmos filtros do endpoint original, ex.:
+    `/export/metrics/daily-revenue?start_date=...&end_date=...&format=ndjson`.
     """
-    rows = fetch_all(db, query, params)
-    # Corrige mojibake em comentarios/motivos quando aplicável
-    for r in rows:
-        if "comentario" in r:
-            r["comentario"] = _fix_mojibake(r["comentario"]) or ""
-        if "motivo_cancelamento" in r:
-            r["motivo_cancelamento"] = _fix_mojibake(r["motivo_cancelamento"]) or ""
-    return rows
+    query = f"{scope}/{name}"
+    spec = _EXPORTS.get(query)
+    if spec is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown export")
+    f = Filtros(
+        unit_id=_user_unit_id(current_user),
+        start_date=start_date,
+        end_date=end_date,
+        date=date,
+        limit=limit if limit is not None else spec.default_limit,
+    )
+    missing = [field for field in spec.requires if not getattr(f, field)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"{', '.join(missing)} required (YYYY-MM-DD)")
+    if query == "metrics/monthly-revenue" and not rollup.months_covered(db, f.params().get("month_start")):
+        query = "metrics/monthly-revenue@pedidos"
+    return stream_query(db, *_sql(db, query, f), fmt, name)
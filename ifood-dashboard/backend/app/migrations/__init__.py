@@ -0,0 +1,79 @@
+"""Versioned schema migrations.
+
+Each migration is a module in this package exposing `upgrade(conn)`. Applied
+versions are recorded in `schema_migrations`, so running the command again
+only applies what is pending:
+
+    python -m app.migrations
+"""
+import importlib
+from typing import List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from ..database import engine as default_engine
+
+MIGRATIONS: List[str] = [
+    "m0001_rollup_diario",
+    "m0002_indices_pedidos",
+    "m0003_clientes_primeiro_pedido",
+    "m0004_pedidos_id_externo",
+    "m0005_coleta_cursores",
+    "m0006_job_execucoes",
+    "m0007_indices_marca_dagua",
+    "m0008_reparos_texto",
+    "m0009_indice_updated_at",
+    "m0010_faturamento_mensal",
+    "m0011_login_claims_valid_after",
+]
+
+
+def table_exists(conn: Connection, table: str) -> bool:
+    return inspect(conn).has_table(table)
+
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl_type: str) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def create_table_if_missing(conn: Connection, model) -> bool:
+    """Create `model`'s table from its ORM definition; return True if created."""
+    if table_exists(conn, model.__tablename__):
+        return False
+    model.__table__.create(conn)
+    return True
+
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version VARCHAR(128) PRIMARY KEY,"
+            " applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+    )
+
+
+def applied_versions(conn: Connection) -> List[str]:
+    _ensure_version_table(conn)
+    return [r[0] for r in conn.execute(text("SELECT version FROM schema_migrations"))]
+
+
+def upgrade(engine: Optional[Engine] = None) -> List[str]:
+    """Apply pending migrations in order, each in its own transaction."""
+    engine = engine or default_engine
+    with engine.begin() as conn:
+        done = set(applied_versions(conn))
+    applied: List[str] = []
+    for name in MIGRATIONS:
+        if name in done:
+            continue
+        module = importlib.import_module(f"{__name__}.{name}")
+        with engine.begin() as conn:
+            module.upgrade(conn)
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": name})
+        applied.append(name)
+    return applied
@@ -0,0 +1,5 @@
+from . import upgrade
+
+if __name__ == "__main__":
+    applied = upgrade()
+    print(f"Migrações aplicadas: {', '.join(applied)}" if applied else "Banco já está atualizado.")
@@ -0,0 +1,22 @@
+"""Tabelas e colunas do rollup diário (metricas_diarias)."""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import add_column_if_missing, create_table_if_missing
+
+
+def upgrade(conn: Connection) -> None:
+    if not create_table_if_missing(conn, models.MetricaDiaria):
+        add_column_if_missing(conn, "metricas_diarias", "pedidos_entregues", "INTEGER DEFAULT 0")
+        add_column_if_missing(conn, "metricas_diarias", "custo_cancelamento", "NUMERIC DEFAULT 0")
+        add_column_if_missing(conn, "metricas_diarias", "total_avaliacoes", "INTEGER DEFAULT 0")
+        # O upsert do rollup depende da chave (unidade, dia)
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_metricas_diarias_unidade_dia "
+                "ON metricas_diarias (id_unidade, data_referencia)"
+            )
+        )
+    create_table_if_missing(conn, models.MetricaDiariaStatus)
+    create_table_if_missing(conn, models.RollupEstado)
@@ -0,0 +1,26 @@
+"""Índices dos caminhos quentes de pedidos, itens_pedido e feedbacks.
+
+Criados a partir dos `Index` declarados nos modelos, com `checkfirst`, então
+reaplicar é inofensivo. Em bases grandes de Postgres prefira criá-los antes
+com `CREATE INDEX CONCURRENTLY` (mesmos nomes); a migração então só registra
+a versão.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import table_exists
+
+
+def upgrade(conn: Connection) -> None:
+    for model in (models.Pedido, models.ItemPedido, models.Feedback):
+        if not table_exists(conn, model.__tablename__):
+            continue
+        primary_key = list(model.__table__.primary_key.columns)
+        existing = {c["name"] for c in inspect(conn).get_columns(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if list(index.columns) == primary_key:  # o PK já tem índice
+                continue
+            # Índices de colunas criadas por migrações posteriores ficam para elas
+            if {c.name for c in index.columns} <= existing:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,9 @@
+"""Tabela clientes_primeiro_pedido (novos vs recorrentes e coortes)."""
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import create_table_if_missing
+
+
+def upgrade(conn: Connection) -> None:
+    create_table_if_missing(conn, models.ClientePrimeiroPedido)
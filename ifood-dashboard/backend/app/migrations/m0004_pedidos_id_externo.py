@@ -0,0 +1,14 @@
+"""Coluna pedidos.id_externo e seu índice único (idempotência da ingestão)."""
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import add_column_if_missing, table_exists
+
+
+def upgrade(conn: Connection) -> None:
+    if not table_exists(conn, "pedidos"):
+        return
+    add_column_if_missing(conn, "pedidos", "id_externo", "VARCHAR(64)")
+    for index in models.Pedido.__table__.indexes:
+        if index.name == "ux_pedidos_id_externo":
+            index.create(conn, checkfirst=True)
@@ -0,0 +1,9 @@
+"""Tabela coleta_cursores (posição da coleta incremental por unidade)."""
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import create_table_if_missing
+
+
+def upgrade(conn: Connection) -> None:
+    create_table_if_missing(conn, models.ColetaCursor)
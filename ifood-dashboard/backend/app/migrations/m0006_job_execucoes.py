@@ -0,0 +1,9 @@
+"""Tabela job_execucoes (histórico dos jobs agendados)."""
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import create_table_if_missing
+
+
+def upgrade(conn: Connection) -> None:
+    create_table_if_missing(conn, models.JobExecucao)
@@ -0,0 +1,32 @@
+"""Acrescenta updated_at a ix_pedidos_unidade_data e ix_pedidos_data.
+
+Com a coluna no fim do índice, a marca d'água das ETags (contagem e último
+`updated_at` do período, ver app/httpcache.py) é lida só do índice. Bases
+criadas antes têm os índices sem a coluna: são recriados com o mesmo nome.
+No Postgres, em bases grandes, prefira recriá-los antes com
+`CREATE INDEX CONCURRENTLY`; a migração então só registra a versão.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import table_exists
+
+WIDENED = ("ix_pedidos_unidade_data", "ix_pedidos_data")
+
+
+def upgrade(conn: Connection) -> None:
+    if not table_exists(conn, "pedidos"):
+        return
+    if "updated_at" not in {c["name"] for c in inspect(conn).get_columns("pedidos")}:
+        return
+    existing = {i["name"]: i["column_names"] for i in inspect(conn).get_indexes("pedidos")}
+    for index in models.Pedido.__table__.indexes:
+        if index.name not in WIDENED:
+            continue
+        wanted = [c.name for c in index.columns]
+        if existing.get(index.name) == wanted:
+            continue
+        if index.name in existing:
+            index.drop(conn)
+        index.create(conn)
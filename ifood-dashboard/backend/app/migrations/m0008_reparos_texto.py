@@ -0,0 +1,9 @@
+"""Tabela reparos_texto (progresso do reparo de mojibake, app/textfix.py)."""
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import create_table_if_missing
+
+
+def upgrade(conn: Connection) -> None:
+    create_table_if_missing(conn, models.ReparoTexto)
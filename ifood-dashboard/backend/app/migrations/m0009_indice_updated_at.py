@@ -0,0 +1,23 @@
+"""Índice em pedidos.updated_at.
+
+O snapshot colunar (app/columnar.py) lê o último `updated_at` a cada consulta
+e depois só as linhas alteradas desde a marca anterior; o rollup incremental
+faz o mesmo a cada execução. Sem o índice, as duas leituras varrem a tabela.
+Em bases grandes de Postgres prefira criá-lo antes com
+`CREATE INDEX CONCURRENTLY` (mesmo nome); a migração então só registra a versão.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import table_exists
+
+
+def upgrade(conn: Connection) -> None:
+    if not table_exists(conn, "pedidos"):
+        return
+    if "updated_at" not in {c["name"] for c in inspect(conn).get_columns("pedidos")}:
+        return
+    for index in models.Pedido.__table__.indexes:
+        if index.name == "ix_pedidos_updated_at":
+            index.create(conn, checkfirst=True)
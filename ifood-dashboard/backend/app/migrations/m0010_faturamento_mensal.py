@@ -0,0 +1,32 @@
+"""Tabela faturamento_mensal (faturamento por unidade e mês, app/rollup.py).
+
+Os meses já consolidados em `metricas_diarias` são somados na criação; daí
+em diante o rollup incremental mantém a tabela.
+"""
+from datetime import date
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import insert, inspect, select
+from sqlalchemy.engine import Connection
+
+from .. import models
+from . import create_table_if_missing, table_exists
+
+TOTALS = ("total_faturamento", "total_pedidos", "pedidos_entregues")
+
+
+def upgrade(conn: Connection) -> None:
+    if not create_table_if_missing(conn, models.FaturamentoMensal) or not table_exists(conn, "metricas_diarias"):
+        return
+    # Bases antigas podem não ter todas as colunas de total: as ausentes contam zero
+    existing = {c["name"] for c in inspect(conn).get_columns("metricas_diarias")}
+    totals = [name for name in TOTALS if name in existing]
+    daily = models.MetricaDiaria.__table__
+    months: Dict[Tuple[int, date], Dict[str, Any]] = {}
+    for row in conn.execute(select(daily.c.id_unidade, daily.c.data_referencia, *(daily.c[name] for name in totals))):
+        key = (row.id_unidade, row.data_referencia.replace(day=1))
+        month = months.setdefault(key, {"id_unidade": key[0], "mes": key[1], **dict.fromkeys(TOTALS, 0)})
+        for name in totals:
+            month[name] += row._mapping[name] or 0
+    if months:
+        conn.execute(insert(models.FaturamentoMensal.__table__), list(months.values()))
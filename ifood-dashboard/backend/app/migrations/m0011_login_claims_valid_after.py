@@ -0,0 +1,10 @@
+"""Coluna login.claims_valid_after: corte compartilhado das claims embutidas no token (app/principal.py)."""
+from sqlalchemy.engine import Connection
+
+from . import add_column_if_missing, table_exists
+
+
+def upgrade(conn: Connection) -> None:
+    if not table_exists(conn, "login"):
+        return
+    add_column_if_missing(conn, "login", "claims_valid_after", "TIMESTAMP WITH TIME ZONE")
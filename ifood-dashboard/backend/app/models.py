@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -11,6 +11,8 @@ class Login(Base):
     id_unidade = Column(Integer, ForeignKey("unidades.id"), nullable=True)
     role = Column(String, default="user")
     last_login = Column(DateTime(timezone=True))
+    # Tokens emitidos antes disso não têm as claims de papel/unidade confiáveis (app/principal.py)
+    claims_valid_after = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -26,7 +28,20 @@ class Unidade(Base):
 
 class Pedido(Base):
     __tablename__ = "pedidos"
+    # Filtros quentes: unidade/status + intervalo de data_pedido (ver app/queries.py);
+    # updated_at no fim cobre a marca d'água das ETags sem ler a tabela
+    __table_args__ = (
+        Index("ix_pedidos_unidade_data", "id_unidade", "data_pedido", "updated_at"),
+        Index("ix_pedidos_status_data", "status", "data_pedido"),
+        Index("ix_pedidos_data", "data_pedido", "updated_at"),
+        Index("ix_pedidos_cliente_data", "id_cliente", "data_pedido"),
+        # Último updated_at e linhas alteradas desde uma marca (app/columnar.py, app/rollup.py)
+        Index("ix_pedidos_updated_at", "updated_at"),
+        # Chave de idempotência da ingestão (app/ingest.py)
+        Index("ux_pedidos_id_externo", "id_externo", unique=True),
+    )
     id = Column(Integer, primary_key=True, index=True)
+    id_externo = Column(String(64))
     id_cliente = Column(Integer)
     id_unidade = Column(Integer, ForeignKey("unidades.id"))
     id_regiao_entrega = Column(Integer)
@@ -41,8 +56,30 @@ class Pedido(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class Produto(Base):
+    __tablename__ = "produtos"
+    id = Column(Integer, primary_key=True, index=True)
+    nome = Column(String, nullable=False)
+
+class ItemPedido(Base):
+    __tablename__ = "itens_pedido"
+    id = Column(Integer, primary_key=True, index=True)
+    id_pedido = Column(Integer, ForeignKey("pedidos.id"), index=True)
+    id_produto = Column(Integer, ForeignKey("produtos.id"))
+    quantidade = Column(Integer, default=1)
+    preco_unitario = Column(Numeric, default=0)
+
+class Feedback(Base):
+    __tablename__ = "feedbacks"
+    id = Column(Integer, primary_key=True, index=True)
+    id_pedido = Column(Integer, ForeignKey("pedidos.id"), index=True)
+    nota = Column(Integer)
+    tipo_feedback = Column(String)
+    comentario = Column(String)
+
 class MetricaDiaria(Base):
     __tablename__ = "metricas_diarias"
+    __table_args__ = (UniqueConstraint("id_unidade", "data_referencia", name="uq_metricas_diarias_unidade_dia"),)
     id = Column(Integer, primary_key=True, index=True)
     id_unidade = Column(Integer, ForeignKey("unidades.id"))
     data_referencia = Column(Date)
@@ -50,5 +87,84 @@ class MetricaDiaria(Base):
     total_pedidos = Column(Integer, default=0)
     total_cancelamentos = Column(Integer, default=0)
     media_nota = Column(Numeric, default=0)
+    # Permitem recombinar dias em intervalos sem média de médias
+    pedidos_entregues = Column(Integer, default=0)
+    custo_cancelamento = Column(Numeric, default=0)
+    total_avaliacoes = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class MetricaDiariaStatus(Base):
+    __tablename__ = "metricas_diarias_status"
+    __table_args__ = (UniqueConstraint("id_unidade", "data_referencia", "status", name="uq_metricas_status_unidade_dia"),)
+    id = Column(Integer, primary_key=True, index=True)
+    id_unidade = Column(Integer, ForeignKey("unidades.id"))
+    data_referencia = Column(Date, nullable=False)
+    status = Column(String, nullable=False)
+    total = Column(Integer, default=0)
+
+class ClientePrimeiroPedido(Base):
+    """Primeiro pedido de cada cliente, mantido por app/clientes.py."""
+    __tablename__ = "clientes_primeiro_pedido"
+    __table_args__ = (Index("ix_clientes_primeiro_pedido_data", "primeira_data"),)
+    id_cliente = Column(Integer, primary_key=True, autoincrement=False)
+    id_pedido = Column(Integer)
+    id_unidade = Column(Integer, ForeignKey("unidades.id"))
+    primeiro_pedido_em = Column(DateTime, nullable=False)
+    primeira_data = Column(Date, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ColetaCursor(Base):
+    """Posição da coleta incremental de cada unidade na API do iFood (app/collector.py)."""
+    __tablename__ = "coleta_cursores"
+    id_unidade = Column(Integer, ForeignKey("unidades.id"), primary_key=True, autoincrement=False)
+    cursor = Column(String)
+    pedidos_coletados = Column(Integer, default=0)
+    ultimo_erro = Column(String)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class JobExecucao(Base):
+    """Histórico das execuções dos jobs agendados (app/scheduling.py)."""
+    __tablename__ = "job_execucoes"
+    __table_args__ = (Index("ix_job_execucoes_job_inicio", "job", "iniciado_em"),)
+    id = Column(Integer, primary_key=True)
+    job = Column(String, nullable=False)
+    # executando | ok | erro | ignorado (execução anterior ainda rodando)
+    status = Column(String, nullable=False)
+    instancia = Column(String)
+    iniciado_em = Column(DateTime(timezone=True), nullable=False)
+    terminado_em = Column(DateTime(timezone=True))
+    duracao_ms = Column(Integer)
+    erro = Column(String)
+
+class FaturamentoMensal(Base):
+    """Faturamento por unidade e mês, somado de metricas_diarias pelo rollup."""
+    __tablename__ = "faturamento_mensal"
+    __table_args__ = (UniqueConstraint("id_unidade", "mes", name="uq_faturamento_mensal_unidade_mes"),)
+    id = Column(Integer, primary_key=True, index=True)
+    id_unidade = Column(Integer, ForeignKey("unidades.id"))
+    mes = Column(Date, nullable=False)  # primeiro dia do mês
+    total_faturamento = Column(Numeric, default=0)
+    total_pedidos = Column(Integer, default=0)
+    pedidos_entregues = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class RollupEstado(Base):
+    """Watermark e cobertura de cada rollup incremental."""
+    __tablename__ = "rollup_estado"
+    nome = Column(String, primary_key=True)
+    watermark = Column(DateTime(timezone=True))
+    cobertura_inicio = Column(Date)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ReparoTexto(Base):
+    """Progresso do reparo de texto (mojibake) de cada coluna (app/textfix.py)."""
+    __tablename__ = "reparos_texto"
+    alvo = Column(String, primary_key=True)
+    ultimo_id = Column(Integer, nullable=False, default=0)
+    verificados = Column(Integer, nullable=False, default=0)
+    reparados = Column(Integer, nullable=False, default=0)
+    iniciado_em = Column(DateTime(timezone=True))
+    concluido_em = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
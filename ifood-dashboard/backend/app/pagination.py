@@ -0,0 +1,31 @@
+import base64
+import json
+from typing import Any, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(data_pedido: Any, pedido_id: int) -> str:
+    """Encode the keyset position `(data_pedido, id)` as an opaque token.
+
+    The timestamp is kept exactly as the driver returned it (ISO string for
+    `datetime` values, raw text on SQLite) so the next page compares against
+    the same representation that is stored in the table.
+    """
+    ts = data_pedido.isoformat(sep=" ") if hasattr(data_pedido, "isoformat") else str(data_pedido)
+    raw = json.dumps([ts, int(pedido_id)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Decode a token produced by `encode_cursor`.
+
+    Raises ValueError when the token is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, pedido_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(ts), int(pedido_id)
+    except Exception as exc:
+        raise ValueError("invalid cursor") from exc
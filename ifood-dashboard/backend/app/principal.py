@@ -0,0 +1,164 @@
+"""Authenticated principal and its per-token cache.
+
+`get_current_user` used to load the `Login` row on every request. The
+principal (id, email, role, unit) is now resolved once per token and kept in
+a bounded LRU for at most `PRINCIPAL_CACHE_TTL` seconds (and never past the
+token's expiry). Tokens issued with the `uid`, `role` and `unit` claims skip
+the database entirely.
+
+Changing a user's unit or role stamps `login.claims_valid_after` in the same
+flush and calls `principal_cache.invalidate(email)`: cached entries are
+dropped and tokens issued before that moment are resolved from the database
+again instead of trusting their claims. Every process reads the stamps
+written since its last read at most every `PRINCIPAL_SYNC_SECONDS`, so a
+change made by another worker (or before a restart) reaches it within that
+interval. Deleting a user is only seen by the process that did it; the
+others stop serving the cached entry after `PRINCIPAL_CACHE_TTL`.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .models import Login
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096"))
+AUTH_EMBED_CLAIMS = os.getenv("AUTH_EMBED_CLAIMS", "1") not in ("0", "false", "False")
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_SYNC_SECONDS = float(os.getenv("PRINCIPAL_SYNC_SECONDS", "5"))
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    role: str
+    id_unidade: Optional[int]
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(id=user.id, email=user.email, role=user.role or "user", id_unidade=user.id_unidade)
+
+    @classmethod
+    def from_claims(cls, payload: Dict[str, Any]) -> Optional["Principal"]:
+        if "uid" not in payload or "role" not in payload:
+            return None
+        return cls(id=int(payload["uid"]), email=payload["sub"], role=payload["role"], id_unidade=payload.get("unit"))
+
+    def claims(self) -> Dict[str, Any]:
+        return {"uid": self.id, "role": self.role, "unit": self.id_unidade}
+
+
+class PrincipalCache:
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Principal]]" = OrderedDict()
+        self._revoked_before: Dict[str, float] = {}
+        self._synced_at: Optional[float] = None
+        self._synced_upto: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str, payload: Dict[str, Any]) -> Hashable:
+        # Tokens antigos, sem iat, são identificados pelo próprio token
+        if "iat" in payload:
+            return payload["sub"], payload["iat"]
+        return token
+
+    def get(self, key: Hashable) -> Optional[Principal]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, principal: Principal, expires_at: float) -> None:
+        with self._lock:
+            self._data[key] = (min(expires_at, time.time() + PRINCIPAL_CACHE_TTL), principal)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def claims_trusted(self, payload: Dict[str, Any]) -> bool:
+        """Embedded claims are stale if the user changed after the token was issued."""
+        cutoff = self._revoked_before.get(payload.get("sub"))
+        return cutoff is None or payload.get("iat", 0) > cutoff
+
+    def invalidate(self, email: str, at: Optional[float] = None) -> None:
+        with self._lock:
+            self._revoke(email, time.time() if at is None else at)
+
+    def _revoke(self, email: str, at: float) -> None:
+        if at <= self._revoked_before.get(email, float("-inf")):
+            return
+        self._revoked_before[email] = at
+        for key in [k for k, (_, p) in self._data.items() if p.email == email]:
+            del self._data[key]
+
+    def sync_due(self) -> bool:
+        return self._synced_at is None or time.monotonic() - self._synced_at >= PRINCIPAL_SYNC_SECONDS
+
+    def sync(self, db: Session) -> None:
+        """Apply the `claims_valid_after` stamps written since the last read (by any process)."""
+        stmt = select(Login.email, Login.claims_valid_after).where(Login.claims_valid_after.is_not(None))
+        if self._synced_upto is not None:
+            # >=: a marca repetida não muda nada, e uma gravada no mesmo instante não se perde
+            stmt = stmt.where(Login.claims_valid_after >= self._synced_upto)
+        rows = db.execute(stmt).all()
+        with self._lock:
+            for email, stamp in rows:
+                self._revoke(email, _epoch(stamp))
+                if self._synced_upto is None or _epoch(stamp) > _epoch(self._synced_upto):
+                    self._synced_upto = stamp
+            self._synced_at = time.monotonic()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._revoked_before.clear()
+            self._synced_at = None
+            self._synced_upto = None
+
+
+def _epoch(value: datetime) -> float:
+    # SQLite devolve o instante sem fuso; é gravado em UTC
+    return (value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+principal_cache = PrincipalCache()
+
+
+def _stamp_claims_change(mapper, connection, target) -> None:
+    attrs = inspect(target).attrs
+    if attrs.id_unidade.history.has_changes() or attrs.role.history.has_changes():
+        target.claims_valid_after = datetime.now(timezone.utc)
+
+
+def _on_user_update(mapper, connection, target) -> None:
+    attrs = inspect(target).attrs
+    if attrs.claims_valid_after.history.has_changes() and target.claims_valid_after is not None:
+        principal_cache.invalidate(target.email, _epoch(target.claims_valid_after))
+
+
+def _on_user_delete(mapper, connection, target) -> None:
+    principal_cache.invalidate(target.email)
+
+
+def install_user_change_hooks() -> None:
+    """Invalidate cached principals when a user's unit or role changes."""
+    if not event.contains(Login, "after_update", _on_user_update):
+        event.listen(Login, "before_update", _stamp_claims_change)
+        event.listen(Login, "after_update", _on_user_update)
+        event.listen(Login, "after_delete", _on_user_delete)
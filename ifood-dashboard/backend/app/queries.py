@@ -0,0 +1,774 @@
+"""Analytics queries, built with SQLAlchemy Core and compiled once per shape.
+
+Every `/metrics`, `/insights` and `/dashboard` query is registered here
+under a name (the endpoint path, plus a suffix for variants) and written
+against a `Filtros`. Date arithmetic that differs between databases (hour,
+weekday, ISO week, minutes between timestamps) uses the dialect-aware
+functions below, so the same query runs on Postgres and SQLite.
+
+`build(name, f, dialect)` returns `(sql, params)` like the old hand-written
+builders, so results still go through `fetch_all`, `stream_query` and the
+single-flight keys. The SQL text is compiled once per
+`(name, dialect, filter shape)` and kept in an LRU cache. The shape is
+which filters are set, not their values. Builders therefore only check
+whether a filter is present and bind its value by name (see
+`Filtros.params`).
+
+Date filters are half-open ranges on the raw column
+(`data_pedido >= :start AND data_pedido < :end`), never `DATE(col) = ...`,
+so the indexes on `(id_unidade, data_pedido)` and `(status, data_pedido)`
+are usable. A `YYYY-MM-DD` end date includes the whole day; an ISO
+timestamp is used as the exclusive end.
+"""
+from dataclasses import dataclass, fields, replace
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, List, Tuple
+
+from sqlalchemy import and_, bindparam, case, desc, func, literal_column, or_, select
+from sqlalchemy.engine import Dialect
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement, Executable, FunctionElement
+from sqlalchemy.types import Date, Float, Integer, String
+
+from . import models
+from .cache import GENERATION_STATE
+
+COMPILED_CACHE_SIZE = 512
+
+
+@dataclass(frozen=True)
+class Filtros:
+    unit_id: int | None = None
+    start_date: str | None = None
+    end_date: str | None = None
+    date: str | None = None
+    limit: int | None = None
+
+    def shape(self) -> Tuple[bool, ...]:
+        return tuple(_present(getattr(self, f.name)) for f in fields(self))
+
+    @classmethod
+    def from_shape(cls, shape: Tuple[bool, ...]) -> "Filtros":
+        # Valores fictícios: os builders só podem testar presença, nunca embutir o valor
+        return cls(**{f.name: ... if present else None for f, present in zip(fields(cls), shape)})
+
+    def params(self) -> Dict[str, Any]:
+        """Bind values: `start`/`end` (timestamps) and `start_day`/`end_day`
+        (dates) bound the period, `month_start`/`month_end` the whole months
+        it touches, `day`/`day_start`/`day_end` the single day."""
+        values: Dict[str, Any] = {"unit_id": self.unit_id, "limit": self.limit}
+        if _present(self.start_date):
+            values["start"] = lower_bound(self.start_date, "start_date")
+            values["start_day"] = values["start"].date()
+            values["month_start"] = values["start_day"].replace(day=1)
+        if _present(self.end_date):
+            values["end"] = upper_bound(self.end_date, "end_date")
+            values["end_day"] = values["end"].date()
+            # Fim exclusivo: primeiro dia do mês seguinte ao último instante do período
+            last = (values["end"] - timedelta(microseconds=1)).date()
+            values["month_end"] = (last.replace(day=1) + timedelta(days=32)).replace(day=1)
+        if _present(self.date):
+            day = lower_bound(self.date, "date").date()
+            values["day"] = day
+            values["day_start"] = datetime.combine(day, time())
+            values["day_end"] = values["day_start"] + timedelta(days=1)
+        return {k: v for k, v in values.items() if _present(v)}
+
+    def whole_months(self) -> "Filtros":
+        """The same filter widened to the whole months its period touches."""
+        values = self.params()
+        return replace(
+            self,
+            start_date=values["month_start"].isoformat() if "month_start" in values else None,
+            end_date=(values["month_end"] - timedelta(days=1)).isoformat() if "month_end" in values else None,
+        )
+
+
+class InvalidFilter(ValueError):
+    """A date filter that is neither `YYYY-MM-DD` nor an ISO timestamp."""
+
+
+def _present(value: Any) -> bool:
+    # Query string vazia (`?start_date=`) conta como filtro ausente, como antes
+    return value is not None and value != ""
+
+
+def lower_bound(value: str, field: str = "date") -> datetime:
+    """Inclusive start of a date filter."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilter(f"{field} must be YYYY-MM-DD or an ISO timestamp") from None
+
+
+def upper_bound(value: str, field: str = "date") -> datetime:
+    """Exclusive end of a date filter: the next midnight for a plain day."""
+    bound = lower_bound(value, field)
+    return bound + timedelta(days=1) if len(value) == 10 else bound
+
+
+def bind_values(params: Dict[str, Any], dialect: str) -> Dict[str, Any]:
+    """Adapt date bounds to what the driver compares correctly."""
+    if dialect != "sqlite":
+        return params
+    # O SQLite guarda timestamps como texto "YYYY-MM-DD HH:MM:SS[.ffffff]";
+    # str() produz esse mesmo formato e a comparação de texto preserva a ordem
+    return {k: str(v) if isinstance(v, date) else v for k, v in params.items()}
+
+
+# ---------------------------
+# Funções dependentes do banco
+# ---------------------------
+
+class hour_of(FunctionElement):
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(hour_of)
+def _hour_of(element, compiler, **kw):
+    return "EXTRACT(HOUR FROM %s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(hour_of, "sqlite")
+def _hour_of_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%%H', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+class weekday_of(FunctionElement):
+    """Day of week, 0 = Sunday."""
+
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(weekday_of)
+def _weekday_of(element, compiler, **kw):
+    return "EXTRACT(DOW FROM %s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(weekday_of, "sqlite")
+def _weekday_of_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%%w', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+class iso_week(FunctionElement):
+    """ISO week as `YYYY-WW` (e.g. `2024-07`)."""
+
+    type = String()
+    inherit_cache = True
+
+
+@compiles(iso_week)
+def _iso_week(element, compiler, **kw):
+    return "to_char(date_trunc('week', %s), 'IYYY-IW')" % compiler.process(element.clauses, **kw)
+
+
+@compiles(iso_week, "sqlite")
+def _iso_week_sqlite(element, compiler, **kw):
+    # A quinta-feira da semana define o ano e o número da semana ISO
+    thursday = "date(%s, '-3 days', 'weekday 4')" % compiler.process(element.clauses, **kw)
+    return f"printf('%s-%02d', strftime('%Y', {thursday}), (CAST(strftime('%j', {thursday}) AS INTEGER) - 1) / 7 + 1)"
+
+
+class month_of(FunctionElement):
+    """Month as `YYYY-MM`."""
+
+    type = String()
+    inherit_cache = True
+
+
+@compiles(month_of)
+def _month_of(element, compiler, **kw):
+    return "to_char(%s, 'YYYY-MM')" % compiler.process(element.clauses, **kw)
+
+
+@compiles(month_of, "sqlite")
+def _month_of_sqlite(element, compiler, **kw):
+    return "strftime('%%Y-%%m', %s)" % compiler.process(element.clauses, **kw)
+
+
+class minutes_between(FunctionElement):
+    """Minutes from the first timestamp to the second."""
+
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(minutes_between)
+def _minutes_between(element, compiler, **kw):
+    start, end = (compiler.process(c, **kw) for c in element.clauses)
+    return f"EXTRACT(EPOCH FROM ({end} - {start})) / 60.0"
+
+
+@compiles(minutes_between, "sqlite")
+def _minutes_between_sqlite(element, compiler, **kw):
+    start, end = (compiler.process(c, **kw) for c in element.clauses)
+    return f"(julianday({end}) - julianday({start})) * 1440.0"
+
+
+# ---------------------------
+# Tabelas e filtros comuns
+# ---------------------------
+
+p = models.Pedido.__table__.alias("p")
+ip = models.ItemPedido.__table__.alias("ip")
+pr = models.Produto.__table__.alias("pr")
+fb = models.Feedback.__table__.alias("f")
+u = models.Unidade.__table__.alias("u")
+m = models.MetricaDiaria.__table__.alias("m")
+ms = models.MetricaDiariaStatus.__table__.alias("s")
+c = models.ClientePrimeiroPedido.__table__.alias("c")
+fm = models.FaturamentoMensal.__table__.alias("fm")
+re_ = models.RollupEstado.__table__.alias("re")
+
+ENTREGUE = "Entregue"
+CANCELADO = "Cancelado"
+SEM_MOTIVO = "Sem motivo"
+
+
+def unit_scope(f: Filtros, col=p.c.id_unidade) -> List[ColumnElement]:
+    return [col == bindparam("unit_id")] if f.unit_id is not None else []
+
+
+def period(f: Filtros, col=p.c.data_pedido) -> List[ColumnElement]:
+    # Colunas DATE (rollup) comparam com dias; timestamps com o instante exato
+    start, end = ("start_day", "end_day") if isinstance(col.type, Date) else ("start", "end")
+    conditions = []
+    if f.start_date is not None:
+        conditions.append(col >= bindparam(start))
+    if f.end_date is not None:
+        conditions.append(col < bindparam(end))
+    return conditions
+
+
+def months(f: Filtros, col=p.c.data_pedido) -> List[ColumnElement]:
+    # Meses inteiros; no SQLite '2024-06-01' <= '2024-06-01 00:00:00' na comparação de texto
+    conditions = []
+    if f.start_date is not None:
+        conditions.append(col >= bindparam("month_start"))
+    if f.end_date is not None:
+        conditions.append(col < bindparam("month_end"))
+    return conditions
+
+
+def in_day(col=p.c.data_pedido) -> ColumnElement:
+    return and_(col >= bindparam("day_start"), col < bindparam("day_end"))
+
+
+def _limited(stmt, f: Filtros):
+    return stmt.limit(bindparam("limit", type_=Integer)) if f.limit is not None else stmt
+
+
+def _products_joined():
+    return ip.join(pr, pr.c.id == ip.c.id_produto).join(p, p.c.id == ip.c.id_pedido)
+
+
+# ---------------------------
+# Registro de consultas
+# ---------------------------
+
+Builder = Callable[[Filtros], Executable]
+QUERIES: Dict[str, Builder] = {}
+
+
+def query(name: str) -> Callable[[Builder], Builder]:
+    def register(builder: Builder) -> Builder:
+        QUERIES[name] = builder
+        return builder
+
+    return register
+
+
+@query("metrics/monthly-revenue")
+def monthly_revenue(f: Filtros):
+    return (
+        select(u.c.nome.label("unidade"), month_of(fm.c.mes).label("mes"), fm.c.total_faturamento.label("faturamento_total"))
+        .select_from(fm.join(u, u.c.id == fm.c.id_unidade))
+        .where(*unit_scope(f, fm.c.id_unidade), *months(f, fm.c.mes))
+        .order_by(fm.c.mes, u.c.nome)
+    )
+
+
+@query("metrics/monthly-revenue@pedidos")
+def monthly_revenue_from_orders(f: Filtros):
+    # Meses ainda fora do rollup (ver rollup.months_covered)
+    mes = month_of(p.c.data_pedido).label("mes")
+    return (
+        select(u.c.nome.label("unidade"), mes, func.coalesce(func.sum(p.c.valor_total), 0).label("faturamento_total"))
+        .select_from(p.join(u, u.c.id == p.c.id_unidade))
+        .where(p.c.status == ENTREGUE, *unit_scope(f), *months(f))
+        .group_by(u.c.nome, literal_column("mes"))
+        .order_by(literal_column("mes"), u.c.nome)
+    )
+
+
+@query("metrics/orders-by-status")
+def orders_by_status(f: Filtros):
+    return (
+        select(p.c.status, func.count().label("total"))
+        .where(*unit_scope(f), *period(f))
+        .group_by(p.c.status)
+        .order_by(p.c.status)
+    )
+
+
+@query("metrics/top-selling-products")
+def top_selling_products(f: Filtros):
+    total = func.sum(ip.c.quantidade).label("total_vendido")
+    return (
+        select(pr.c.nome, total)
+        .select_from(_products_joined())
+        .where(p.c.status == ENTREGUE, *period(f))
+        .group_by(pr.c.nome)
+        .order_by(desc(total))
+        .limit(5)
+    )
+
+
+@query("metrics/average-ratings")
+def average_ratings(f: Filtros):
+    return (
+        select(u.c.nome.label("unidade"), func.avg(fb.c.nota).label("media_nota"))
+        .select_from(fb.join(p, p.c.id == fb.c.id_pedido).join(u, u.c.id == p.c.id_unidade))
+        .where(*period(f))
+        .group_by(u.c.nome)
+        .order_by(u.c.nome)
+    )
+
+
+@query("metrics/weekly-orders")
+def weekly_orders(f: Filtros):
+    semana = iso_week(p.c.data_pedido).label("semana")
+    return (
+        select(semana, func.count().label("total_pedidos"))
+        .where(*period(f))
+        .group_by(literal_column("semana"))
+        .order_by(literal_column("semana"))
+    )
+
+
+@query("metrics/top-products-revenue")
+def top_products_revenue(f: Filtros):
+    receita = func.sum(ip.c.quantidade * ip.c.preco_unitario).label("receita")
+    stmt = (
+        select(pr.c.nome.label("produto"), receita)
+        .select_from(_products_joined())
+        .where(p.c.status == ENTREGUE, *unit_scope(f), *period(f))
+        .group_by(pr.c.nome)
+        .order_by(desc(receita))
+    )
+    return _limited(stmt, f)
+
+
+@query("metrics/daily-revenue")
+def daily_revenue(f: Filtros):
+    dia = func.date(p.c.data_pedido)
+    return (
+        select(
+            dia.label("dia"),
+            func.sum(p.c.valor_total).label("faturamento"),
+            func.avg(p.c.valor_total).label("ticket_medio"),
+        )
+        .where(p.c.status == ENTREGUE, *period(f), *unit_scope(f))
+        .group_by(dia)
+        .order_by(literal_column("dia"))
+    )
+
+
+@query("metrics/cancellation-cost")
+def cancellation_cost(f: Filtros):
+    return (
+        select(func.coalesce(func.sum(p.c.valor_total), 0).label("custo_cancelamento"))
+        .select_from(p)
+        .where(p.c.status == CANCELADO, *unit_scope(f), *period(f))
+    )
+
+
+@query("metrics/daily-cumulative-revenue")
+def daily_cumulative_revenue(f: Filtros):
+    return (
+        select(p.c.data_pedido.label("ts"), p.c.valor_total)
+        .where(in_day(), p.c.status == ENTREGUE, *unit_scope(f))
+        .order_by(p.c.data_pedido)
+    )
+
+
+@query("metrics/daily-accept-time-by-hour")
+def daily_accept_time_by_hour(f: Filtros):
+    return (
+        select(
+            hour_of(p.c.data_pedido).label("hora"),
+            func.avg(minutes_between(p.c.data_pedido, p.c.data_aceite)).label("tempo_medio"),
+        )
+        .where(in_day(), p.c.data_aceite.is_not(None), *unit_scope(f))
+        .group_by(literal_column("hora"))
+        .order_by(literal_column("hora"))
+    )
+
+
+@query("metrics/daily-cancellations-by-hour")
+def daily_cancellations_by_hour(f: Filtros):
+    return (
+        select(
+            hour_of(p.c.data_pedido).label("hora"),
+            func.coalesce(p.c.motivo_cancelamento, literal_column(f"'{SEM_MOTIVO}'")).label("motivo"),
+            func.count().label("qtd"),
+        )
+        .where(in_day(), p.c.status == CANCELADO, *unit_scope(f))
+        .group_by(literal_column("hora"), literal_column("motivo"))
+        .order_by(literal_column("hora"), literal_column("motivo"))
+    )
+
+
+@query("metrics/daily-overview:kpis")
+def daily_overview_kpis(f: Filtros):
+    entregue = p.c.status == ENTREGUE
+    return (
+        select(
+            func.count().label("total_pedidos"),
+            func.sum(case((entregue, p.c.valor_total), else_=0)).label("faturamento_dia"),
+            func.avg(minutes_between(p.c.data_pedido, p.c.data_aceite)).label("tempo_medio_aceite"),
+            func.avg(
+                case(
+                    (
+                        and_(entregue, p.c.data_aceite.is_not(None), p.c.data_entrega.is_not(None)),
+                        minutes_between(p.c.data_aceite, p.c.data_entrega),
+                    )
+                )
+            ).label("tempo_medio_entrega"),
+        )
+        .select_from(p)
+        .where(in_day(), *unit_scope(f))
+    )
+
+
+@query("metrics/daily-overview:status")
+def daily_overview_status(f: Filtros):
+    return select(p.c.status, func.count().label("total")).where(in_day(), *unit_scope(f)).group_by(p.c.status)
+
+
+@query("metrics/daily-overview:clientes")
+def daily_overview_clientes(f: Filtros):
+    # Cliente ainda fora de clientes_primeiro_pedido (job não rodou) é novo
+    d = bindparam("day")
+    return (
+        select(
+            func.sum(case((or_(c.c.primeira_data.is_(None), c.c.primeira_data >= d), 1), else_=0)).label("novos"),
+            func.sum(case((c.c.primeira_data < d, 1), else_=0)).label("recorrentes"),
+        )
+        .select_from(p.outerjoin(c, c.c.id_cliente == p.c.id_cliente))
+        .where(in_day(), p.c.id_cliente.is_not(None), *unit_scope(f))
+    )
+
+
+@query("metrics/daily-overview:clientes@historico")
+def daily_overview_clientes_historico(f: Filtros):
+    # Antes do backfill de clientes_primeiro_pedido: primeiro pedido calculado do histórico
+    h = models.Pedido.__table__.alias("h")
+    primeiros = (
+        select(h.c.id_cliente, func.min(func.date(h.c.data_pedido)).label("primeira_data"))
+        .where(h.c.id_cliente.is_not(None))
+        .group_by(h.c.id_cliente)
+        .cte("primeiros_pedidos")
+    )
+    d = bindparam("day")
+    return (
+        select(
+            func.sum(case((primeiros.c.primeira_data == d, 1), else_=0)).label("novos"),
+            func.sum(case((primeiros.c.primeira_data < d, 1), else_=0)).label("recorrentes"),
+        )
+        .select_from(p.join(primeiros, primeiros.c.id_cliente == p.c.id_cliente))
+        .where(in_day(), *unit_scope(f))
+    )
+
+
+@query("dashboard/daily:pedidos")
+def daily_bundle_orders(f: Filtros):
+    return (
+        select(
+            p.c.id_cliente, p.c.data_pedido, p.c.status, p.c.valor_total,
+            p.c.motivo_cancelamento, p.c.data_aceite, p.c.data_entrega,
+        )
+        .where(in_day(), *unit_scope(f))
+        .order_by(p.c.data_pedido)
+    )
+
+
+def _clientes_do_dia(f: Filtros):
+    return select(p.c.id_cliente).where(in_day(), p.c.id_cliente.is_not(None), *unit_scope(f))
+
+
+@query("dashboard/daily:recorrentes")
+def daily_bundle_returning(f: Filtros):
+    return select(c.c.id_cliente).where(
+        c.c.primeira_data < bindparam("day"), c.c.id_cliente.in_(_clientes_do_dia(f))
+    )
+
+
+@query("dashboard/daily:recorrentes@historico")
+def daily_bundle_returning_historico(f: Filtros):
+    h = models.Pedido.__table__.alias("h")
+    return (
+        select(h.c.id_cliente)
+        .distinct()
+        .where(h.c.data_pedido < bindparam("day_start"), h.c.id_cliente.in_(_clientes_do_dia(f)))
+    )
+
+
+@query("dashboard/monthly:pedidos")
+def monthly_bundle_orders(f: Filtros):
+    dia = func.date(p.c.data_pedido)
+    return (
+        select(
+            dia.label("dia"),
+            p.c.status,
+            func.count().label("total"),
+            func.coalesce(func.sum(p.c.valor_total), 0).label("valor"),
+        )
+        .where(*unit_scope(f), *period(f))
+        .group_by(dia, p.c.status)
+    )
+
+
+@query("insights/top-cancelled-products")
+def top_cancelled_products(f: Filtros):
+    qtd = func.sum(ip.c.quantidade).label("qtd_cancelada")
+    perda = func.sum(ip.c.quantidade * ip.c.preco_unitario).label("perda_total")
+    stmt = (
+        select(pr.c.nome.label("produto"), qtd, perda)
+        .select_from(_products_joined())
+        .where(p.c.status == CANCELADO, *unit_scope(f), *period(f))
+        .group_by(pr.c.nome)
+        .order_by(desc(qtd), desc(perda))
+    )
+    return _limited(stmt, f)
+
+
+@query("insights/orders-heatmap")
+def orders_heatmap(f: Filtros):
+    return (
+        select(
+            weekday_of(p.c.data_pedido).label("dow"),
+            hour_of(p.c.data_pedido).label("hora"),
+            func.count().label("qtd"),
+        )
+        .where(*unit_scope(f), *period(f))
+        .group_by(literal_column("dow"), literal_column("hora"))
+        .order_by(literal_column("dow"), literal_column("hora"))
+    )
+
+
+@query("insights/customer-cohorts")
+def customer_cohorts(f: Filtros):
+    """Distinct customers per first-order month (`coorte`) and active month (`mes`).
+
+    The period filters the cohorts; orders after it still count as activity.
+    """
+    coorte = month_of(c.c.primeiro_pedido_em).label("coorte")
+    mes = month_of(p.c.data_pedido).label("mes")
+    return (
+        select(coorte, mes, func.count(func.distinct(p.c.id_cliente)).label("clientes"))
+        .select_from(c.join(p, p.c.id_cliente == c.c.id_cliente))
+        .where(*period(f, c.c.primeira_data), *unit_scope(f, c.c.id_unidade), *unit_scope(f))
+        .group_by(literal_column("coorte"), literal_column("mes"))
+        .order_by(literal_column("coorte"), literal_column("mes"))
+    )
+
+
+@query("insights/negative-feedbacks")
+def negative_feedbacks(f: Filtros):
+    negativo = or_(
+        fb.c.nota <= 2,
+        func.lower(fb.c.tipo_feedback) == func.lower("Reclamação"),
+        fb.c.tipo_feedback.ilike("Reclam%"),
+    )
+    stmt = (
+        select(
+            fb.c.id,
+            fb.c.nota,
+            fb.c.tipo_feedback,
+            func.coalesce(fb.c.comentario, "").label("comentario"),
+            p.c.id.label("id_pedido"),
+            p.c.data_pedido,
+            func.coalesce(p.c.motivo_cancelamento, "").label("motivo_cancelamento"),
+        )
+        .select_from(fb.join(p, p.c.id == fb.c.id_pedido))
+        .where(negativo, *unit_scope(f), *period(f))
+        .order_by(fb.c.nota.asc(), p.c.data_pedido.desc())
+    )
+    return _limited(stmt, f)
+
+
+# Variantes servidas pelo rollup `metricas_diarias` quando o intervalo inteiro
+# já está consolidado (ver `rollup.covers`).
+
+def _rollup_scope(f: Filtros, t) -> List[ColumnElement]:
+    return [*period(f, t.c.data_referencia), *unit_scope(f, t.c.id_unidade)]
+
+
+@query("metrics/orders-by-status@rollup")
+def orders_by_status_rollup(f: Filtros):
+    return (
+        select(ms.c.status, func.sum(ms.c.total).label("total"))
+        .where(*_rollup_scope(f, ms))
+        .group_by(ms.c.status)
+        .order_by(ms.c.status)
+    )
+
+
+@query("metrics/average-ratings@rollup")
+def average_ratings_rollup(f: Filtros):
+    media = func.sum(m.c.media_nota * m.c.total_avaliacoes) * literal_column("1.0") / func.sum(m.c.total_avaliacoes)
+    return (
+        select(u.c.nome.label("unidade"), media.label("media_nota"))
+        .select_from(m.join(u, u.c.id == m.c.id_unidade))
+        .where(*_rollup_scope(f, m), m.c.total_avaliacoes > 0)
+        .group_by(u.c.nome)
+        .order_by(u.c.nome)
+    )
+
+
+@query("metrics/daily-revenue@rollup")
+def daily_revenue_rollup(f: Filtros):
+    faturamento = func.sum(m.c.total_faturamento)
+    entregues = func.sum(m.c.pedidos_entregues)
+    return (
+        select(
+            m.c.data_referencia.label("dia"),
+            faturamento.label("faturamento"),
+            (faturamento * literal_column("1.0") / entregues).label("ticket_medio"),
+        )
+        .where(*_rollup_scope(f, m))
+        .group_by(m.c.data_referencia)
+        .having(entregues > 0)
+        .order_by(literal_column("dia"))
+    )
+
+
+@query("metrics/cancellation-cost@rollup")
+def cancellation_cost_rollup(f: Filtros):
+    return (
+        select(func.coalesce(func.sum(m.c.custo_cancelamento), 0).label("custo_cancelamento"))
+        .select_from(m)
+        .where(*_rollup_scope(f, m))
+    )
+
+
+# ---------------------------
+# Marcas d'água (ETag, ver app/httpcache.py)
+# ---------------------------
+
+def _orders_scope(f: Filtros) -> List[ColumnElement]:
+    conditions = [*unit_scope(f), *period(f)]
+    if f.date is not None:
+        conditions.append(in_day())
+    return conditions
+
+
+def _orders_mark(f: Filtros):
+    return select(func.count(), func.max(p.c.updated_at)).select_from(p).where(*_orders_scope(f))
+
+
+def _children_mark(f: Filtros, t):
+    # Itens e avaliações não têm updated_at: a API só insere e apaga (o reenvio substitui),
+    # então contagem e último id mudam a cada escrita
+    return select(func.count(), func.max(t.c.id)).select_from(t.join(p, p.c.id == t.c.id_pedido)).where(*_orders_scope(f))
+
+
+@query("watermark")
+def watermark(f: Filtros):
+    """Cheap change marker of the data behind a response for the unit/period.
+
+    Orders give count (catches deletes) and last update; the rollup rows
+    move on their own schedule, so their last update is part of it too, and
+    so is the shared cache generation (rewrites that keep `updated_at`, such
+    as the text repair backfill, see `app.cache`).
+    """
+    orders = _orders_mark(f).subquery()
+    rollup_scope = _rollup_scope(f, m)
+    if f.date is not None:
+        rollup_scope.append(m.c.data_referencia == bindparam("day"))
+    rollup_mark = select(func.max(m.c.updated_at)).where(*rollup_scope).scalar_subquery()
+    generation = select(re_.c.watermark).where(re_.c.nome == GENERATION_STATE).scalar_subquery()
+    return select(
+        orders.c[0].label("pedidos"),
+        orders.c[1].label("pedidos_atualizados_em"),
+        rollup_mark.label("rollup_atualizado_em"),
+        generation.label("cache_geracao"),
+    )
+
+
+@query("watermark@monthly")
+def watermark_monthly(f: Filtros):
+    """`watermark` plus the monthly rollup rows (`f` already widened to whole months)."""
+    base = watermark(f).subquery()
+    scope = [*unit_scope(f, fm.c.id_unidade), *months(f, fm.c.mes)]
+    return select(base, select(func.max(fm.c.updated_at)).where(*scope).scalar_subquery().label("mensal_atualizado_em"))
+
+
+@query("watermark@clientes")
+def watermark_clientes(f: Filtros):
+    """`watermark` plus the first-order table the cohort endpoint reads."""
+    base = watermark(f).subquery()
+    scope = [*period(f, c.c.primeira_data), *unit_scope(f, c.c.id_unidade)]
+    return select(
+        base,
+        select(func.count()).select_from(c).where(*scope).scalar_subquery().label("clientes"),
+        select(func.max(c.c.updated_at)).where(*scope).scalar_subquery().label("clientes_atualizados_em"),
+    )
+
+
+@query("watermark@detalhes")
+def watermark_detalhes(f: Filtros):
+    """`watermark` plus the items, feedbacks and products read by the product and rating endpoints.
+
+    Editing a child row in place outside the API is not seen; the text
+    repair backfill moves the cache generation instead.
+    """
+    base = watermark(f).subquery()
+    itens = _children_mark(f, ip).subquery()
+    avaliacoes = _children_mark(f, fb).subquery()
+    produtos = select(func.count(), func.max(pr.c.id)).select_from(pr).subquery()
+    return select(
+        base,
+        itens.c[0].label("itens"),
+        itens.c[1].label("itens_ultimo_id"),
+        avaliacoes.c[0].label("feedbacks"),
+        avaliacoes.c[1].label("feedbacks_ultimo_id"),
+        produtos.c[0].label("produtos"),
+        produtos.c[1].label("produtos_ultimo_id"),
+    )
+
+
+# ---------------------------
+# Compilação
+# ---------------------------
+
+@lru_cache(maxsize=None)
+def _dialect(name: str) -> Dialect:
+    # paramstyle "named" gera `:nome`, o formato que `text()` aceita em qualquer driver
+    return make_url(f"{name}://").get_dialect()(paramstyle="named")
+
+
+@lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def _compiled(name: str, dialect: str, shape: Tuple[bool, ...]) -> Tuple[str, Dict[str, Any], FrozenSet[str]]:
+    stmt = QUERIES[name](Filtros.from_shape(shape))
+    compiled = stmt.compile(dialect=_dialect(dialect))
+    # Constantes do próprio SQL (status, limites fixos); os filtros vêm de Filtros.params()
+    constants = {k: v for k, v in compiled.params.items() if v is not None and v is not ...}
+    return str(compiled), constants, frozenset(compiled.params)
+
+
+def build(name: str, f: Filtros, dialect: str) -> Tuple[str, Dict[str, Any]]:
+    """SQL text and parameters of query `name` for filter `f` on `dialect`."""
+    sql, constants, names = _compiled(name, dialect, f.shape())
+    # Só os parâmetros que a consulta usa: mantém estáveis as chaves do single-flight
+    values = {k: v for k, v in f.params().items() if k in names}
+    return sql, {**constants, **bind_values(values, dialect)}
+
+
+def cache_info():
+    return _compiled.cache_info()
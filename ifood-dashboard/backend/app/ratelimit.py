@@ -0,0 +1,258 @@
+"""Token-bucket rate limiting shared by every worker.
+
+Each limit ("5/minute") is a bucket of `count` tokens refilled continuously
+at `count / period` tokens per second; a request takes one token or is
+rejected with 429 and a `Retry-After` of the time until the next token.
+The bucket state lives in a backend chosen by `RATE_LIMIT_URL`:
+
+- `sqlite:///path` (default: `ifood-ratelimit.db` in the temp dir): a small
+  SQLite file in WAL mode shared by the workers of one host. Each check is a
+  single atomic UPSERT, so concurrent workers never hand out the same token.
+  It runs in the threadpool and waits at most `RATE_LIMIT_SQLITE_TIMEOUT_MS`
+  for the write lock; past that the request goes through, as on any error.
+- `redis://...`: a Lua script on a shared Redis, for several hosts
+  (requires the optional `redis` package).
+- `memory://`: per-process dict; each worker enforces its own limit.
+
+The routes declare their limits as FastAPI dependencies (see `main.py`), so
+they run after routing for the matched route only; authenticated routes are
+keyed by user id, the login routes by client address. If the backend fails
+the request is let through and the error is logged.
+"""
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Protocol, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") not in ("0", "false", "False")
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SQLITE_TIMEOUT_MS = int(os.getenv("RATE_LIMIT_SQLITE_TIMEOUT_MS", "100"))
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"rate limit {name!r} exceeded")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """'10/minute' -> (capacity 10, refill 10/60 tokens per second)."""
+    try:
+        count, period = rate.split("/")
+        count = int(count)
+        seconds = _PERIODS[period.strip().rstrip("s")]
+    except (ValueError, KeyError):
+        raise ValueError(f"invalid rate {rate!r}, expected e.g. '10/minute'")
+    if count <= 0:
+        raise ValueError(f"invalid rate {rate!r}, count must be positive")
+    return count, count / seconds
+
+
+class RateLimitBackend(Protocol):
+    # Backends com I/O (arquivo, rede) bloqueiam: o limitador os chama fora do event loop
+    blocking: bool
+
+    def take(self, key: str, capacity: int, refill: float, now: float) -> float:
+        """Take one token; return 0 when granted, else seconds until one is available."""
+        ...
+
+    def clear(self) -> None: ...
+
+
+class MemoryBackend:
+    """Per-process buckets; idle (already full) buckets are dropped past `max_keys`."""
+
+    blocking = False
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float, int, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, refill: float, now: float) -> float:
+        with self._lock:
+            tokens, updated, _, _ = self._buckets.get(key, (capacity, now, capacity, refill))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            if tokens < 1:
+                return (1 - tokens) / refill
+            self._buckets[key] = (tokens - 1, now, capacity, refill)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return 0.0
+
+    def _prune(self, now: float) -> None:
+        # Balde cheio de novo equivale a balde inexistente
+        full = [k for k, (t, u, c, r) in self._buckets.items() if t + (now - u) * r >= c]
+        for key in full:
+            del self._buckets[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    """Buckets in a SQLite file shared by the processes of one host."""
+
+    blocking = True
+    PRUNE_EVERY = 10000
+
+    _TAKE = """
+        INSERT INTO buckets (key, tokens, updated, capacity, refill) VALUES (?1, ?2 - 1, ?3, ?2, ?4)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(?2, tokens + (?3 - updated) * ?4) - 1, updated = ?3, capacity = ?2, refill = ?4
+        WHERE min(?2, tokens + (?3 - updated) * ?4) >= 1
+    """
+
+    def __init__(self, path: str, timeout_ms: int = RATE_LIMIT_SQLITE_TIMEOUT_MS):
+        self.path = path
+        self.timeout_ms = timeout_ms
+        self._local = threading.local()
+        self._takes = 0
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: cada UPSERT é uma transação atômica por si só
+            # Espera curta pela trava de escrita: com os workers disputando o arquivo,
+            # melhor liberar a requisição do que segurá-la
+            conn = sqlite3.connect(self.path, timeout=self.timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Estado descartável: não vale um fsync por requisição
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL,"
+                " capacity INTEGER NOT NULL, refill REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, capacity: int, refill: float, now: float) -> float:
+        conn = self._connect()
+        granted = conn.execute(self._TAKE, (key, capacity, now, refill)).rowcount
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM buckets WHERE tokens + (? - updated) * refill >= capacity", (now,))
+        if granted:
+            return 0.0
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * refill) if row else 0.0
+        # Negado pelo UPSERT: mesmo que um token tenha acabado de voltar, espera algo > 0
+        return max((1 - tokens) / refill, 0.001)
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM buckets")
+
+
+class RedisBackend:
+    """Buckets in Redis, updated atomically by a Lua script."""
+
+    blocking = True
+
+    _SCRIPT = """
+        local capacity, refill, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + (now - updated) * refill)
+        if tokens < 1 then
+            return tostring((1 - tokens) / refill)
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill))
+        return '0'
+    """
+
+    def __init__(self, url: str, prefix: str = "ifood:ratelimit:"):
+        import redis  # dependência opcional
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self._SCRIPT)
+        self._prefix = prefix
+
+    def take(self, key: str, capacity: int, refill: float, now: float) -> float:
+        return float(self._take(keys=[self._prefix + key], args=[capacity, refill, now]))
+
+    def clear(self) -> None:
+        for key in self._redis.scan_iter(f"{self._prefix}*"):
+            self._redis.delete(key)
+
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.enabled = enabled
+        self.allowed: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+        self._rates: Dict[str, Tuple[int, float]] = {}
+
+    def check(self, name: str, key: str, rate: str) -> None:
+        """Take a token from `name`'s bucket for `key`; raise RateLimitExceeded if empty."""
+        if not self.enabled:
+            return
+        parsed = self._rates.get(rate)
+        if parsed is None:
+            parsed = self._rates[rate] = parse_rate(rate)
+        capacity, refill = parsed
+        try:
+            # Relógio de parede: os workers (e hosts, no Redis) precisam da mesma referência
+            wait = self.backend.take(f"{name}:{key}", capacity, refill, time.time())
+        except Exception:
+            logger.exception("rate limit indisponível; liberando a requisição")
+            return
+        if wait > 0:
+            self.rejected[name] = self.rejected.get(name, 0) + 1
+            raise RateLimitExceeded(name, wait)
+        self.allowed[name] = self.allowed.get(name, 0) + 1
+
+    async def check_async(self, name: str, key: str, rate: str) -> None:
+        if self.enabled and self.backend.blocking:
+            await run_in_threadpool(self.check, name, key, rate)
+        else:
+            # Memória: mais barato que o salto para o threadpool
+            self.check(name, key, rate)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self.allowed.clear()
+        self.rejected.clear()
+
+
+def retry_after_header(exc: RateLimitExceeded) -> str:
+    return str(max(1, math.ceil(exc.retry_after)))
+
+
+def _make_backend(url: Optional[str] = RATE_LIMIT_URL) -> RateLimitBackend:
+    if url is None:
+        url = "sqlite:///" + os.path.join(tempfile.gettempdir(), "ifood-ratelimit.db")
+    if url.startswith("redis"):
+        try:
+            return RedisBackend(url)
+        except ImportError:
+            logger.warning("RATE_LIMIT_URL aponta para o Redis, mas o pacote 'redis' não está instalado; limite por processo")
+            return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url != "memory://":
+        logger.warning("RATE_LIMIT_URL %r não reconhecida; limite por processo", url)
+    return MemoryBackend()
+
+
+limiter = RateLimiter(_make_backend())
@@ -0,0 +1,378 @@
+"""Incremental daily rollup of `pedidos` into `metricas_diarias`.
+
+The job keeps a watermark on `pedidos.updated_at`: each run finds the
+(unit, day) pairs touched since the last watermark, recomputes only those
+days and upserts them. The watermark trails the database clock by
+`ROLLUP_LAG_SECONDS` and every run re-reads from it: `updated_at` has
+second resolution on SQLite and is the transaction start on Postgres, so a
+row can commit with a timestamp at or before the previous run. Days in that
+overlap are simply recomputed again; only transactions longer than the lag
+can still be missed. The months of those days are then summed again from
+`metricas_diarias` into `faturamento_mensal` (normally just the current
+month). When a day before today is recomputed, the run also publishes a
+new cache generation (`app.cache.publish_invalidation`): the rollup only
+runs on the leader, and the other workers' caches would otherwise keep
+those closed ranges until they expire. Historical data is loaded once with:
+
+    python -m app.rollup backfill --start 2024-01-01 [--end 2024-12-31]
+"""
+import argparse
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, case, delete, func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import publish_invalidation, result_cache
+from .database import ReadSession, SessionLocal, fetch_one_async
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "metricas_diarias"
+ROLLUP_INTERVAL_MINUTES = int(os.getenv("ROLLUP_INTERVAL_MINUTES", "5"))
+ROLLUP_LAG_SECONDS = int(os.getenv("ROLLUP_LAG_SECONDS", "120"))
+
+Pedido = models.Pedido
+
+
+def as_date(value: Any) -> date:
+    """Day of a DATE/timestamp value as returned by any driver."""
+    # DATE() volta como texto no SQLite e como date no Postgres
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def parse_day(value: Optional[str]) -> Optional[date]:
+    """Parse a `YYYY-MM-DD` filter; None for empty or timestamp-like values."""
+    if not value or len(value) != 10:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def upsert(db: Session, table, rows: List[Dict[str, Any]], keys: List[str]) -> None:
+    """Insert `rows` into `table`, updating the ones whose `keys` exist (and their `updated_at`)."""
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"rollup upsert not supported on {dialect}")
+    stmt = insert(table).values(rows)
+    updates = {c: stmt.excluded[c] for c in rows[0] if c not in keys}
+    updates["updated_at"] = func.now()
+    db.execute(stmt.on_conflict_do_update(index_elements=keys, set_=updates))
+
+
+def recompute_day(db: Session, day: date) -> Set[int]:
+    """Rebuild every unit's rollup rows for `day`; return the unit ids touched."""
+    start, end = _day_bounds(day)
+    in_day = and_(Pedido.data_pedido >= start, Pedido.data_pedido < end)
+    entregue = Pedido.status == "Entregue"
+    cancelado = Pedido.status == "Cancelado"
+
+    totals = db.execute(
+        select(
+            Pedido.id_unidade,
+            func.count().label("total_pedidos"),
+            func.coalesce(func.sum(case((entregue, Pedido.valor_total), else_=0)), 0).label("total_faturamento"),
+            func.coalesce(func.sum(case((entregue, 1), else_=0)), 0).label("pedidos_entregues"),
+            func.coalesce(func.sum(case((cancelado, 1), else_=0)), 0).label("total_cancelamentos"),
+            func.coalesce(func.sum(case((cancelado, Pedido.valor_total), else_=0)), 0).label("custo_cancelamento"),
+        )
+        .where(in_day, Pedido.id_unidade.is_not(None))
+        .group_by(Pedido.id_unidade)
+    ).all()
+    ratings = {
+        r.id_unidade: r
+        for r in db.execute(
+            select(
+                Pedido.id_unidade,
+                func.count(models.Feedback.nota).label("total_avaliacoes"),
+                func.avg(models.Feedback.nota).label("media_nota"),
+            )
+            .join(Pedido, Pedido.id == models.Feedback.id_pedido)
+            .where(in_day)
+            .group_by(Pedido.id_unidade)
+        )
+    }
+    rows = []
+    for t in totals:
+        r = ratings.get(t.id_unidade)
+        rows.append(
+            {
+                "id_unidade": t.id_unidade,
+                "data_referencia": day,
+                "total_pedidos": t.total_pedidos,
+                "total_faturamento": t.total_faturamento,
+                "pedidos_entregues": t.pedidos_entregues,
+                "total_cancelamentos": t.total_cancelamentos,
+                "custo_cancelamento": t.custo_cancelamento,
+                "total_avaliacoes": r.total_avaliacoes if r else 0,
+                "media_nota": r.media_nota if r and r.media_nota is not None else 0,
+            }
+        )
+    units = {row["id_unidade"] for row in rows}
+
+    # Unidades que não têm mais pedidos no dia (ex.: pedido movido) saem do rollup
+    stale = delete(models.MetricaDiaria).where(models.MetricaDiaria.data_referencia == day)
+    if units:
+        stale = stale.where(models.MetricaDiaria.id_unidade.not_in(units))
+    db.execute(stale)
+    upsert(db, models.MetricaDiaria.__table__, rows, ["id_unidade", "data_referencia"])
+
+    # O conjunto de status varia por dia, então a quebra é regravada inteira
+    db.execute(delete(models.MetricaDiariaStatus).where(models.MetricaDiariaStatus.data_referencia == day))
+    status_rows = [
+        {"id_unidade": r.id_unidade, "data_referencia": day, "status": r.status, "total": r.total}
+        for r in db.execute(
+            select(Pedido.id_unidade, Pedido.status, func.count().label("total"))
+            .where(in_day, Pedido.id_unidade.is_not(None), Pedido.status.is_not(None))
+            .group_by(Pedido.id_unidade, Pedido.status)
+        )
+    ]
+    if status_rows:
+        db.execute(models.MetricaDiariaStatus.__table__.insert(), status_rows)
+    return units
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(month: date) -> date:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def recompute_month(db: Session, month: date) -> None:
+    """Rebuild `faturamento_mensal` for `month` from the daily rollup rows."""
+    month = month_start(month)
+    daily = models.MetricaDiaria
+    totals = db.execute(
+        select(
+            daily.id_unidade,
+            func.coalesce(func.sum(daily.total_faturamento), 0).label("total_faturamento"),
+            func.coalesce(func.sum(daily.total_pedidos), 0).label("total_pedidos"),
+            func.coalesce(func.sum(daily.pedidos_entregues), 0).label("pedidos_entregues"),
+        )
+        .where(daily.data_referencia >= month, daily.data_referencia < _next_month(month))
+        .group_by(daily.id_unidade)
+    ).all()
+    rows = [{**t._mapping, "mes": month} for t in totals]
+    stale = delete(models.FaturamentoMensal).where(models.FaturamentoMensal.mes == month)
+    if rows:
+        stale = stale.where(models.FaturamentoMensal.id_unidade.not_in([r["id_unidade"] for r in rows]))
+    db.execute(stale)
+    upsert(db, models.FaturamentoMensal.__table__, rows, ["id_unidade", "mes"])
+
+
+def current_watermark(db: Session) -> datetime:
+    """Next watermark: the database clock minus `ROLLUP_LAG_SECONDS` (same clock as `updated_at`)."""
+    now = db.execute(select(func.now())).scalar()
+    return now.replace(microsecond=0) - timedelta(seconds=ROLLUP_LAG_SECONDS)
+
+
+def changed_since(watermark: datetime):
+    """Orders written at or after `watermark`; re-reading an overlap is harmless, skipping one is not.
+
+    One extra second: SQLite compares the stored "HH:MM:SS" text with the
+    bound "HH:MM:SS.ffffff" and would drop rows of the watermark's own second.
+    """
+    return Pedido.updated_at >= watermark - timedelta(seconds=1)
+
+
+def _get_state(db: Session) -> Optional[models.RollupEstado]:
+    return db.get(models.RollupEstado, ROLLUP_NAME)
+
+
+def run_incremental(db: Session) -> List[Tuple[int, date]]:
+    """Recompute the days changed since the watermark.
+
+    Returns the (unit, day) pairs that were refreshed. Without a previous
+    state only today is rolled up; older days need an explicit backfill.
+    """
+    state = _get_state(db)
+    if state is None or state.watermark is None:
+        today = date.today()
+        backfill(db, today, today)
+        return [(u, today) for u in _units_for_day(db, today)]
+
+    # Marca lida antes da varredura: o que for gravado durante ela cai na próxima
+    new_watermark = max(current_watermark(db), state.watermark)
+    dirty = db.execute(
+        select(Pedido.id_unidade, func.date(Pedido.data_pedido)).where(changed_since(state.watermark)).distinct()
+    ).all()
+    changed: Dict[date, Set[int]] = {}
+    for unit_id, day in dirty:
+        if day is not None:
+            changed.setdefault(as_date(day), set()).add(unit_id)
+    refreshed: List[Tuple[int, date]] = []
+    for day in sorted(changed):
+        units = recompute_day(db, day) | {u for u in changed[day] if u is not None}
+        refreshed.extend((u, day) for u in sorted(units))
+    for month in sorted({month_start(day) for day in changed}):
+        recompute_month(db, month)
+    if any(day < date.today() for day in changed):
+        publish_invalidation(db)
+    state.watermark = new_watermark
+    db.commit()
+    if refreshed:
+        logger.info("rollup %s: %d dia(s) recalculado(s)", ROLLUP_NAME, len({d for _, d in refreshed}))
+    return refreshed
+
+
+def _units_for_day(db: Session, day: date) -> List[int]:
+    return list(
+        db.execute(
+            select(models.MetricaDiaria.id_unidade).where(models.MetricaDiaria.data_referencia == day)
+        ).scalars()
+    )
+
+
+def backfill(db: Session, start: date, end: date) -> int:
+    """Recompute every day in [start, end], committing one day at a time.
+
+    The watermark is only initialized here (taken before the scan, so changes
+    made during the backfill are picked up by the next incremental run); an
+    existing watermark is left alone so incremental progress is not skipped.
+    """
+    watermark = current_watermark(db)
+    days = 0
+    day = start
+    while day <= end:
+        recompute_day(db, day)
+        db.commit()
+        days += 1
+        day += timedelta(days=1)
+    month = month_start(start)
+    while month <= end:
+        recompute_month(db, month)
+        db.commit()
+        month = _next_month(month)
+
+    state = _get_state(db)
+    if state is None:
+        state = models.RollupEstado(nome=ROLLUP_NAME, cobertura_inicio=start)
+        db.add(state)
+    if state.watermark is None:
+        state.watermark = watermark
+    if state.cobertura_inicio is None or (start < state.cobertura_inicio and end >= state.cobertura_inicio - timedelta(days=1)):
+        state.cobertura_inicio = start
+    publish_invalidation(db)
+    db.commit()
+    return days
+
+
+def covers(db: Session, start: Optional[date], end: Optional[date]) -> bool:
+    """True when every day in [start, end] is closed and already rolled up.
+
+    A day is closed once the watermark has moved past it, which also keeps
+    "today" on the raw tables.
+    """
+    if start is None or end is None or start > end:
+        return False
+    state = _get_state(db)
+    return state is not None and _state_covers(state.watermark, state.cobertura_inicio, start, end)
+
+
+async def covers_async(db: ReadSession, start: Optional[date], end: Optional[date]) -> bool:
+    """`covers` for async routes, reading the state with plain SQL."""
+    if start is None or end is None or start > end:
+        return False
+    state = await fetch_one_async(
+        db, "SELECT watermark, cobertura_inicio FROM rollup_estado WHERE nome = :nome", {"nome": ROLLUP_NAME}
+    )
+    return state is not None and _state_covers(state["watermark"], state["cobertura_inicio"], start, end)
+
+
+def _state_covers(watermark: Any, cobertura_inicio: Any, start: date, end: date) -> bool:
+    if watermark is None or cobertura_inicio is None:
+        return False
+    return as_date(cobertura_inicio) <= start and end < as_date(watermark)
+
+
+def months_covered(db: Session, first_month: Optional[date]) -> bool:
+    """True when `faturamento_mensal` is complete from `first_month` on (None: the first order's month).
+
+    A month is complete once the daily rollup covers it from its first day;
+    the current month follows the incremental runs.
+    """
+    state = _get_state(db)
+    if state is None or state.watermark is None or state.cobertura_inicio is None:
+        return False
+    if first_month is None:
+        first_month = db.execute(select(func.min(Pedido.data_pedido))).scalar()
+    return _month_covered(state.cobertura_inicio, first_month)
+
+
+async def months_covered_async(db: ReadSession, first_month: Optional[date]) -> bool:
+    """`months_covered` for async routes, reading with plain SQL."""
+    state = await fetch_one_async(
+        db, "SELECT watermark, cobertura_inicio FROM rollup_estado WHERE nome = :nome", {"nome": ROLLUP_NAME}
+    )
+    if state is None or state["watermark"] is None or state["cobertura_inicio"] is None:
+        return False
+    if first_month is None:
+        first_month = (await fetch_one_async(db, "SELECT MIN(data_pedido) AS primeiro FROM pedidos"))["primeiro"]
+    return _month_covered(state["cobertura_inicio"], first_month)
+
+
+def _month_covered(cobertura_inicio: Any, first_month: Any) -> bool:
+    # Sem pedidos: nada a cobrir
+    return first_month is None or as_date(cobertura_inicio) <= month_start(as_date(first_month))
+
+
+def run_incremental_job() -> None:
+    """Scheduler entry point: runs one incremental pass on its own session."""
+    db = SessionLocal()
+    try:
+        refreshed = run_incremental(db)
+        if refreshed:
+            result_cache.invalidate(refreshed)
+    except Exception:
+        # O wrapper de app/scheduling.py registra o erro no log e no histórico
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.rollup", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    bf = sub.add_parser("backfill", help="recalcula um intervalo histórico de dias")
+    bf.add_argument("--start", type=date.fromisoformat, required=True)
+    bf.add_argument("--end", type=date.fromisoformat, default=date.today())
+    sub.add_parser("run", help="executa uma passada incremental")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "backfill":
+            days = backfill(db, args.start, args.end)
+            print(f"{days} dia(s) recalculado(s) de {args.start} a {args.end}")
+        else:
+            refreshed = run_incremental(db)
+            print(f"{len(refreshed)} par(es) unidade/dia atualizados")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    _main()
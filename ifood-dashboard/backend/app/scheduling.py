@@ -0,0 +1,335 @@
+"""Background jobs: one leader across workers, with a run history.
+
+Every uvicorn/gunicorn worker starts the scheduler, but a job only does work
+in the process that holds the scheduler lock:
+
+- Postgres: a session-level advisory lock (`pg_try_advisory_lock`) held on a
+  dedicated connection. It goes away with the connection, so a dead leader
+  is replaced on the next attempt of another worker.
+- SQLite (and anything else): an exclusive `flock` on a file next to the
+  database (`SCHEDULER_LOCK_FILE` overrides the path), released by the OS
+  when the process exits.
+
+Each worker checks the lock every `LEADER_RENEW_SECONDS`: the leader
+confirms it still holds it (lease renewal) and the others try to take it
+(failover). Job runs are recorded in `job_execucoes` with their duration
+and error; a run that is due while the previous one is still going is
+skipped (and recorded as `ignorado`) instead of overlapping.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import socket
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional, Protocol
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .database import SessionLocal, engine as default_engine
+
+try:  # indisponível no Windows
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LEADER_RENEW_SECONDS = float(os.getenv("LEADER_RENEW_SECONDS", "15"))
+SCHEDULER_LOCK_KEY = int(os.getenv("SCHEDULER_LOCK_KEY", "7310019"))
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE")
+
+INSTANCE = f"{socket.gethostname()}:{os.getpid()}"
+
+# Sessão usada para gravar o histórico (substituível nos testes)
+history_session: Callable[[], Session] = SessionLocal
+
+
+class SchedulerLock(Protocol):
+    def acquire(self) -> bool: ...
+
+    def renew(self) -> bool: ...
+
+    def release(self) -> None: ...
+
+
+class AdvisoryLock:
+    """Postgres session-level advisory lock on its own (unpooled) connection."""
+
+    def __init__(self, engine: Engine, key: int = SCHEDULER_LOCK_KEY):
+        # Fora do pool do app: a conexão fica presa enquanto este processo for líder
+        self.engine = create_engine(engine.url, poolclass=NullPool)
+        self.key = key
+        self._conn: Optional[Connection] = None
+
+    def acquire(self) -> bool:
+        conn = self.engine.connect()
+        try:
+            got = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not got:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def renew(self) -> bool:
+        if self._conn is None:
+            return False
+        try:
+            held = self._conn.execute(
+                text(
+                    "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = :key"
+                    " AND pid = pg_backend_pid() AND granted"
+                ),
+                {"key": self.key},
+            ).scalar()
+            self._conn.commit()
+        except Exception:
+            logger.warning("scheduler: conexão do lock perdida", exc_info=True)
+            held = 0
+        if not held:
+            self.release()
+        return bool(held)
+
+    def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            self._conn.commit()
+        except Exception:
+            pass  # conexão já caiu: o lock foi junto
+        finally:
+            self._conn.close()
+            self._conn = None
+
+
+class FileLock:
+    """Exclusive, non-blocking `flock` on a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        if fcntl is None:
+            logger.warning("scheduler: sem fcntl, cada processo roda os jobs")
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        self._write_owner()
+        return True
+
+    def _write_owner(self) -> None:
+        # Só informativo: quem é o líder e quando renovou
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, f"{INSTANCE} {datetime.now(timezone.utc).isoformat()}\n".encode(), 0)
+
+    def renew(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._fd is None:
+            return False
+        self._write_owner()
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+def lock_for(engine: Engine) -> SchedulerLock:
+    if engine.dialect.name == "postgresql":
+        return AdvisoryLock(engine)
+    path = SCHEDULER_LOCK_FILE
+    if path is None:
+        database = engine.url.database if engine.dialect.name == "sqlite" else None
+        if database and database != ":memory:":
+            path = f"{database}.scheduler.lock"
+        else:
+            path = os.path.join(tempfile.gettempdir(), "ifood-scheduler.lock")
+    return FileLock(path)
+
+
+class LeaderElection:
+    def __init__(self, lock: SchedulerLock, renew_seconds: float = LEADER_RENEW_SECONDS):
+        self.lock = lock
+        self.renew_seconds = renew_seconds
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def step(self) -> bool:
+        """Renew the lease when leader, otherwise try to take over; return leadership."""
+        try:
+            if self.is_leader:
+                self.is_leader = self.lock.renew()
+                if not self.is_leader:
+                    logger.warning("scheduler: liderança perdida (%s)", INSTANCE)
+            else:
+                self.is_leader = self.lock.acquire()
+                if self.is_leader:
+                    logger.info("scheduler: %s assumiu os jobs", INSTANCE)
+        except Exception:
+            logger.exception("scheduler: falha ao verificar o lock")
+            self.is_leader = False
+        return self.is_leader
+
+    async def _loop(self) -> None:
+        while True:
+            await run_in_threadpool(self.step)
+            await asyncio.sleep(self.renew_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await run_in_threadpool(self.lock.release)
+        self.is_leader = False
+
+
+leader = LeaderElection(lock_for(default_engine))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _record_start(name: str) -> Optional[int]:
+    try:
+        with history_session() as db:
+            run = models.JobExecucao(job=name, status="executando", instancia=INSTANCE, iniciado_em=_now())
+            db.add(run)
+            db.commit()
+            return run.id
+    except Exception:
+        # Sem histórico (ex.: migração pendente) o job roda mesmo assim
+        logger.warning("scheduler: não foi possível registrar o início de %s", name, exc_info=True)
+        return None
+
+
+def _record_end(run_id: Optional[int], started: float, error: Optional[str]) -> None:
+    if run_id is None:
+        return
+    try:
+        with history_session() as db:
+            run = db.get(models.JobExecucao, run_id)
+            run.status = "erro" if error else "ok"
+            run.erro = error[:1000] if error else None
+            run.terminado_em = _now()
+            run.duracao_ms = int((time.perf_counter() - started) * 1000)
+            db.commit()
+    except Exception:
+        logger.warning("scheduler: não foi possível registrar o fim da execução %s", run_id, exc_info=True)
+
+
+def record_skip(name: str) -> None:
+    try:
+        with history_session() as db:
+            now = _now()
+            db.add(models.JobExecucao(job=name, status="ignorado", instancia=INSTANCE, iniciado_em=now, terminado_em=now))
+            db.commit()
+    except Exception:
+        logger.warning("scheduler: não foi possível registrar o salto de %s", name, exc_info=True)
+
+
+def job(name: str, fn: Callable[[], Any], election: Optional[LeaderElection] = None) -> Callable[[], Any]:
+    """Wrap a job: run only on the leader and record the run in `job_execucoes`."""
+    election = election or leader
+
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def run_async() -> None:
+            if not election.is_leader:
+                return
+            run_id = await run_in_threadpool(_record_start, name)
+            started, error = time.perf_counter(), None
+            try:
+                await fn()
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {exc}"
+                logger.exception("job %s falhou", name)
+            await run_in_threadpool(_record_end, run_id, started, error)
+
+        return run_async
+
+    @functools.wraps(fn)
+    def run_sync() -> None:
+        if not election.is_leader:
+            return
+        run_id = _record_start(name)
+        started, error = time.perf_counter(), None
+        try:
+            fn()
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            logger.exception("job %s falhou", name)
+        _record_end(run_id, started, error)
+
+    return run_sync
+
+
+def _on_max_instances(event) -> None:
+    # Execução anterior ainda rodando: esta é pulada em vez de sobrepor.
+    # Só o líder executa os jobs, então só ele registra o salto
+    if not leader.is_leader:
+        return
+    logger.warning("job %s ignorado: execução anterior ainda em andamento", event.job_id)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        record_skip(event.job_id)  # scheduler com thread própria
+    else:
+        # AsyncIOScheduler chama o listener no event loop: a escrita vai para uma thread
+        loop.run_in_executor(None, record_skip, event.job_id)
+
+
+def add_job(scheduler, name: str, fn: Callable[[], Any], minutes: float) -> None:
+    """Schedule `fn` every `minutes`, leader-only, never overlapping itself."""
+    scheduler.add_job(
+        job(name, fn), "interval", minutes=minutes, id=name, replace_existing=True, max_instances=1, coalesce=True
+    )
+
+
+def start(scheduler) -> None:
+    from apscheduler.events import EVENT_JOB_MAX_INSTANCES
+
+    scheduler.add_listener(_on_max_instances, EVENT_JOB_MAX_INSTANCES)
+    scheduler.start()
+    leader.start()
+
+
+async def stop(scheduler) -> None:
+    scheduler.shutdown(wait=False)
+    scheduler.remove_all_jobs()
+    scheduler.remove_listener(_on_max_instances)
+    await leader.stop()
@@ -0,0 +1,122 @@
+"""Password hashing on a bounded process pool.
+
+bcrypt burns a full core for hundreds of milliseconds per call. Running it
+inline held a Starlette threadpool slot, so a burst of logins starved the
+metric endpoints. Hashes are now computed in a small process pool with
+a cap on in-flight jobs; when the cap is reached callers get
+`HashPoolSaturated` right away instead of queueing behind the burst.
+
+Configuration:
+- BCRYPT_ROUNDS: cost factor for new hashes (default 12). Stored hashes with
+  a lower cost are transparently upgraded on the next successful login.
+- HASH_WORKERS: pool size (default: half the CPUs). 0 hashes inline.
+- HASH_MAX_PENDING: in-flight limit, running plus queued (default 4x workers).
+  0 disables the limit, so callers queue and are never rejected.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Optional
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(max(1, HASH_WORKERS) * 4)))
+
+
+class HashPoolSaturated(Exception):
+    """Raised when too many hash jobs are already in flight."""
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _verify(password: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+    except ValueError:
+        # Hash corrompido ou em formato desconhecido
+        return False
+
+
+def hash_cost(hashed: str) -> Optional[int]:
+    """Cost factor of a `$2b$12$...` hash, or None if it can't be parsed."""
+    parts = hashed.split("$")
+    try:
+        return int(parts[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = HASH_WORKERS, max_pending: int = HASH_MAX_PENDING, rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.rounds = rounds
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending > 0 else None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: fazer fork de um processo com threads e event loop não é seguro
+                ctx = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            return self._executor
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashPoolSaturated()
+        try:
+            if self.workers <= 0:
+                future: Future = Future()
+                try:
+                    future.set_result(fn(*args))
+                except Exception as exc:
+                    future.set_exception(exc)
+            else:
+                future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
+
+    def needs_rehash(self, hashed: str) -> bool:
+        cost = hash_cost(hashed)
+        return cost is not None and cost < self.rounds
+
+    def hash(self, password: str) -> str:
+        return self._submit(_hash, password, self.rounds).result()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._submit(_verify, password, hashed).result()
+
+    async def hash_async(self, password: str) -> str:
+        if self.workers <= 0:
+            return await asyncio.to_thread(self.hash, password)
+        return await asyncio.wrap_future(self._submit(_hash, password, self.rounds))
+
+    async def verify_async(self, password: str, hashed: str) -> bool:
+        if self.workers <= 0:
+            return await asyncio.to_thread(self.verify, password, hashed)
+        return await asyncio.wrap_future(self._submit(_verify, password, hashed))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,100 @@
+"""Coalescing of identical in-flight queries.
+
+When a shift starts, many managers of the same unit open the same page at
+once and every request would run the same SQL. `SingleFlight.do(key, fn)`
+lets the first caller (the leader) run `fn` while concurrent callers with
+the same key wait for its result. The leader's exception is raised to every
+waiter as well. Waiters give up after `timeout` seconds with
+`SingleFlightTimeout`. If the leader is cancelled (e.g. the client went
+away), one of the waiters becomes the new leader.
+
+Configuration:
+- SINGLEFLIGHT_ENABLED: default on.
+- SINGLEFLIGHT_TIMEOUT: seconds a waiter waits for the leader (default 30).
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") not in ("0", "false", "False")
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "30"))
+
+
+class SingleFlightTimeout(Exception):
+    """Raised to a waiter whose leader did not finish within the timeout."""
+
+
+def query_key(sql: str, params: Optional[Mapping[str, Any]]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """Whitespace-insensitive key for a `(sql, params)` pair."""
+    normalized = " ".join(sql.split())
+    return normalized, tuple(sorted((k, repr(v)) for k, v in (params or {}).items()))
+
+
+class SingleFlight:
+    def __init__(self, timeout: float = SINGLEFLIGHT_TIMEOUT, enabled: bool = SINGLEFLIGHT_ENABLED):
+        self.timeout = timeout
+        self.enabled = enabled
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        copy: Optional[Callable[[Any], Any]] = None,
+    ) -> Any:
+        """Run `fn()` once per key among concurrent callers.
+
+        Waiters receive `copy(result)` when `copy` is given, so they can
+        change their result without affecting the others.
+        """
+        if not self.enabled:
+            return await fn()
+        while True:
+            call = self._calls.get(key)
+            if call is None:
+                break
+            try:
+                result = await asyncio.wait_for(asyncio.shield(call), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise SingleFlightTimeout(f"query still running after {self.timeout:.0f}s") from None
+            except asyncio.CancelledError:
+                if call.cancelled():
+                    continue  # o líder desistiu; este chamador assume
+                raise
+            self.coalesced += 1
+            return copy(result) if copy else result
+
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        self.executions += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as exc:
+            call.set_exception(exc)
+            call.exception()  # sem espera, não há quem consuma a exceção
+            raise
+        else:
+            # Os que esperam recebem cópias de um instantâneo: o líder pode alterar o seu
+            call.set_result(copy(result) if copy else result)
+            return result
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "in_flight": len(self._calls),
+        }
+
+
+singleflight = SingleFlight()
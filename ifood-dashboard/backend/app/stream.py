@@ -0,0 +1,363 @@
+"""Server-Sent Events for the daily page (`GET /stream/daily`).
+
+Every unit with open streams has one `DailyFeed` per worker: a single loop
+polls `pedidos` every `STREAM_POLL_SECONDS` for the rows whose `updated_at`
+moved (index `ix_pedidos_updated_at`) and fans the changes out to all of its
+subscribers, so N open dashboards cost one query per interval instead of N.
+`POST /ingest/pedidos` wakes the loops right after writing.
+
+A connection first gets a `snapshot` event with today's counters, then one
+`delta` per poll that changed something: new orders, status changes and the
+updated totals (revenue of delivered orders, orders per status and per
+hour). Event ids are `<feed>:<seq>`; the last `STREAM_REPLAY_EVENTS` events
+are kept, so a reconnect with `Last-Event-ID` gets only what it missed (or a
+new snapshot when the id is gone). A comment line every
+`STREAM_HEARTBEAT_SECONDS` keeps proxies from closing idle connections,
+streams are closed after `STREAM_MAX_SECONDS` (the browser reconnects and
+resumes), and `STREAM_MAX_SUBSCRIBERS` caps the open streams per worker.
+
+Like the columnar snapshot, a row committed with an `updated_at` older than
+the last mark (a long Postgres transaction) is only seen after the day
+rolls over. A new cache generation (`app.cache`: rewrites that keep
+`updated_at`, like the text repair backfill) empties the replay logs, so a
+reconnect gets a fresh snapshot instead of the old events.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import result_cache
+from .database import SessionLocal
+from .queries import CANCELADO, ENTREGUE, SEM_MOTIVO
+
+logger = logging.getLogger(__name__)
+
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "2"))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "600"))
+STREAM_MAX_SUBSCRIBERS = int(os.getenv("STREAM_MAX_SUBSCRIBERS", "200"))
+STREAM_REPLAY_EVENTS = int(os.getenv("STREAM_REPLAY_EVENTS", "1000"))
+# Feed sem assinantes continua vivo por um tempo: a reconexão retoma pelo Last-Event-ID
+STREAM_IDLE_SECONDS = float(os.getenv("STREAM_IDLE_SECONDS", "60"))
+# Eventos pendentes por conexão; quem não acompanha é desconectado e retoma depois
+QUEUE_SIZE = 256
+RETRY_MS = 3000
+
+p = models.Pedido.__table__
+_COLUMNS = (p.c.id, p.c.status, p.c.valor_total, p.c.data_pedido, p.c.motivo_cancelamento)
+
+
+class StreamSaturated(Exception):
+    """The worker already holds `STREAM_MAX_SUBSCRIBERS` open streams."""
+
+
+@dataclass(frozen=True)
+class Order:
+    status: Optional[str]
+    valor_total: float
+    data_pedido: datetime
+    motivo: Optional[str]
+
+    def as_dict(self, order_id: int) -> Dict[str, Any]:
+        return {
+            "id": order_id,
+            "status": self.status,
+            "valor_total": self.valor_total,
+            "ts": self.data_pedido.isoformat(),
+            "hora": self.data_pedido.hour,
+            "motivo": (self.motivo or SEM_MOTIVO) if self.status == CANCELADO else None,
+        }
+
+
+def _order(row: Any) -> Order:
+    placed = row.data_pedido
+    if not isinstance(placed, datetime):  # SQLite sem tipo declarado devolve texto
+        placed = datetime.fromisoformat(str(placed))
+    return Order(row.status, float(row.valor_total or 0), placed.replace(tzinfo=None), row.motivo_cancelamento)
+
+
+def format_event(event_id: str, kind: str, data: Dict[str, Any]) -> str:
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@dataclass(eq=False)
+class Subscription:
+    feed: "DailyFeed"
+    queue: "asyncio.Queue[Optional[str]]" = field(default_factory=lambda: asyncio.Queue(QUEUE_SIZE))
+    backlog: List[str] = field(default_factory=list)
+    lagged: bool = False
+
+    def push(self, message: str) -> None:
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Esvazia e encerra: o cliente reconecta e retoma pelo Last-Event-ID
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class DailyFeed:
+    """Today's orders of one unit (`None`: all units), polled once for all subscribers."""
+
+    def __init__(self, hub: "StreamHub", unit_id: Optional[int]):
+        self.hub = hub
+        self.unit_id = unit_id
+        self.key = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.day: Optional[date] = None
+        self.mark: Optional[datetime] = None
+        self.orders: Dict[int, Order] = {}
+        self.log: Deque[Tuple[int, str]] = deque(maxlen=hub.replay_events)
+        self.subscribers: Set[Subscription] = set()
+        self.wakeup = asyncio.Event()
+        self.idle_since: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # Leitura do banco (em thread) --------------------------------------
+
+    def _poll(self, db: Session) -> List[Tuple[str, Dict[str, Any]]]:
+        today = self.hub.today()
+        # Marca lida antes das linhas: o que mudar durante a leitura aparece na próxima
+        mark = db.execute(select(func.max(p.c.updated_at))).scalar()
+        lower = datetime.combine(today, datetime.min.time())
+        stmt = select(*_COLUMNS).where(p.c.data_pedido >= lower, p.c.data_pedido < lower + timedelta(days=1))
+        if self.unit_id is not None:
+            stmt = stmt.where(p.c.id_unidade == self.unit_id)
+        if today != self.day:
+            self.orders = {r.id: _order(r) for r in db.execute(stmt)}
+            self.day, self.mark = today, mark
+            return [("snapshot", self.totals())]
+        if mark is None:
+            return []
+        # Relê sempre desde um segundo antes da marca: o SQLite grava updated_at em segundos
+        # (uma alteração no mesmo segundo não move a marca); linhas iguais ao estado são ignoradas
+        if self.mark is not None:
+            stmt = stmt.where(p.c.updated_at >= self.mark - timedelta(seconds=1))
+        rows = db.execute(stmt).all()
+        self.mark = mark
+        novos, alterados = [], []
+        for row in rows:
+            order, previous = _order(row), self.orders.get(row.id)
+            if previous == order:
+                continue
+            self.orders[row.id] = order
+            if previous is None:
+                novos.append(order.as_dict(row.id))
+            elif previous.status != order.status or previous.valor_total != order.valor_total:
+                alterados.append({**order.as_dict(row.id), "anterior": previous.status})
+        if not novos and not alterados:
+            return []
+        return [("delta", {"novos": novos, "status": alterados, **self.totals()})]
+
+    def totals(self) -> Dict[str, Any]:
+        por_status: Dict[Optional[str], int] = {}
+        por_hora: Dict[int, int] = {}
+        faturamento = 0.0
+        for order in self.orders.values():
+            por_status[order.status] = por_status.get(order.status, 0) + 1
+            por_hora[order.data_pedido.hour] = por_hora.get(order.data_pedido.hour, 0) + 1
+            if order.status == ENTREGUE:
+                faturamento += order.valor_total
+        return {
+            "data": self.day.isoformat() if self.day else None,
+            "total_pedidos": len(self.orders),
+            "faturamento_dia": round(faturamento, 2),
+            "por_status": [{"status": s, "total": t} for s, t in sorted(por_status.items(), key=lambda x: str(x[0]))],
+            "por_hora": [{"hora": h, "total": t} for h, t in sorted(por_hora.items())],
+        }
+
+    def _run_poll(self) -> List[Tuple[str, Dict[str, Any]]]:
+        db = self.hub.session_factory()
+        try:
+            return self._poll(db)
+        finally:
+            db.close()
+
+    # Loop e assinantes --------------------------------------------------
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            await self._refresh_locked()
+
+    async def _refresh_locked(self) -> None:
+        try:
+            events = await run_in_threadpool(self._run_poll)
+        except Exception:
+            logger.exception("stream: leitura dos pedidos falhou (unidade %s)", self.unit_id)
+            return
+        self.hub.polls += 1
+        for kind, data in events:
+            self._publish(kind, data)
+
+    def _publish(self, kind: str, data: Dict[str, Any]) -> None:
+        self.seq += 1
+        message = format_event(f"{self.key}:{self.seq}", kind, data)
+        self.log.append((self.seq, message))
+        for subscription in list(self.subscribers):
+            subscription.push(message)
+
+    def attach(self, last_event_id: Optional[str]) -> Subscription:
+        """Register a subscriber; call with `_lock` held (`_poll` changes `orders` in a thread)."""
+        subscription = Subscription(self)
+        seq = self._resume_from(last_event_id)
+        if seq is not None:
+            subscription.backlog = [message for n, message in self.log if n > seq]
+        else:
+            # O snapshot leva o id do último evento: retomar dele repete só o que veio depois
+            subscription.backlog = [format_event(f"{self.key}:{self.seq}", "snapshot", self.totals())]
+        self.subscribers.add(subscription)
+        self.idle_since = None
+        return subscription
+
+    def _resume_from(self, last_event_id: Optional[str]) -> Optional[int]:
+        """Sequence to replay after, when every event since `last_event_id` is still in the log."""
+        key, _, seq = (last_event_id or "").partition(":")
+        if key != self.key or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        if int(seq) < self.seq and (not self.log or self.log[0][0] > int(seq) + 1):
+            return None
+        return int(seq)
+
+    def detach(self, subscription: Subscription) -> None:
+        self.subscribers.discard(subscription)
+        if not self.subscribers:
+            self.idle_since = asyncio.get_running_loop().time()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while self.subscribers or loop.time() - (self.idle_since or loop.time()) < self.hub.idle_seconds:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.hub.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                await self.refresh()
+        finally:
+            self.hub._drop(self)
+
+
+class StreamHub:
+    """The feeds of this worker, by unit, and the subscriber cap."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        poll_seconds: float = STREAM_POLL_SECONDS,
+        heartbeat_seconds: float = STREAM_HEARTBEAT_SECONDS,
+        max_seconds: float = STREAM_MAX_SECONDS,
+        max_subscribers: int = STREAM_MAX_SUBSCRIBERS,
+        replay_events: int = STREAM_REPLAY_EVENTS,
+        idle_seconds: float = STREAM_IDLE_SECONDS,
+        today: Callable[[], date] = date.today,
+    ):
+        self.session_factory = session_factory
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_seconds = max_seconds
+        self.max_subscribers = max_subscribers
+        self.replay_events = replay_events
+        self.idle_seconds = idle_seconds
+        self.today = today
+        self.feeds: Dict[Optional[int], DailyFeed] = {}
+        self.polls = 0
+        self.rejected = 0
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(feed.subscribers) for feed in self.feeds.values())
+
+    async def subscribe(self, unit_id: Optional[int], last_event_id: Optional[str] = None) -> Subscription:
+        """Attach to the unit's feed (starting it on first use); `StreamSaturated` past the cap."""
+        if self.subscribers >= self.max_subscribers:
+            self.rejected += 1
+            raise StreamSaturated()
+        feed = self.feeds.get(unit_id)
+        if feed is None:
+            feed = self.feeds[unit_id] = DailyFeed(self, unit_id)
+        # Com a trava: o snapshot não pode ler `orders` no meio de uma leitura do loop do feed
+        async with feed._lock:
+            if feed.day is None:
+                await feed._refresh_locked()
+            subscription = feed.attach(last_event_id)
+        feed.start()
+        return subscription
+
+    async def events(self, subscription: Subscription) -> AsyncIterator[str]:
+        """The SSE body of one connection; ends after `max_seconds` or when it falls behind."""
+        feed = subscription.feed
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_seconds
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            for message in subscription.backlog:
+                yield message
+            subscription.backlog = []
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), min(self.heartbeat_seconds, remaining))
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            feed.detach(subscription)
+
+    def wake(self) -> None:
+        """Poll every feed now (called after ingestion)."""
+        for feed in self.feeds.values():
+            feed.wakeup.set()
+
+    def reset_replay(self) -> None:
+        """Forget the events kept for resuming; reconnects get a new snapshot."""
+        for feed in self.feeds.values():
+            feed.log.clear()
+
+    def _drop(self, feed: DailyFeed) -> None:
+        if self.feeds.get(feed.unit_id) is feed:
+            del self.feeds[feed.unit_id]
+
+    async def close(self) -> None:
+        tasks = [feed._task for feed in self.feeds.values() if feed._task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.feeds.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"feeds": len(self.feeds), "subscribers": self.subscribers, "polls": self.polls, "rejected": self.rejected}
+
+
+hub = StreamHub()
+
+
+def _reset_replay() -> None:
+    hub.reset_replay()
+
+
+result_cache.on_generation_change(_reset_replay)
@@ -0,0 +1,225 @@
+"""Clean UTF-8 for the free-text columns, at write time and for old rows.
+
+Part of the loaded data came through a Latin-1/cp1252 step, so UTF-8 text
+was stored double-encoded ("HambÃºrguer" for "Hambúrguer"). `normalize`
+undoes that (up to two rounds) and applies NFC; it runs on every write of
+`produtos.nome`, `feedbacks.comentario` and `pedidos.motivo_cancelamento`:
+ingestion validates through it and `install_normalization_hooks` covers
+ORM assignments. Existing rows are repaired once by a batched backfill that
+walks each table by primary key, one short transaction per batch, and keeps
+its position in `reparos_texto` so an interrupted run picks up where it
+stopped:
+
+    python -m app.textfix backfill --batch-size 1000 --pause 0.05
+    python -m app.textfix report
+
+Repairs do not bump `pedidos.updated_at` (the rollup would recompute whole
+days for a text change); instead every batch that rewrote rows publishes a
+new cache generation (`app.cache.publish_invalidation`), which drops cached
+results, changes the ETags and resets each worker's columnar snapshot and
+stream replay.
+"""
+import argparse
+import logging
+import os
+import time
+import unicodedata
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, or_, select, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import publish_invalidation
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+TEXTFIX_BATCH_SIZE = int(os.getenv("TEXTFIX_BATCH_SIZE", "1000"))
+
+# tabela.coluna -> modelo; a chave também identifica o alvo em `reparos_texto`
+TARGETS: Dict[str, Tuple[Any, str]] = {
+    "produtos.nome": (models.Produto, "nome"),
+    "feedbacks.comentario": (models.Feedback, "comentario"),
+    "pedidos.motivo_cancelamento": (models.Pedido, "motivo_cancelamento"),
+}
+
+# Sequências que UTF-8 lido como Latin-1/cp1252 deixa para trás
+_MARKERS = ("Ã", "Â", "â€")
+
+
+def _suspicious(value: str) -> bool:
+    return any(m in value for m in _MARKERS)
+
+
+def _redecode(value: str) -> Optional[str]:
+    for encoding in ("cp1252", "latin-1"):
+        try:
+            return value.encode(encoding).decode("utf-8")
+        except UnicodeError:
+            continue
+    return None
+
+
+def normalize(value: Any) -> Any:
+    """Repair double-encoded UTF-8 and return NFC text; anything else is returned as is."""
+    if not isinstance(value, str) or not value:
+        return value
+    # Até duas voltas: há linhas que passaram duas vezes pela conversão
+    for _ in range(2):
+        if not _suspicious(value):
+            break
+        repaired = _redecode(value)
+        if repaired is None:
+            break
+        value = repaired
+    return value if unicodedata.is_normalized("NFC", value) else unicodedata.normalize("NFC", value)
+
+
+def _normalize_on_set(target, value, oldvalue, initiator):
+    return normalize(value)
+
+
+def install_normalization_hooks() -> None:
+    """Normalize the target columns whenever they are assigned through the ORM."""
+    for model, column in TARGETS.values():
+        attribute = getattr(model, column)
+        if not event.contains(attribute, "set", _normalize_on_set):
+            event.listen(attribute, "set", _normalize_on_set, retval=True)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _state(db: Session, target: str) -> models.ReparoTexto:
+    state = db.get(models.ReparoTexto, target)
+    if state is None:
+        state = models.ReparoTexto(alvo=target, ultimo_id=0, verificados=0, reparados=0, iniciado_em=_now())
+        db.add(state)
+    return state
+
+
+def repair_batch(db: Session, target: str, batch_size: int = TEXTFIX_BATCH_SIZE) -> Tuple[int, int]:
+    """Check the next `batch_size` rows of `target` and fix them; return (checked, repaired).
+
+    Commits the fixes together with the new position, so a crash never
+    skips nor repeats work. Returns (0, 0) once the table is done.
+    """
+    model, column = TARGETS[target]
+    table = model.__table__
+    state = _state(db, target)
+    if state.concluido_em is not None:
+        return 0, 0
+    rows = db.execute(
+        select(table.c.id, table.c[column])
+        .where(table.c.id > state.ultimo_id, table.c[column].is_not(None))
+        .order_by(table.c.id)
+        .limit(batch_size)
+    ).all()
+    changes = [{"id": id_, "valor": fixed} for id_, value in rows if (fixed := normalize(value)) != value]
+    if changes:
+        # SQL direto: um UPDATE do Core também atualizaria updated_at (onupdate);
+        # quem guardou o texto antigo é avisado pela geração do cache
+        db.execute(text(f"UPDATE {table.name} SET {column} = :valor WHERE id = :id"), changes)
+        publish_invalidation(db)
+    if rows:
+        state.ultimo_id = rows[-1].id
+    state.verificados += len(rows)
+    state.reparados += len(changes)
+    if len(rows) < batch_size:
+        state.concluido_em = _now()
+    db.commit()
+    return len(rows), len(changes)
+
+
+def backfill(
+    db: Session,
+    targets: Optional[Iterable[str]] = None,
+    batch_size: int = TEXTFIX_BATCH_SIZE,
+    pause: float = 0.0,
+    restart: bool = False,
+) -> Dict[str, Dict[str, int]]:
+    """Repair every target (or `targets`) batch by batch; return checked/repaired per target for this run.
+
+    `pause` sleeps between batches to leave room for the regular load;
+    `restart` discards the saved positions and scans the tables again.
+    """
+    result: Dict[str, Dict[str, int]] = {}
+    for target in targets or TARGETS:
+        if target not in TARGETS:
+            raise ValueError(f"unknown target {target!r}, expected one of {sorted(TARGETS)}")
+        if restart:
+            db.query(models.ReparoTexto).filter_by(alvo=target).delete()
+            db.commit()
+        run = result.setdefault(target, {"verificados": 0, "reparados": 0})
+        while True:
+            checked, repaired = repair_batch(db, target, batch_size)
+            run["verificados"] += checked
+            run["reparados"] += repaired
+            if checked < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        if run["reparados"]:
+            logger.info("textfix %s: %d linha(s) reparada(s)", target, run["reparados"])
+    return result
+
+
+def report(db: Session) -> List[Dict[str, Any]]:
+    """Progress of each target and how many rows still look double-encoded."""
+    out = []
+    for target, (model, column) in TARGETS.items():
+        col = getattr(model, column)
+        state = db.get(models.ReparoTexto, target)
+        pending = db.execute(
+            select(func.count()).select_from(model).where(or_(*(col.contains(m, autoescape=True) for m in _MARKERS)))
+        ).scalar()
+        out.append(
+            {
+                "alvo": target,
+                "verificados": state.verificados if state else 0,
+                "reparados": state.reparados if state else 0,
+                "ultimo_id": state.ultimo_id if state else None,
+                "concluido_em": state.concluido_em if state else None,
+                "suspeitos": pending,
+            }
+        )
+    return out
+
+
+def _main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.textfix", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("backfill", help="repara as linhas existentes, em lotes (retoma de onde parou)")
+    run.add_argument("--alvo", action="append", choices=sorted(TARGETS), help="só estas colunas (pode repetir)")
+    run.add_argument("--batch-size", type=int, default=TEXTFIX_BATCH_SIZE)
+    run.add_argument("--pause", type=float, default=0.0, help="segundos de pausa entre lotes")
+    run.add_argument("--restart", action="store_true", help="ignora o progresso salvo e varre de novo")
+    sub.add_parser("report", help="progresso e linhas ainda suspeitas por coluna")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "backfill":
+            t0 = time.perf_counter()
+            for target, run_result in backfill(db, args.alvo, args.batch_size, args.pause, args.restart).items():
+                print(f"{target}: {run_result['reparados']} reparada(s) de {run_result['verificados']} verificada(s)")
+            print(f"{time.perf_counter() - t0:.1f}s")
+        else:
+            for row in report(db):
+                if row["concluido_em"]:
+                    status = f"concluído em {row['concluido_em']:%Y-%m-%d %H:%M}"
+                else:
+                    status = f"até id {row['ultimo_id']}" if row["ultimo_id"] is not None else "não iniciado"
+                print(
+                    f"{row['alvo']}: {row['reparados']} reparada(s) de {row['verificados']} verificada(s), "
+                    f"{status}; {row['suspeitos']} ainda suspeita(s)"
+                )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,89 @@
+"""SQL vs. in-memory columnar snapshot for the hour/weekday breakdowns.
+
+Runs each breakdown of `app.columnar` on a database filled by
+`benchmarks.synthetic`, once with its SQL and once on the snapshot, and
+prints p50/p95 in milliseconds, plus the snapshot build time, its size and
+the cost of an incremental refresh after `--touch` orders change:
+
+    python -m benchmarks.synthetic --url sqlite:///bench.db --orders 1000000 --reset
+    python -m benchmarks.columnar --url sqlite:///bench.db --window 90
+"""
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.orm import Session
+
+from app import columnar, models, queries
+from app.database import fetch_all
+
+ROUTES = {
+    "insights/orders-heatmap": "period",
+    "metrics/weekly-orders": "period",
+    "metrics/daily-accept-time-by-hour": "day",
+    "metrics/daily-cancellations-by-hour": "day",
+}
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _timed(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return {"p50_ms": round(_percentile(samples, 50) * 1000, 2), "p95_ms": round(_percentile(samples, 95) * 1000, 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="sqlite:///./bench.db")
+    parser.add_argument("--window", type=int, default=90, help="dias no snapshot, contados do último pedido")
+    parser.add_argument("--days", type=int, default=30, help="tamanho do intervalo das rotas de período")
+    parser.add_argument("--unit", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--touch", type=int, default=1000, help="pedidos alterados antes do refresh incremental")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    with Session(engine) as db:
+        last: date = db.execute(select(func.max(models.Pedido.data_pedido))).scalar().date()
+        dialect = engine.dialect.name
+        # A janela é relativa a hoje: estende até cobrir os dados sintéticos
+        snapshot_engine = columnar.ColumnarEngine(enabled=True, days=(date.today() - last).days + args.window)
+        t0 = time.perf_counter()
+        snapshot = snapshot_engine.refresh(db)
+        print(f"build: {len(snapshot)} pedidos, {snapshot.nbytes / 2**20:.1f} MB em {time.perf_counter() - t0:.2f}s")
+
+        for name, kind in ROUTES.items():
+            if kind == "day":
+                f = queries.Filtros(unit_id=args.unit, date=last.isoformat())
+            else:
+                f = queries.Filtros(unit_id=args.unit, start_date=(last - timedelta(days=args.days - 1)).isoformat(), end_date=last.isoformat())
+            sql, params = queries.build(name, f, dialect)
+            breakdown = columnar.BREAKDOWNS[name]
+            sql_time = _timed(lambda: fetch_all(db, sql, params), args.repeat)
+            mem_time = _timed(lambda: breakdown(snapshot, f.params()), args.repeat)
+            print(f"{name:<38} sql {sql_time}  snapshot {mem_time}")
+
+        ids = db.execute(select(models.Pedido.id).order_by(models.Pedido.id.desc()).limit(args.touch)).scalars().all()
+        db.execute(update(models.Pedido).where(models.Pedido.id.in_(ids)).values(updated_at=datetime.utcnow() + timedelta(seconds=5)))
+        db.commit()
+        t0 = time.perf_counter()
+        snapshot_engine.refresh(db)
+        refresh_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        snapshot_engine.refresh(db)
+        idle_ms = (time.perf_counter() - t0) * 1000
+        print(f"refresh incremental ({len(ids)} alterados): {refresh_ms:.1f} ms; sem alterações: {idle_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
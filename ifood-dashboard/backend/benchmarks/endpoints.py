@@ -0,0 +1,166 @@
+"""Latency and memory of every `/metrics/*` and `/insights/*` route.
+
+Runs the app in-process against a database filled by `benchmarks.synthetic`,
+with the result cache off, and records p50/p95 latency and the peak Python
+memory of one request per endpoint. Results are compared with a stored
+baseline for the same scale label; a slower p95 or a larger peak beyond the
+tolerance is flagged and the exit status is 1:
+
+    python -m benchmarks.synthetic --url sqlite:///bench.db --orders 100000 --reset --rollup
+    python -m benchmarks.endpoints --url sqlite:///bench.db --label 100k
+    python -m benchmarks.endpoints --url sqlite:///bench.db --label 100k --save-baseline
+
+Baselines are machine-specific: record one per machine before comparing.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+# Ruído abaixo disso não conta como regressão, mesmo acima da tolerância
+MIN_DELTA_MS = 2.0
+MIN_DELTA_KIB = 64.0
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _routes(app) -> List[Any]:
+    from fastapi.routing import APIRoute
+
+    return [
+        r for r in app.routes
+        if isinstance(r, APIRoute) and "GET" in r.methods and r.path.startswith(("/metrics/", "/insights/"))
+    ]
+
+
+def _params(route, start: date, end: date, day: date) -> Dict[str, str]:
+    names = {p.alias for p in route.dependant.query_params}
+    values = {"start_date": start.isoformat(), "end_date": end.isoformat(), "date": day.isoformat()}
+    return {k: v for k, v in values.items() if k in names}
+
+
+def _login(db) -> Dict[str, str]:
+    from app import main, models
+    from app.security import password_hasher
+
+    user = db.query(models.Login).filter_by(email="bench@example.com").first()
+    if user is None:
+        user = models.Login(name="Bench", email="bench@example.com", password_hash=password_hasher.hash("bench"))
+        db.add(user)
+        db.commit()
+    return {"Authorization": f"Bearer {main._token_for(user)}"}
+
+
+def measure(args) -> Dict[str, Any]:
+    # A configuração do app é lida na importação
+    os.environ["DATABASE_URL"] = args.url
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["CACHE_ENABLED"] = "0"
+    os.environ.setdefault("HASH_WORKERS", "0")
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+
+    from app import models
+    from app.database import SessionLocal
+    from app.main import app
+
+    with SessionLocal() as db:
+        headers = _login(db)
+        orders = db.execute(select(func.count()).select_from(models.Pedido)).scalar()
+        last = db.execute(select(func.max(models.Pedido.data_pedido))).scalar()
+    end = args.end or (last.date() if last else date.today())
+    start = end - timedelta(days=args.days - 1)
+    results: Dict[str, Any] = {}
+    with TestClient(app, raise_server_exceptions=False) as client:
+        for route in _routes(app):
+            params = _params(route, start, end, end)
+            for _ in range(args.warmup):
+                client.get(route.path, params=params, headers=headers)
+            latencies = []
+            status = 200
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                resp = client.get(route.path, params=params, headers=headers)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                status = resp.status_code
+            # Memória medida à parte: o tracemalloc deixa as requisições bem mais lentas
+            tracemalloc.start()
+            client.get(route.path, params=params, headers=headers)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[route.path] = {
+                "status": status,
+                "p50_ms": round(statistics.median(latencies), 2),
+                "p95_ms": round(_percentile(latencies, 95), 2),
+                "peak_kib": round(peak / 1024, 1),
+            }
+            print(f"  {route.path:<42} {status}  p50 {results[route.path]['p50_ms']:8.1f} ms  "
+                  f"p95 {results[route.path]['p95_ms']:8.1f} ms  pico {results[route.path]['peak_kib']:9.1f} KiB")
+    return {"orders": orders, "period": [start.isoformat(), end.isoformat()], "endpoints": results}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of `current` against `baseline`, one message per metric."""
+    problems = []
+    for path, now in current["endpoints"].items():
+        before = baseline["endpoints"].get(path)
+        if before is None:
+            continue
+        if now["status"] != before["status"]:
+            problems.append(f"{path}: status {before['status']} -> {now['status']}")
+        for metric, min_delta in (("p95_ms", MIN_DELTA_MS), ("peak_kib", MIN_DELTA_KIB)):
+            if now[metric] > before[metric] * (1 + tolerance) and now[metric] - before[metric] > min_delta:
+                problems.append(f"{path}: {metric} {before[metric]} -> {now[metric]}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="sqlite:///./bench.db")
+    parser.add_argument("--label", required=True, help="nome da escala no baseline, ex.: 100k")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--days", type=int, default=30, help="tamanho do intervalo dos endpoints de período")
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="padrão: último dia com pedidos")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="aumento relativo aceito")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", type=Path, help="grava o resultado em JSON")
+    args = parser.parse_args()
+
+    print(f"{args.label} ({args.url})")
+    current = measure(args)
+    if args.output:
+        args.output.write_text(json.dumps(current, indent=2))
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.save_baseline:
+        baselines[args.label] = current
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"baseline '{args.label}' gravado em {args.baseline}")
+        return
+    if args.label not in baselines:
+        print(f"sem baseline '{args.label}' em {args.baseline}; use --save-baseline")
+        return
+    problems = compare(current, baselines[args.label], args.tolerance)
+    for problem in problems:
+        print(f"REGRESSÃO {problem}")
+    if problems:
+        sys.exit(1)
+    print("sem regressões")
+
+
+if __name__ == "__main__":
+    main()
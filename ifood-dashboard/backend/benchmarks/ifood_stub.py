@@ -0,0 +1,100 @@
+"""Local stand-in for the iFood order API, for testing `app.collector` offline.
+
+Serves `GET /merchants/{id}/orders?cursor=&limit=` with deterministic
+synthetic orders (same generator as `benchmarks.synthetic`), paginated by an
+opaque cursor, and can inject latency, 503 errors and 429 throttling to
+exercise the collector's retries:
+
+    python -m benchmarks.ifood_stub --port 8900 --orders 20000 --error-rate 0.05 --throttle-rate 0.02
+    IFOOD_API_URL=http://127.0.0.1:8900 python -m app.collector run
+
+Product ids 1-20 match the catalogue seeded by `benchmarks.synthetic`; the
+merchant id is the unit id, so the units must exist in the target database.
+"""
+import argparse
+import asyncio
+import random
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+from benchmarks.synthetic import PRODUCTS, generate_orders
+
+
+def _order(pedido: Dict[str, Any], itens: List[Dict[str, Any]], feedback: Optional[Dict[str, Any]], merchant: int) -> Dict[str, Any]:
+    order = {k: v for k, v in pedido.items() if k != "id"}
+    order["id_externo"] = f"{merchant}-{pedido['id']}"
+    for key in ("data_pedido", "data_aceite", "data_saida_entrega", "data_entrega"):
+        if order[key] is not None:
+            order[key] = order[key].isoformat()
+    order["itens"] = [{k: v for k, v in i.items() if k != "id_pedido"} for i in itens]
+    if feedback:
+        order["feedback"] = {k: v for k, v in feedback.items() if k != "id_pedido"}
+    return order
+
+
+def create_app(
+    orders: int = 1000,
+    seed: int = 42,
+    latency_ms: float = 0.0,
+    error_rate: float = 0.0,
+    throttle_rate: float = 0.0,
+    end: date = date(2024, 12, 31),
+    days: int = 365,
+) -> FastAPI:
+    """Stub app serving `orders` orders per merchant."""
+    app = FastAPI(title="iFood stub")
+    products = [(i + 1, price) for i, (_, price) in enumerate(PRODUCTS)]
+    catalog: Dict[int, List[Dict[str, Any]]] = {}
+    faults = random.Random(seed)
+    app.state.requests = 0
+
+    def merchant_orders(merchant: int) -> List[Dict[str, Any]]:
+        if merchant not in catalog:
+            rng = random.Random(seed * 1_000_003 + merchant)
+            generated = generate_orders(rng, orders, [merchant], max(1, orders // 8), products, end, days)
+            catalog[merchant] = [_order(p, i, f, merchant) for p, i, f in generated]
+        return catalog[merchant]
+
+    @app.get("/merchants/{merchant}/orders")
+    async def list_orders(merchant: int, cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=5000)):
+        app.state.requests += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        roll = faults.random()
+        if roll < throttle_rate:
+            return JSONResponse({"detail": "Too Many Requests"}, status_code=429, headers={"Retry-After": "1"})
+        if roll < throttle_rate + error_rate:
+            return JSONResponse({"detail": "Service Unavailable"}, status_code=503)
+        try:
+            offset = int(cursor) if cursor else 0
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+        data = merchant_orders(merchant)
+        page = data[offset : offset + limit]
+        next_offset = offset + len(page)
+        return {"orders": page, "cursor": str(next_offset), "has_more": next_offset < len(data)}
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--orders", type=int, default=1000, help="pedidos por loja")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de respostas 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fração de respostas 429")
+    args = parser.parse_args()
+    app = create_app(args.orders, args.seed, args.latency_ms, args.error_rate, args.throttle_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
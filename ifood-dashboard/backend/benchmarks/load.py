@@ -0,0 +1,271 @@
+"""Concurrent dashboard sessions against a running API, ramped until it saturates.
+
+Each virtual manager logs in through `/auth/login` and then opens the
+frontend pages in a loop, firing the same requests each page fires in
+parallel (`dashboard`, `mensal`, `insights`, `diario`) with a random think
+time between pages. Concurrency grows stage by stage; every stage reports
+throughput, latency percentiles and error/429 rates, and the first stage
+where throughput stops growing (or errors appear) marks the saturation point:
+
+    python -m benchmarks.synthetic --url sqlite:///bench.db --orders 100000 --reset --rollup
+    python -m benchmarks.load --serve --database-url sqlite:///bench.db --end 2024-12-31 \\
+        --email admin@example.com --password secret --register --output load.json
+
+Without `--serve` the API at `--url` is used as is (e.g. several uvicorn
+workers behind the real proxy).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+Request = Tuple[str, Dict[str, Any]]
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _month(end: date) -> Tuple[str, str]:
+    first = end.replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first.isoformat(), last.isoformat()
+
+
+def pages(end: date) -> Dict[str, List[List[Request]]]:
+    """Requests of each frontend page, as sequential groups of parallel calls."""
+    start, last = _month(end)
+    period = {"start_date": start, "end_date": last}
+    return {
+        # dashboard/page.tsx: quatro gráficos em paralelo, sem filtro de data
+        "dashboard": [[
+            ("/metrics/monthly-revenue", {}),
+            ("/metrics/orders-by-status", {}),
+            ("/metrics/average-ratings", {}),
+            ("/metrics/weekly-orders", {}),
+        ]],
+        # mensal/page.tsx: lista de meses e depois o bundle do mês escolhido
+        "mensal": [
+            [("/metrics/monthly-revenue", {})],
+            [("/dashboard/monthly", {**period, "limit": 5})],
+        ],
+        "insights": [[
+            ("/metrics/cancellation-cost", period),
+            ("/metrics/top-products-revenue", {**period, "limit": 5}),
+            ("/insights/top-cancelled-products", {**period, "limit": 5}),
+            ("/insights/orders-heatmap", period),
+            ("/insights/negative-feedbacks", {**period, "limit": 50}),
+        ]],
+        "diario": [[("/dashboard/daily", {"date": end.isoformat()})]],
+    }
+
+
+class Stats:
+    """Samples of one stage."""
+
+    def __init__(self) -> None:
+        self.requests: List[float] = []
+        self.pages: Dict[str, List[float]] = {}
+        self.status: Dict[str, int] = {}
+        self.logins: List[float] = []
+        self.login_status: Dict[str, int] = {}
+
+    def add(self, status: str, ms: float) -> None:
+        self.status[status] = self.status.get(status, 0) + 1
+        self.requests.append(ms)
+
+    def summary(self, users: int, elapsed: float) -> Dict[str, Any]:
+        total = sum(self.status.values())
+        errors = sum(n for s, n in self.status.items() if not s.startswith(("2", "3", "429")))
+        return {
+            "users": users,
+            "seconds": round(elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+            "pages_per_s": round(sum(len(v) for v in self.pages.values()) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(_percentile(self.requests, 50), 1),
+                "p95": round(_percentile(self.requests, 95), 1),
+                "p99": round(_percentile(self.requests, 99), 1),
+            },
+            "page_p95_ms": {name: round(_percentile(v, 95), 1) for name, v in sorted(self.pages.items())},
+            "login_p95_ms": round(_percentile(self.logins, 95), 1),
+            "login_status": dict(sorted(self.login_status.items())),
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "rate_limited": round(self.status.get("429", 0) / total, 4) if total else 0.0,
+            "status": dict(sorted(self.status.items())),
+        }
+
+
+async def _call(client: httpx.AsyncClient, stats: Stats, path: str, params, headers) -> None:
+    t0 = time.perf_counter()
+    try:
+        resp = await client.get(path, params=params, headers=headers)
+        status = str(resp.status_code)
+    except httpx.HTTPError as exc:
+        status = type(exc).__name__
+    stats.add(status, (time.perf_counter() - t0) * 1000)
+
+
+async def _login(client: httpx.AsyncClient, stats: Stats, args) -> Optional[Dict[str, str]]:
+    t0 = time.perf_counter()
+    try:
+        resp = await client.post("/auth/login", json={"email": args.email, "password": args.password})
+        status = str(resp.status_code)
+    except httpx.HTTPError as exc:
+        status = type(exc).__name__
+    stats.logins.append((time.perf_counter() - t0) * 1000)
+    stats.login_status[status] = stats.login_status.get(status, 0) + 1
+    if status != "200":
+        return None
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+
+async def _manager(client, stats: Stats, args, catalog, rng: random.Random, deadline: float) -> None:
+    # Gerentes não entram todos no mesmo instante
+    await asyncio.sleep(rng.uniform(0, args.think))
+    headers = await _login(client, stats, args)
+    if headers is None:
+        return
+    names = list(catalog)
+    weights = [args.weights.get(n, 1.0) for n in names]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights=weights)[0]
+        t0 = time.perf_counter()
+        for group in catalog[name]:
+            await asyncio.gather(*(_call(client, stats, path, params, headers) for path, params in group))
+        stats.pages.setdefault(name, []).append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(rng.expovariate(1 / args.think) if args.think > 0 else 0)
+
+
+async def run_stage(args, users: int, catalog, seed: int) -> Dict[str, Any]:
+    stats = Stats()
+    limits = httpx.Limits(max_connections=users * 5, max_keepalive_connections=users * 5)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        t0 = time.perf_counter()
+        deadline = t0 + args.stage_seconds
+        await asyncio.gather(*(
+            _manager(client, stats, args, catalog, random.Random(seed + i), deadline) for i in range(users)
+        ))
+        elapsed = time.perf_counter() - t0
+    return stats.summary(users, elapsed)
+
+
+def saturation(stages: List[Dict[str, Any]], min_gain: float, max_errors: float) -> Optional[int]:
+    """Concurrency after which adding users no longer adds throughput.
+
+    That is the last stage before throughput grows less than `min_gain`
+    (relative) or the error rate goes above `max_errors`; None when every
+    stage still scaled.
+    """
+    for prev, cur in zip(stages, stages[1:]):
+        if cur["error_rate"] > max_errors or cur["throughput_rps"] < prev["throughput_rps"] * (1 + min_gain):
+            return prev["users"]
+    return None
+
+
+def _serve(args) -> subprocess.Popen:
+    env = dict(os.environ)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    env.setdefault("SECRET_KEY", "bench")
+    # Todos os gerentes virtuais entram pelo mesmo endereço
+    env.setdefault("RATE_LIMIT_LOGIN", "10000/minute")
+    port = httpx.URL(args.url).port or 8000
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(args.workers),
+         "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{args.url}/docs", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("uvicorn não subiu")
+
+
+async def _register(args) -> None:
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        await client.post(
+            "/auth/register",
+            json={"name": "Load", "email": args.email, "password": args.password, "id_unidade": args.unit},
+        )
+
+
+async def main(args) -> Dict[str, Any]:
+    if args.register:
+        await _register(args)  # 400 se já existir
+    catalog = pages(args.end)
+    stages = []
+    for users in args.users:
+        result = await run_stage(args, users, catalog, args.seed)
+        stages.append(result)
+        print(f"{users:5d} usuários  {result['throughput_rps']:8.1f} req/s  p50 {result['latency_ms']['p50']:7.1f} ms  "
+              f"p95 {result['latency_ms']['p95']:7.1f} ms  erros {result['error_rate']:.2%}  429 {result['rate_limited']:.2%}")
+        if args.stop_on_saturation and saturation(stages, args.min_gain, args.max_errors) is not None:
+            break
+    return {
+        "url": args.url,
+        "end": args.end.isoformat(),
+        "think_s": args.think,
+        "stages": stages,
+        "saturation_users": saturation(stages, args.min_gain, args.max_errors),
+    }
+
+
+def _parse_weights(value: str) -> Dict[str, float]:
+    return {k: float(v) for k, v in (item.split("=") for item in value.split(",") if item)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--register", action="store_true", help="cadastra o usuário antes (ignora se já existe)")
+    parser.add_argument("--unit", type=int, default=None, help="id_unidade do usuário cadastrado")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="dia do diário; o mês dele vai para mensal/insights")
+    parser.add_argument("--users", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--stage-seconds", type=float, default=20.0)
+    parser.add_argument("--think", type=float, default=2.0, help="pausa média entre páginas, em segundos")
+    parser.add_argument("--weights", type=_parse_weights, default={}, help="ex.: diario=3,dashboard=1")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-gain", type=float, default=0.1, help="ganho mínimo de vazão entre estágios")
+    parser.add_argument("--max-errors", type=float, default=0.01)
+    parser.add_argument("--stop-on-saturation", action="store_true")
+    parser.add_argument("--serve", action="store_true", help="sobe um uvicorn local em --url durante o teste")
+    parser.add_argument("--database-url", default=None, help="DATABASE_URL do uvicorn de --serve")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="grava o resultado em JSON")
+    args = parser.parse_args()
+
+    server = _serve(args) if args.serve else None
+    try:
+        report = asyncio.run(main(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(f"saturação: {report['saturation_users'] or 'não atingida'}")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
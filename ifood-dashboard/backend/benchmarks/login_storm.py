@@ -0,0 +1,84 @@
+"""Latency of a metrics endpoint while a burst of logins is in progress.
+
+Run it against a live API twice, once with `HASH_WORKERS=0` (bcrypt inline,
+the old behaviour) and once with the process pool, and compare the p99. The
+login limit has to be lifted, otherwise the storm only collects 429s and
+bcrypt never runs:
+
+    RATE_LIMIT_LOGIN=100000/minute uvicorn app.main:app --workers 1 &
+    python -m benchmarks.login_storm --email admin@example.com --password secret
+
+The user must exist; the metrics calls reuse the token from the first login.
+Login responses are counted by status; any 429 (or no successful login)
+exits with status 1.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+async def _storm(client, args, stop):
+    statuses = Counter()
+
+    async def one():
+        while not stop.is_set():
+            resp = await client.post("/auth/login", json={"email": args.email, "password": args.password})
+            statuses[resp.status_code] += 1
+
+    await asyncio.gather(*(one() for _ in range(args.logins)))
+    return statuses
+
+
+async def _probe(client, headers, args, stop):
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        resp = await client.get(args.path, headers=headers)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        resp.raise_for_status()
+        await asyncio.sleep(args.interval)
+    stop.set()
+    return latencies
+
+
+async def main(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        resp = await client.post("/auth/login", json={"email": args.email, "password": args.password})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        stop = asyncio.Event()
+        latencies, statuses = await asyncio.gather(_probe(client, headers, args, stop), _storm(client, args, stop))
+    print(f"{args.path}: n={len(latencies)} p50={statistics.median(latencies):.1f}ms "
+          f"p99={_percentile(latencies, 99):.1f}ms max={max(latencies):.1f}ms")
+    print("logins: " + " ".join(f"{code}={n}" for code, n in sorted(statuses.items())))
+    if statuses[429] or not statuses[200]:
+        # Limitado pelo RATE_LIMIT_LOGIN: o bcrypt não rodou e o p99 não mede nada
+        print("login storm was throttled (429) or never logged in; raise RATE_LIMIT_LOGIN", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", default="/metrics/daily-overview")
+    parser.add_argument("--logins", type=int, default=32, help="concurrent login loops")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--interval", type=float, default=0.05)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,115 @@
+"""Per-request overhead of the rate limiter, per backend.
+
+Measures one `limiter.check` (p50/p95 in microseconds) for the memory and
+SQLite backends (and Redis with `--redis-url`), the SQLite backend again
+with several processes hammering the same file, and the end-to-end cost
+on a minimal FastAPI route with and without the limit dependency:
+
+    python -m benchmarks.ratelimit --checks 20000 --processes 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+from fastapi import Depends, FastAPI
+
+from app import ratelimit
+
+RATE = "1000000/second"  # nunca rejeita: mede só o custo da verificação
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    return {"p50_us": round(_percentile(samples, 50) * 1e6, 1), "p95_us": round(_percentile(samples, 95) * 1e6, 1)}
+
+
+def measure(backend: ratelimit.RateLimitBackend, checks: int, keys: int = 1000) -> List[float]:
+    limiter = ratelimit.RateLimiter(backend, enabled=True)
+    samples = []
+    for i in range(checks):
+        t0 = time.perf_counter()
+        limiter.check("bench", f"user:{i % keys}", RATE)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _worker(path: str, checks: int, out) -> None:
+    out.put(measure(ratelimit.SQLiteBackend(path), checks))
+
+
+def measure_contended(path: str, checks: int, processes: int) -> List[float]:
+    out = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_worker, args=(path, checks, out)) for _ in range(processes)]
+    for proc in procs:
+        proc.start()
+    samples = [s for _ in procs for s in out.get()]
+    for proc in procs:
+        proc.join()
+    return samples
+
+
+async def measure_route(backend: ratelimit.RateLimitBackend, requests: int) -> Dict[str, Dict[str, float]]:
+    limiter = ratelimit.RateLimiter(backend, enabled=True)
+
+    async def limited() -> None:
+        await limiter.check_async("bench", "user:1", RATE)
+
+    app = FastAPI()
+
+    @app.get("/plain")
+    async def plain():
+        return {"ok": True}
+
+    @app.get("/limited", dependencies=[Depends(limited)])
+    async def with_limit():
+        return {"ok": True}
+
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for path in ("/plain", "/limited"):
+            samples = []
+            for _ in range(requests):
+                t0 = time.perf_counter()
+                await client.get(path)
+                samples.append(time.perf_counter() - t0)
+            results[path] = _summary(samples)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checks", type=int, default=20000, help="verificações por backend/processo")
+    parser.add_argument("--processes", type=int, default=4, help="processos disputando o arquivo SQLite")
+    parser.add_argument("--requests", type=int, default=3000, help="requisições na medição ponta a ponta")
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ratelimit.db")
+        backends = {"memory": ratelimit.MemoryBackend(), "sqlite": ratelimit.SQLiteBackend(path)}
+        if args.redis_url:
+            backends["redis"] = ratelimit.RedisBackend(args.redis_url)
+        for name, backend in backends.items():
+            print(f"{name:<18} {_summary(measure(backend, args.checks))}")
+        contended = measure_contended(path, args.checks, args.processes)
+        print(f"{'sqlite x' + str(args.processes) + ' proc':<18} {_summary(contended)}")
+        for name in ("memory", "sqlite"):
+            route = asyncio.run(measure_route(backends[name], args.requests))
+            overhead = route["/limited"]["p50_us"] - route["/plain"]["p50_us"]
+            print(f"rota ({name:<6})      sem limite {route['/plain']}  com limite {route['/limited']}  +{overhead:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Payload size and serialization time of the chart response formats.
+
+Compares today's path (row dicts through `jsonable_encoder` and the stdlib
+encoder, as `JSONResponse` does) with the formats in `app.formats`:
+
+    python -m benchmarks.serialization --rows 50000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from app import formats
+from app.database import Table
+
+
+def _revenue_table(n: int) -> Table:
+    start = datetime(2024, 1, 1)
+    rows = [
+        (start + timedelta(minutes=i), Decimal(random.randint(1000, 20000)) / 100, Decimal(random.randint(1000, 9000)) / 100)
+        for i in range(n)
+    ]
+    return Table(["ts", "faturamento", "ticket_medio"], rows)
+
+
+def _heatmap_table(n: int) -> Table:
+    return Table(["dia_semana", "hora", "total"], [(i % 7, i % 24, random.randint(0, 500)) for i in range(n)])
+
+
+def _legacy(table: Table) -> bytes:
+    rows = [dict(zip(table.columns, row)) for row in table.rows]
+    return json.dumps(jsonable_encoder(rows), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+CASES = {
+    "legacy json": _legacy,
+    "fast json": lambda t: formats.dumps(formats.records(t)),
+    "columnar json": lambda t: formats.dumps(formats.columnar(t)),
+    "arrow ipc": formats.arrow_ipc,
+}
+
+
+def _time(fn, table: Table, repeat: int) -> tuple[float, int]:
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = len(fn(table))
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, table in (("daily-revenue", _revenue_table(args.rows)), ("orders-heatmap", _heatmap_table(args.rows))):
+        print(f"{name} ({args.rows} linhas)")
+        base_ms, base_size = _time(_legacy, table, args.repeat)
+        for case, fn in CASES.items():
+            ms, size = _time(fn, table, args.repeat)
+            print(f"  {case:<14} {ms:8.1f} ms ({base_ms / ms:4.1f}x)  {size / 1024:8.1f} KiB ({size / base_size:5.0%})")
+
+
+if __name__ == "__main__":
+    main()
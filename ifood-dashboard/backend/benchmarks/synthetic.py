@@ -0,0 +1,192 @@
+"""Deterministic synthetic data for benchmarks.
+
+Fills `unidades`, `produtos`, `pedidos`, `itens_pedido` and `feedbacks` with
+a realistic shape: lunch/dinner peaks, busier weekends, a status mix with
+cancellation reasons, a few heavy repeat customers and a long tail of
+one-off ones. The same `--seed` always produces the same rows:
+
+    python -m benchmarks.synthetic --url sqlite:///bench.db --orders 100000 --reset
+    python -m benchmarks.synthetic --url postgresql://user:pw@localhost/bench --orders 10000000 --rollup
+
+`--rollup` also backfills `metricas_diarias` and `clientes_primeiro_pedido`
+so the endpoints run on the same paths as in production.
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app import clientes, models, rollup
+from app.database import Base
+
+# Pedidos por hora do dia (0-23): picos no almoço e no jantar
+HOUR_WEIGHTS = [1, 0.5, 0.2, 0.1, 0.1, 0.2, 0.5, 1, 2, 3, 5, 12, 16, 12, 6, 4, 4, 6, 12, 18, 20, 15, 8, 3]
+# Segunda a domingo
+WEEKDAY_WEIGHTS = [0.8, 0.85, 0.9, 1.0, 1.3, 1.5, 1.4]
+STATUS_WEIGHTS = {"Entregue": 0.88, "Cancelado": 0.09, "Em rota": 0.03}
+CANCEL_REASONS = [
+    ("Atraso na entrega", "Cliente", 0.30),
+    ("Cliente desistiu", "Cliente", 0.20),
+    ("Item indisponível", "Loja", 0.18),
+    ("Endereço não encontrado", "Entregador", 0.10),
+    ("Pagamento recusado", "iFood", 0.12),
+    (None, None, 0.10),
+]
+RATING_WEIGHTS = {1: 0.05, 2: 0.07, 3: 0.15, 4: 0.33, 5: 0.40}
+COMMENTS = {
+    "Reclamação": ["Chegou frio", "Demorou demais", "Pedido veio errado", "Embalagem violada", ""],
+    "Sugestão": ["Poderia vir mais molho", "Mais opções veganas", ""],
+    "Elogio": ["Muito bom!", "Chegou rápido", "Ótimo atendimento", ""],
+}
+PRODUCTS = [
+    ("Hambúrguer Clássico", 32.9), ("X-Bacon", 36.5), ("Pizza Margherita", 54.0), ("Pizza Calabresa", 52.0),
+    ("Açaí 500ml", 24.0), ("Pastel de Carne", 9.5), ("Coxinha", 7.0), ("Feijoada", 45.0),
+    ("Moqueca", 62.0), ("Salada Caesar", 29.9), ("Temaki Salmão", 31.0), ("Yakisoba", 38.0),
+    ("Parmegiana", 44.9), ("Strogonoff", 39.9), ("Refrigerante Lata", 6.5), ("Suco Natural", 9.0),
+    ("Pudim", 12.0), ("Brigadeiro", 4.5), ("Batata Frita", 18.0), ("Esfiha", 6.0),
+]
+CITIES = [("São Paulo", "SP"), ("Rio de Janeiro", "RJ"), ("Belo Horizonte", "MG"), ("Curitiba", "PR"), ("Recife", "PE")]
+
+
+def _weighted(rng: random.Random, weights: Dict[Any, float]) -> Any:
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _days(end: date, days: int) -> Tuple[List[date], List[float]]:
+    calendar = [end - timedelta(days=i) for i in range(days)][::-1]
+    return calendar, [WEEKDAY_WEIGHTS[d.weekday()] for d in calendar]
+
+
+def generate_orders(
+    rng: random.Random, orders: int, units: List[int], customers: int, products: List[Tuple[int, float]],
+    end: date, days: int, first_id: int = 1,
+) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any] | None]]:
+    """Yield `(pedido, itens, feedback)` tuples with explicit ids."""
+    calendar, day_weights = _days(end, days)
+    unit_weights = [1 / (i + 1) ** 0.6 for i in range(len(units))]  # algumas lojas vendem muito mais
+    hours = list(range(24))
+    reasons = [r[:2] for r in CANCEL_REASONS]
+    reason_weights = [r[2] for r in CANCEL_REASONS]
+    for offset in range(orders):
+        pedido_id = first_id + offset
+        day = rng.choices(calendar, weights=day_weights)[0]
+        ts = datetime.combine(day, datetime.min.time()) + timedelta(
+            hours=rng.choices(hours, weights=HOUR_WEIGHTS)[0], minutes=rng.randrange(60), seconds=rng.randrange(60)
+        )
+        status = _weighted(rng, STATUS_WEIGHTS)
+        # 60% dos pedidos vêm de 10% dos clientes (recorrentes); o resto da base toda
+        pool = max(1, customers // 10) if rng.random() < 0.6 else customers
+        cliente = rng.randint(1, pool)
+        aceite = ts + timedelta(minutes=rng.uniform(1, 12))
+        saida = aceite + timedelta(minutes=rng.uniform(10, 25))
+        motivo = origem = None
+        if status == "Cancelado":
+            motivo, origem = rng.choices(reasons, weights=reason_weights)[0]
+            if rng.random() < 0.3:
+                aceite = None
+            saida = None
+        itens = []
+        for produto_id, preco in rng.sample(products, rng.randint(1, 4)):
+            itens.append({"id_pedido": pedido_id, "id_produto": produto_id, "quantidade": rng.randint(1, 3), "preco_unitario": preco})
+        pedido = {
+            "id": pedido_id,
+            "id_cliente": cliente,
+            "id_unidade": rng.choices(units, weights=unit_weights)[0],
+            "id_regiao_entrega": rng.randint(1, 40),
+            "data_pedido": ts,
+            "status": status,
+            "valor_total": round(sum(i["quantidade"] * i["preco_unitario"] for i in itens), 2),
+            "motivo_cancelamento": motivo,
+            "origem_cancelamento": origem,
+            "data_aceite": aceite,
+            "data_saida_entrega": saida if status != "Cancelado" else None,
+            "data_entrega": saida + timedelta(minutes=rng.uniform(15, 45)) if status == "Entregue" else None,
+        }
+        feedback = None
+        if status != "Em rota" and rng.random() < 0.35:
+            nota = _weighted(rng, RATING_WEIGHTS)
+            if status == "Cancelado":
+                nota = min(nota, 2)
+            tipo = "Elogio" if nota >= 4 else "Reclamação" if nota <= 2 else "Sugestão"
+            feedback = {"id_pedido": pedido_id, "nota": nota, "tipo_feedback": tipo, "comentario": rng.choice(COMMENTS[tipo])}
+        yield pedido, itens, feedback
+
+
+def _seed_dimensions(db: Session, units: int) -> Tuple[List[int], List[Tuple[int, float]]]:
+    existing = db.execute(select(models.Unidade.id).order_by(models.Unidade.id)).scalars().all()
+    for i in range(len(existing), units):
+        cidade, estado = CITIES[i % len(CITIES)]
+        db.add(models.Unidade(nome=f"Unidade {i + 1:03d}", cidade=cidade, estado=estado, data_abertura=date(2020, 1, 1)))
+    if not db.execute(select(func.count()).select_from(models.Produto)).scalar():
+        db.add_all(models.Produto(nome=nome) for nome, _ in PRODUCTS)
+    db.commit()
+    unit_ids = db.execute(select(models.Unidade.id).order_by(models.Unidade.id)).scalars().all()[:units]
+    prices = dict(PRODUCTS)
+    names = db.execute(select(models.Produto.id, models.Produto.nome).order_by(models.Produto.id)).all()
+    return unit_ids, [(pid, prices.get(nome, 20.0)) for pid, nome in names]
+
+
+def populate(engine: Engine, orders: int, units: int = 20, customers: int | None = None, seed: int = 42,
+             end: date = date(2024, 12, 31), days: int = 365, batch: int = 5000) -> int:
+    """Insert `orders` orders (plus items and feedbacks); return the first new order id."""
+    rng = random.Random(seed)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        unit_ids, products = _seed_dimensions(db, units)
+        first_id = (db.execute(select(func.max(models.Pedido.id))).scalar() or 0) + 1
+    pedidos, itens, feedbacks = [], [], []
+
+    def flush(conn) -> None:
+        for table, rows in ((models.Pedido, pedidos), (models.ItemPedido, itens), (models.Feedback, feedbacks)):
+            if rows:
+                conn.execute(insert(table.__table__), rows)
+                rows.clear()
+
+    with engine.begin() as conn:
+        for pedido, pedido_itens, feedback in generate_orders(
+            rng, orders, unit_ids, customers or max(1, orders // 8), products, end, days, first_id
+        ):
+            pedidos.append(pedido)
+            itens.extend(pedido_itens)
+            if feedback:
+                feedbacks.append(feedback)
+            if len(pedidos) >= batch:
+                flush(conn)
+        flush(conn)
+    return first_id
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="sqlite:///./bench.db", help="banco de destino (SQLite ou Postgres)")
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--units", type=int, default=20)
+    parser.add_argument("--customers", type=int, default=None, help="padrão: pedidos / 8")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--end", type=date.fromisoformat, default=date(2024, 12, 31))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--reset", action="store_true", help="apaga e recria as tabelas antes")
+    parser.add_argument("--rollup", action="store_true", help="faz o backfill do rollup e dos primeiros pedidos")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if args.reset:
+        Base.metadata.drop_all(engine)
+    t0 = time.perf_counter()
+    populate(engine, args.orders, args.units, args.customers, args.seed, args.end, args.days, args.batch)
+    print(f"{args.orders} pedidos gerados em {time.perf_counter() - t0:.1f}s")
+    if args.rollup:
+        with Session(engine) as db:
+            days = rollup.backfill(db, args.end - timedelta(days=args.days - 1), args.end)
+            loaded = clientes.backfill(db)
+        print(f"rollup: {days} dia(s); clientes_primeiro_pedido: {loaded} cliente(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 import os
 import sys
+from datetime import timedelta
 from pathlib import Path
 
 os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("RATE_LIMIT_URL", "memory://")
 
 import pytest
 from fastapi.testclient import TestClient
@@ -12,6 +14,7 @@ from sqlalchemy.orm import sessionmaker
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from app.database import Base
+from app.instrumentation import instrument_engine
 from app.main import app, get_db
 
 
@@ -23,9 +26,26 @@ engine = create_engine(
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
+instrument_engine(engine, name="test")
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    """Cached results/principals must not leak between tests that recreate the DB."""
+    from app.cache import result_cache
+    from app.principal import principal_cache
+    from app.ratelimit import limiter
+
+    result_cache.clear()
+    principal_cache.clear()
+    limiter.clear()
+    yield
+    result_cache.clear()
+    principal_cache.clear()
+    limiter.clear()
+
+
 @pytest.fixture()
 def db():
     """Create a new database for each test case."""
@@ -53,3 +73,62 @@ def client(db):
         yield c
     app.dependency_overrides.clear()
 
+
+
+@pytest.fixture()
+def auth_headers(client, db):
+    """Register a user bound to a fresh unit and return its bearer header."""
+    from app import models
+
+    unit = models.Unidade(nome="Loja Auth")
+    db.add(unit)
+    db.commit()
+    client.post(
+        "/auth/register",
+        json={"name": "User", "email": "auth@example.com", "password": "secret", "id_unidade": unit.id},
+    )
+    token = client.post(
+        "/auth/login", json={"email": "auth@example.com", "password": "secret"}
+    ).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture()
+def auth_unit(db, auth_headers):
+    """The "Loja Auth" unit the `auth_headers` user is bound to."""
+    from app import models
+
+    return db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+
+
+@pytest.fixture()
+def make_order():
+    """Factory that adds an order to a session; accept/delivery times in minutes after `ts`."""
+    from app import models
+
+    def make(db, unit_id, ts, status, valor, cliente=None, aceite_min=None, entrega_min=None, motivo=None):
+        pedido = models.Pedido(
+            id_unidade=unit_id,
+            id_cliente=cliente,
+            data_pedido=ts,
+            status=status,
+            valor_total=valor,
+            motivo_cancelamento=motivo,
+            data_aceite=ts + timedelta(minutes=aceite_min) if aceite_min is not None else None,
+            data_entrega=ts + timedelta(minutes=entrega_min) if entrega_min is not None else None,
+        )
+        db.add(pedido)
+        return pedido
+
+    return make
+
+
+@pytest.fixture()
+def ingest_headers(db, auth_headers):
+    """`auth_headers` of the same user promoted to the `ingest` role (required by /ingest/pedidos)."""
+    from app import models
+
+    user = db.query(models.Login).filter_by(email="auth@example.com").one()
+    user.role = "ingest"
+    db.commit()
+    return auth_headers
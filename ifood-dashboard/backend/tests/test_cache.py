@@ -0,0 +1,92 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+from app import cache, models, rollup
+from app.cache import CACHE_TTL_PAST, CacheEntryMeta, LRUBackend, ResultCache, result_cache
+
+
+def test_lru_evicts_least_recently_used():
+    backend = LRUBackend(max_entries=2)
+    meta = CacheEntryMeta(None, None, None)
+    backend.set("a", 1, 60, meta)
+    backend.set("b", 2, 60, meta)
+    backend.get("a")
+    backend.set("c", 3, 60, meta)
+    assert backend.get("b") is None
+    assert backend.get("a") == 1 and backend.get("c") == 3
+    assert backend.evictions == 1
+
+
+def test_ttl_is_long_for_closed_ranges_and_short_for_today():
+    today = date(2024, 6, 10)
+    past = CacheEntryMeta(1, date(2024, 6, 1), date(2024, 6, 9))
+    current = CacheEntryMeta(1, date(2024, 6, 1), today)
+    assert ResultCache.ttl_for("metrics/daily-revenue", past, today) == CACHE_TTL_PAST
+    assert ResultCache.ttl_for("metrics/daily-overview", current, today) == 15
+
+
+def test_invalidate_only_drops_overlapping_unit_and_day():
+    cache = ResultCache(LRUBackend(), enabled=True)
+    calls = []
+    june = CacheEntryMeta(1, date(2024, 6, 1), date(2024, 6, 30))
+    may = CacheEntryMeta(1, date(2024, 5, 1), date(2024, 5, 31))
+    other_unit = CacheEntryMeta(2, date(2024, 6, 1), date(2024, 6, 30))
+    all_units = CacheEntryMeta(None, date(2024, 6, 1), date(2024, 6, 30))
+    for name, meta in [("june", june), ("may", may), ("other", other_unit), ("all", all_units)]:
+        cache.get_or_compute("e", meta, lambda n=name: calls.append(n) or n)
+
+    assert cache.invalidate([(1, date(2024, 6, 15))]) == 2
+    for name, meta in [("june", june), ("may", may), ("other", other_unit), ("all", all_units)]:
+        cache.get_or_compute("e", meta, lambda n=name: calls.append(n) or n)
+    assert calls == ["june", "may", "other", "all", "june", "all"]
+    assert cache.stats()["hits"] == {"e": 2}
+
+
+def test_endpoint_is_cached_and_invalidated_by_orm_writes(client, db, auth_headers):
+    unit = db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+    day = datetime(2024, 7, 1, 12, 0)
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=day, status="Entregue", valor_total=10))
+    db.commit()
+    params = {"start_date": "2024-07-01", "end_date": "2024-07-02"}
+
+    # Os contadores são do processo: compara com o valor antes das chamadas
+    hits = result_cache.stats()["hits"].get("metrics/orders-by-status", 0)
+    first = client.get("/metrics/orders-by-status", params=params, headers=auth_headers).json()
+    again = client.get("/metrics/orders-by-status", params=params, headers=auth_headers).json()
+    assert first == again == [{"status": "Entregue", "total": 1}]
+    assert result_cache.stats()["hits"]["metrics/orders-by-status"] == hits + 1
+
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=day + timedelta(hours=1), status="Cancelado", valor_total=5))
+    db.commit()
+    fresh = client.get("/metrics/orders-by-status", params=params, headers=auth_headers).json()
+    assert fresh == [{"status": "Cancelado", "total": 1}, {"status": "Entregue", "total": 1}]
+
+
+def test_rollup_of_past_days_invalidates_other_workers(db, monkeypatch):
+    """The rollup runs on the leader; a worker that did not write sees the new generation and recomputes."""
+    monkeypatch.setattr(cache, "CACHE_GENERATION_SECONDS", 0)
+    unit = models.Unidade(nome="Loja")
+    db.add(unit)
+    db.commit()
+    today = date.today()
+    past = today - timedelta(days=3)
+    rollup.backfill(db, past, today)
+    worker = ResultCache(LRUBackend(), enabled=True)
+    meta = CacheEntryMeta(unit.id, past, past)
+    calls = []
+
+    def cached():
+        asyncio.run(worker.sync_generation_async(db))
+        return worker.get_or_compute("metrics/daily-revenue", meta, lambda: calls.append(1) or len(calls))
+
+    assert cached() == cached() == 1
+
+    # Pedido de hoje: só o dia corrente muda, a geração fica
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime.combine(today, datetime.min.time()), status="Entregue", valor_total=5))
+    db.commit()
+    assert rollup.run_incremental(db) and cached() == 1
+
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime.combine(past, datetime.min.time()), status="Entregue", valor_total=5))
+    db.commit()
+    assert (unit.id, past) in rollup.run_incremental(db)
+    assert cached() == 2 and cached() == 2
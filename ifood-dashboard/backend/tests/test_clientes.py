@@ -0,0 +1,71 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from app import clientes, models
+from app.cache import result_cache
+
+
+def _pedido(db, unit_id, cliente, ts, status="Entregue"):
+    db.add(models.Pedido(id_unidade=unit_id, id_cliente=cliente, data_pedido=ts, status=status, valor_total=10))
+
+
+def test_backfill_then_incremental_keeps_first_order(db):
+    unit = models.Unidade(nome="Loja Clientes")
+    db.add(unit)
+    db.commit()
+    _pedido(db, unit.id, 1, datetime(2024, 3, 10, 12, 0))
+    _pedido(db, unit.id, 1, datetime(2024, 4, 2, 12, 0))
+    _pedido(db, unit.id, 2, datetime(2024, 4, 5, 9, 0))
+    db.commit()
+    # Gravados "há uma hora": fora da janela que a passada incremental relê
+    db.execute(text("UPDATE pedidos SET updated_at = :ts"), {"ts": datetime.utcnow() - timedelta(hours=1)})
+    db.commit()
+
+    assert not clientes.ready(db)
+    assert clientes.run_incremental(db) == 0
+    assert clientes.backfill(db) == 2
+    assert clientes.ready(db)
+    first = db.get(models.ClientePrimeiroPedido, 1)
+    assert (first.primeira_data, first.id_unidade) == (date(2024, 3, 10), unit.id)
+
+    # Pedido retroativo do cliente 2 e um cliente novo
+    _pedido(db, unit.id, 2, datetime(2024, 2, 1, 18, 0))
+    _pedido(db, unit.id, 3, datetime(2024, 4, 6, 10, 0))
+    db.commit()
+    assert clientes.run_incremental(db) == 2
+    db.expire_all()
+    assert db.get(models.ClientePrimeiroPedido, 2).primeira_data == date(2024, 2, 1)
+    assert db.get(models.ClientePrimeiroPedido, 3).primeira_data == date(2024, 4, 6)
+
+    # Primeiro pedido gravado no mesmo segundo da passada anterior
+    _pedido(db, unit.id, 4, datetime(2024, 4, 7, 10, 0))
+    db.commit()
+    clientes.run_incremental(db)
+    db.expire_all()
+    assert db.get(models.ClientePrimeiroPedido, 4).primeira_data == date(2024, 4, 7)
+
+
+def test_daily_split_and_cohorts_use_first_order_table(client, db, auth_headers):
+    unit = db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+    _pedido(db, unit.id, 1, datetime(2024, 7, 20, 12, 0))
+    _pedido(db, unit.id, 1, datetime(2024, 8, 5, 12, 0))
+    _pedido(db, unit.id, 2, datetime(2024, 8, 5, 13, 0))
+    _pedido(db, unit.id, 3, datetime(2024, 8, 20, 13, 0))
+    db.commit()
+    day = {"date": "2024-08-05"}
+    get = lambda path, params: client.get(path, params=params, headers=auth_headers)
+
+    assert get("/insights/customer-cohorts", {}).status_code == 503
+    historico = get("/metrics/daily-overview", day).json()["clientes"]
+    clientes.backfill(db)
+    result_cache.clear()
+    assert get("/metrics/daily-overview", day).json()["clientes"] == historico == {"novos": 1, "recorrentes": 1}
+    assert get("/dashboard/daily", day).json()["clientes"] == historico
+
+    cohorts = get("/insights/customer-cohorts", {"start_date": "2024-07-01", "end_date": "2024-08-31"}).json()
+    assert cohorts == [
+        {"coorte": "2024-07", "mes": "2024-07", "clientes": 1},
+        {"coorte": "2024-07", "mes": "2024-08", "clientes": 1},
+        {"coorte": "2024-08", "mes": "2024-08", "clientes": 2},
+    ]
@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base
+from app.collector import Collector
+
+
+def _order(unit_id, n):
+    return {
+        "id_externo": f"{unit_id}-{n}",
+        "id_unidade": unit_id,
+        "data_pedido": f"2024-06-{n:02d}T12:00:00",
+        "status": "Entregue",
+        "valor_total": 10,
+    }
+
+
+def _api(pages, faults):
+    """Fake order API: `pages[unit]` is the list of pages; `faults` are served first."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        unit = int(request.url.path.split("/")[2])
+        cursor = request.url.params.get("cursor")
+        calls.append((unit, cursor))
+        if faults.get(unit):
+            return faults[unit].pop(0)
+        index = int(cursor) if cursor else 0
+        data = pages[unit]
+        orders = data[index] if index < len(data) else []
+        return httpx.Response(200, json={"orders": orders, "cursor": str(min(index + 1, len(data))), "has_more": index + 1 < len(data)})
+
+    return handler, calls
+
+
+@pytest.fixture()
+def file_db(tmp_path):
+    """Units are collected concurrently, each in its own session: they need real connections."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'coleta.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _collector(db, handler, delays):
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    return Collector(
+        "http://ifood.test",
+        transport=httpx.MockTransport(handler),
+        session_factory=sessionmaker(bind=db.get_bind()),
+        sleep=sleep,
+        backoff_base=0.5,
+        max_retries=3,
+    )
+
+
+def test_collector_retries_and_resumes_from_cursor(file_db):
+    db = file_db
+    units = [models.Unidade(nome="Loja A"), models.Unidade(nome="Loja B")]
+    db.add_all(units)
+    db.commit()
+    a, b = (u.id for u in units)
+    pages = {a: [[_order(a, 1), _order(a, 2)], [_order(a, 3)]], b: [[_order(b, 4)]]}
+    faults = {
+        a: [httpx.Response(503), httpx.Response(429, headers={"Retry-After": "2"})],
+        b: [httpx.Response(401, text="bad token")],
+    }
+    handler, calls = _api(pages, faults)
+    delays = []
+    collector = _collector(db, handler, delays)
+
+    results = asyncio.run(collector.run())
+    assert results[a]["pedidos"] == 3 and results[a]["erro"] is None
+    assert "HTTP 401" in results[b]["erro"]
+    assert collector.retries == 2
+    assert 0.25 <= delays[0] <= 0.5 and delays[1] == 2
+    db.expire_all()
+    assert db.get(models.ColetaCursor, a).cursor == "2"
+    assert db.get(models.ColetaCursor, b).ultimo_erro.startswith("HTTP 401")
+
+    # Próxima execução: A continua do cursor salvo, B tenta de novo do início
+    calls.clear()
+    results = asyncio.run(collector.run())
+    assert (a, "2") in calls and (b, None) in calls
+    assert results[a]["pedidos"] == 0 and results[b]["pedidos"] == 1
+    assert db.query(models.Pedido).count() == 4
+    assert db.get(models.ColetaCursor, b).ultimo_erro is None
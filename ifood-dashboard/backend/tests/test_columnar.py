@@ -0,0 +1,94 @@
+from datetime import date, datetime, timedelta
+
+from app import columnar, models
+from app.cache import result_cache
+
+ROUTES = {
+    "/insights/orders-heatmap": "period",
+    "/metrics/weekly-orders": "period",
+    "/metrics/daily-accept-time-by-hour": "day",
+    "/metrics/daily-cancellations-by-hour": "day",
+}
+
+
+def _orders(db, unit_id, day):
+    other = models.Unidade(nome="Outra")
+    db.add(other)
+    db.flush()
+    reasons = [None, "Atraso na entrega", "Cliente desistiu"]
+    for i in range(60):
+        placed = datetime.combine(day - timedelta(days=i % 3), datetime.min.time()) + timedelta(hours=(i * 5) % 24, minutes=i)
+        cancelled = i % 4 == 0
+        db.add(
+            models.Pedido(
+                id_unidade=other.id if i % 7 == 0 else unit_id,
+                data_pedido=placed,
+                status="Cancelado" if cancelled else "Entregue",
+                motivo_cancelamento=reasons[i // 4 % 3] if cancelled else None,
+                data_aceite=None if i % 5 == 0 else placed + timedelta(minutes=3 + i % 7, seconds=i),
+            )
+        )
+    db.commit()
+
+
+def _get_all(client, headers, day):
+    out = {}
+    for route, kind in ROUTES.items():
+        if kind == "day":
+            params = {"date": day.isoformat()}
+        else:
+            params = {"start_date": (day - timedelta(days=20)).isoformat(), "end_date": day.isoformat()}
+        result_cache.clear()
+        resp = client.get(route, params=params, headers=headers)
+        assert resp.status_code == 200, route
+        out[route] = resp.json()
+    return out
+
+
+def _rounded(results):
+    # tempo_medio: o SQLite calcula via julianday, com erro de ponto flutuante
+    for row in results["/metrics/daily-accept-time-by-hour"]:
+        row["tempo_medio"] = round(row["tempo_medio"], 3)
+    return results
+
+
+def test_snapshot_matches_sql_and_refreshes_incrementally(client, db, auth_headers, monkeypatch):
+    unit_id = db.query(models.Unidade).filter_by(nome="Loja Auth").one().id
+    day = date.today() - timedelta(days=1)
+    _orders(db, unit_id, day)
+    expected = _rounded(_get_all(client, auth_headers, day))
+    assert expected["/metrics/daily-cancellations-by-hour"] and expected["/insights/orders-heatmap"]
+
+    engine = columnar.ColumnarEngine(enabled=True, days=30)
+    monkeypatch.setattr(columnar, "engine", engine)
+    assert _rounded(_get_all(client, auth_headers, day)) == expected
+    assert engine.stats()["answered"] == 4 and engine.builds == 1 and engine.refreshes == 0
+
+    # Alterações depois do build: só as linhas novas/alteradas são lidas
+    order = db.query(models.Pedido).filter_by(id_unidade=unit_id, status="Entregue").first()
+    order.status, order.motivo_cancelamento = "Cancelado", "Pagamento recusado"
+    order.updated_at = datetime.utcnow() + timedelta(seconds=5)
+    db.add(models.Pedido(id_unidade=unit_id, data_pedido=datetime.combine(day, datetime.min.time()) + timedelta(hours=23), status="Cancelado"))
+    db.commit()
+    refreshed = _rounded(_get_all(client, auth_headers, day))
+    assert engine.builds == 1 and engine.refreshes == 1
+    monkeypatch.setattr(columnar, "engine", columnar.ColumnarEngine(enabled=False))
+    assert refreshed == _rounded(_get_all(client, auth_headers, day)) != expected
+
+    # Fora da janela: volta ao SQL
+    monkeypatch.setattr(columnar, "engine", engine)
+    result_cache.clear()
+    old = client.get("/insights/orders-heatmap", params={"start_date": "2020-01-01", "end_date": day.isoformat()}, headers=auth_headers)
+    assert old.status_code == 200 and engine.fallbacks == 1
+
+
+def test_budget_shrinks_the_window(db):
+    day = date.today()
+    for i in range(10):
+        db.add(models.Pedido(data_pedido=datetime.combine(day - timedelta(days=i), datetime.min.time()) + timedelta(hours=12), status="Entregue"))
+    db.commit()
+    engine = columnar.ColumnarEngine(enabled=True, days=30, max_mb=4 * columnar.ROW_BYTES / 2**20)
+    snapshot = engine.refresh(db)
+    # Cabem 4 linhas: o 5º dia mais recente fica de fora e a janela começa no 4º
+    assert len(snapshot) == 4
+    assert snapshot.window_start == datetime.combine(day - timedelta(days=3), datetime.min.time())
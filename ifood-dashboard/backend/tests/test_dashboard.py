@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+from app import models
+
+
+def test_daily_bundle_returns_every_panel(client, db, auth_headers, auth_unit, make_order):
+    unit_id = auth_unit.id
+    day = datetime(2024, 8, 5, 12, 0)
+    make_order(db, unit_id, day - timedelta(days=3), "Entregue", 10, cliente=1)
+    make_order(db, unit_id, day, "Entregue", 40, cliente=1, aceite_min=4, entrega_min=34)
+    make_order(db, unit_id, day + timedelta(minutes=30), "Entregue", 60, cliente=2, aceite_min=6, entrega_min=26)
+    make_order(db, unit_id, day + timedelta(hours=2), "Cancelado", 25, cliente=3, motivo="Atraso")
+    db.commit()
+
+    body = client.get("/dashboard/daily", params={"date": "2024-08-05"}, headers=auth_headers).json()
+    assert body["total_pedidos"] == 3
+    assert body["faturamento_dia"] == 100
+    assert body["tempo_medio_aceite"] == 5.0
+    assert body["tempo_medio_entrega"] == 25.0
+    assert sorted(body["por_status"], key=lambda x: x["status"]) == [
+        {"status": "Cancelado", "total": 1},
+        {"status": "Entregue", "total": 2},
+    ]
+    assert body["clientes"] == {"novos": 2, "recorrentes": 1}
+    assert [float(r["valor_total"]) for r in body["cumulativo"]] == [40, 60]
+    assert body["aceite_por_hora"] == [{"hora": 12, "tempo_medio": 5.0}]
+    assert body["cancelamentos_por_hora"] == [{"hora": 14, "motivo": "Atraso", "qtd": 1}]
+
+
+def test_monthly_bundle_matches_individual_endpoints(client, db, auth_headers, auth_unit, make_order):
+    unit_id = auth_unit.id
+    produto = models.Produto(nome="Pizza")
+    db.add(produto)
+    base = datetime(2024, 9, 1, 19, 0)
+    for i in range(6):
+        status = "Cancelado" if i % 3 == 0 else "Entregue"
+        pedido = make_order(db, unit_id, base + timedelta(days=i % 3), status, 30 + i)
+        db.flush()
+        db.add(models.ItemPedido(id_pedido=pedido.id, id_produto=produto.id, quantidade=1, preco_unitario=30 + i))
+        db.add(models.Feedback(id_pedido=pedido.id, nota=3 + i % 2))
+    db.commit()
+    params = {"start_date": "2024-09-01", "end_date": "2024-09-30"}
+
+    bundle = client.get("/dashboard/monthly", params=params, headers=auth_headers).json()
+    get = lambda path, **extra: client.get(path, params={**params, **extra}, headers=auth_headers).json()
+    assert bundle["por_status"] == get("/metrics/orders-by-status")
+    assert bundle["avaliacoes"] == get("/metrics/average-ratings")
+    assert bundle["top_produtos"] == get("/metrics/top-products-revenue", limit=5)
+    assert bundle["custo_cancelamento"] == get("/metrics/cancellation-cost")["custo_cancelamento"]
+    assert [(r["dia"], r["faturamento"]) for r in bundle["faturamento_diario"]] == [
+        (r["dia"], r["faturamento"]) for r in get("/metrics/daily-revenue")
+    ]
+
+
+def test_daily_bundle_on_async_engine(client, db, auth_headers, auth_unit, make_order, tmp_path):
+    import asyncio
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from sqlalchemy.orm import Session
+
+    from app.database import Base, make_async_engine
+    from app.main import app, get_read_db
+
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    sync_engine = create_engine(url)
+    Base.metadata.create_all(sync_engine)
+    day = datetime(2024, 8, 5, 12, 0)
+    with Session(sync_engine) as other:
+        other.add(models.Unidade(id=auth_unit.id, nome="Loja Auth"))
+        make_order(other, auth_unit.id, day - timedelta(days=1), "Entregue", 10, cliente=1)
+        make_order(other, auth_unit.id, day, "Entregue", 40, cliente=1, aceite_min=4, entrega_min=34)
+        make_order(other, auth_unit.id, day, "Cancelado", 25, cliente=2, motivo="Atraso")
+        other.commit()
+    sync_engine.dispose()
+
+    engine = make_async_engine(url)
+    sessions = async_sessionmaker(engine)
+
+    async def override_get_read_db():
+        async with sessions() as session:
+            yield session
+
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    try:
+        body = client.get("/dashboard/daily", params={"date": "2024-08-05"}, headers=auth_headers).json()
+    finally:
+        del app.dependency_overrides[get_read_db]
+        asyncio.run(engine.dispose())
+    assert body["total_pedidos"] == 2
+    assert body["faturamento_dia"] == 40
+    assert body["clientes"] == {"novos": 1, "recorrentes": 1}
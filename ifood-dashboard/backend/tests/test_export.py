@@ -0,0 +1,75 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from app import models
+
+
+def _seed(db, unit_id, count):
+    base = datetime(2024, 3, 1, 10, 0)
+    for i in range(count):
+        status = "Cancelado" if i % 4 == 0 else "Entregue"
+        db.add(models.Pedido(id_unidade=unit_id, data_pedido=base + timedelta(hours=i), status=status, valor_total=20))
+    db.commit()
+
+
+def test_export_pedidos_csv_streams_every_row(client, db, auth_headers, auth_unit, monkeypatch):
+    monkeypatch.setattr("app.export.EXPORT_CHUNK_SIZE", 3)
+    _seed(db, auth_unit.id, 10)
+
+    resp = client.get("/pedidos/export", params={"format": "csv"}, headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert len(rows) == 10
+    assert {r["status"] for r in rows} == {"Entregue", "Cancelado"}
+
+
+def test_export_metric_ndjson(client, db, auth_headers, auth_unit):
+    _seed(db, auth_unit.id, 8)
+
+    resp = client.get("/export/metrics/orders-by-status", params={"format": "ndjson"}, headers=auth_headers)
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert {r["status"]: r["total"] for r in lines} == {"Cancelado": 2, "Entregue": 6}
+
+
+def test_export_single_order_and_unknown_export(client, db, auth_headers, auth_unit):
+    _seed(db, auth_unit.id, 1)
+    pedido = db.query(models.Pedido).first()
+
+    resp = client.get(f"/pedidos/{pedido.id}/export", headers=auth_headers)
+    assert resp.status_code == 200
+    assert len(list(csv.DictReader(io.StringIO(resp.text)))) == 1
+    assert client.get("/pedidos/9999/export", headers=auth_headers).status_code == 404
+    assert client.get("/export/metrics/nope", headers=auth_headers).status_code == 404
+    assert client.get("/export/metrics/daily-revenue", headers=auth_headers).status_code == 400
+
+
+def test_export_connection_released_when_the_body_never_starts(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from sqlalchemy.pool import QueuePool
+
+    from app.export import stream_query
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}", poolclass=QueuePool)
+    response = stream_query(Session(engine), "SELECT 1 AS um", None, "csv", "x")
+    assert engine.pool.checkedout() == 1
+
+    async def send(message):
+        # Cliente que sumiu antes do primeiro pedaço
+        raise OSError("connection reset")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response(scope, receive, send))
+    assert engine.pool.checkedout() == 0
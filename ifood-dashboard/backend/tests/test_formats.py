@@ -0,0 +1,46 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pyarrow
+
+from app import formats, models
+from app.database import Table
+
+
+def _seed(db):
+    unit = db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+    for day, valor in ((1, "40.50"), (1, "10"), (2, "30")):
+        db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime(2024, 9, day, 12), status="Entregue", valor_total=Decimal(valor)))
+    db.commit()
+
+
+def test_daily_revenue_negotiates_rows_columnar_and_arrow(client, db, auth_headers):
+    _seed(db)
+    params = {"start_date": "2024-09-01", "end_date": "2024-09-30"}
+
+    def get(accept):
+        return client.get("/metrics/daily-revenue", params=params, headers={**auth_headers, "Accept": accept})
+
+    rows = get("application/json")
+    assert "Accept" in rows.headers["vary"]
+    assert [(r["faturamento"], r["ticket_medio"]) for r in rows.json()] == [(50.5, 25.25), (30, 30)]
+
+    col = get(f"{formats.COLUMNAR}, application/json;q=0.5")
+    assert col.headers["content-type"] == formats.COLUMNAR
+    body = col.json()
+    assert body["columns"] == ["dia", "faturamento", "ticket_medio"]
+    assert body["data"]["faturamento"] == [r["faturamento"] for r in rows.json()]
+
+    arrow = get(formats.ARROW)
+    table = pyarrow.ipc.open_stream(arrow.content).read_all()
+    assert table.column_names == body["columns"]
+    assert table.column("faturamento").to_pylist() == [50.5, 30.0]
+
+
+def test_json_rows_match_jsonable_encoder_output():
+    from fastapi.encoders import jsonable_encoder
+    import json
+
+    table = Table(["dia", "valor"], [(datetime(2024, 9, 1), Decimal("10")), (None, Decimal("2.50"))])
+    assert json.loads(formats.dumps(formats.records(table))) == jsonable_encoder(formats.records(table))
+    assert formats.columnar(Table(["a"], [])) == {"columns": ["a"], "data": {"a": []}}
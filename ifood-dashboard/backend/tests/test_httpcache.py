@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+from app import main, models
+from app.cache import result_cache
+
+
+def _orders(db, unit_id, days):
+    for day in range(days):
+        db.add(models.Pedido(id_unidade=unit_id, data_pedido=datetime(2024, 1, 1, 12) + timedelta(days=day), status="Entregue", valor_total=10))
+    db.commit()
+
+
+def test_etag_answers_304_without_running_the_aggregate(client, db, auth_headers, auth_unit, monkeypatch):
+    unit_id = auth_unit.id
+    _orders(db, unit_id, 60)
+    params = {"start_date": "2024-01-01", "end_date": "2024-03-31"}
+
+    first = client.get("/metrics/daily-revenue", params=params, headers=auth_headers)
+    assert first.status_code == 200
+    tag = first.headers["ETag"]
+    assert tag.startswith('W/"')
+    assert first.headers["Cache-Control"] == "private, max-age=900"
+
+    def aggregate(*args, **kwargs):
+        raise AssertionError("aggregate executed")
+
+    result_cache.clear()
+    monkeypatch.setattr(main, "fetch_table_async", aggregate)
+    again = client.get("/metrics/daily-revenue", params=params, headers={**auth_headers, "If-None-Match": tag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == tag
+    monkeypatch.undo()
+
+    # Outro formato, outra ETag; dado novo no período, outra ETag
+    columnar = client.get(
+        "/metrics/daily-revenue", params=params, headers={**auth_headers, "Accept": "application/vnd.ifood.columnar+json"}
+    )
+    assert columnar.headers["ETag"] != tag
+    _orders(db, unit_id, 1)
+    changed = client.get("/metrics/daily-revenue", params=params, headers={**auth_headers, "If-None-Match": tag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != tag
+
+    # Período em aberto: sempre revalida
+    open_range = client.get("/metrics/orders-by-status", headers=auth_headers)
+    assert open_range.headers["Cache-Control"] == "private, no-cache"
+
+
+def test_large_responses_are_compressed(client, db, auth_headers, auth_unit):
+    _orders(db, auth_unit.id, 60)
+    params = {"start_date": "2024-01-01", "end_date": "2024-03-31"}
+
+    resp = client.get("/metrics/daily-revenue", params=params, headers={**auth_headers, "Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in resp.headers["Vary"]
+    assert len(resp.json()) == 60
+    plain = client.get("/metrics/daily-revenue", params=params, headers={**auth_headers, "Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    small = client.get("/healthz", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+
+
+def test_etag_follows_feedbacks_items_and_products(client, db, auth_headers, auth_unit):
+    unit_id = auth_unit.id
+    _orders(db, unit_id, 2)
+    pedido = db.query(models.Pedido).first()
+    params = {"start_date": "2024-01-01", "end_date": "2024-01-31"}
+
+    def etag(path):
+        # Cache de resultados vazio: simula outro worker, que só tem a marca d'água para decidir
+        result_cache.clear()
+        return client.get(path, params=params, headers=auth_headers).headers["ETag"]
+
+    # Avaliação e item novos não mexem em pedidos.updated_at
+    feedbacks = etag("/insights/negative-feedbacks")
+    db.add(models.Feedback(id_pedido=pedido.id, nota=1, comentario="Frio"))
+    db.commit()
+    assert etag("/insights/negative-feedbacks") != feedbacks
+
+    top = etag("/metrics/top-selling-products")
+    db.add(models.Produto(id=1, nome="Pizza"))
+    db.commit()
+    assert etag("/metrics/top-selling-products") != top
+    top = etag("/metrics/top-selling-products")
+    db.add(models.ItemPedido(id_pedido=pedido.id, id_produto=1, quantidade=2, preco_unitario=10))
+    db.commit()
+    assert etag("/metrics/top-selling-products") != top
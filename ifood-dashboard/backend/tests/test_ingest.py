@@ -0,0 +1,99 @@
+import json
+from decimal import Decimal
+
+from app import ingest, main, models
+
+
+def _pedido(unit_id, externo, produto_id, quantidade=1, status="Entregue", **extra):
+    return {
+        "id_externo": externo,
+        "id_unidade": unit_id,
+        "id_cliente": 7,
+        "data_pedido": "2024-06-10T12:30:00-03:00",
+        "status": status,
+        "itens": [{"id_produto": produto_id, "quantidade": quantidade, "preco_unitario": "12.50"}],
+        **extra,
+    }
+
+
+def test_ingest_is_idempotent_on_external_id(client, db, ingest_headers, auth_unit):
+    unit_id = auth_unit.id
+    produto = models.Produto(nome="Pastel")
+    db.add(produto)
+    db.commit()
+    payload = [
+        _pedido(unit_id, "ifood-1", produto.id, feedback={"nota": 5, "tipo_feedback": "Elogio"}),
+        _pedido(unit_id, "ifood-2", produto.id, quantidade=2),
+    ]
+
+    resp = client.post("/ingest/pedidos", json=payload, headers=ingest_headers)
+    assert resp.status_code == 200
+    assert resp.json()["lotes"][0] | {"ms": 0} == {
+        "lote": 1, "pedidos": 2, "novos": 2, "atualizados": 0, "itens": 2, "feedbacks": 1, "ms": 0,
+    }
+
+    # Reenvio em NDJSON: atualiza o pedido e troca os itens em vez de duplicar
+    again = _pedido(unit_id, "ifood-2", produto.id, quantidade=3, status="Cancelado")
+    body = "\n".join(json.dumps(p) for p in (payload[0], again)) + "\n"
+    resp = client.post(
+        "/ingest/pedidos", content=body, headers={**ingest_headers, "Content-Type": ingest.NDJSON}
+    )
+    assert resp.json()["lotes"][0]["atualizados"] == 2
+    db.expire_all()
+    pedidos = {p.id_externo: p for p in db.query(models.Pedido)}
+    assert len(pedidos) == 2
+    assert pedidos["ifood-2"].status == "Cancelado"
+    assert pedidos["ifood-2"].valor_total == Decimal("37.5")
+    assert str(pedidos["ifood-2"].data_pedido) == "2024-06-10 12:30:00"
+    assert [i.quantidade for i in db.query(models.ItemPedido).filter_by(id_pedido=pedidos["ifood-2"].id)] == [3]
+    assert db.query(models.Feedback).count() == 1
+
+
+def test_ingest_reports_rejected_rows(client, db, ingest_headers, auth_unit):
+    unit_id = auth_unit.id
+    outra = models.Unidade(nome="Outra Loja")
+    produto = models.Produto(nome="Coxinha")
+    db.add_all([outra, produto])
+    db.commit()
+    payload = [
+        _pedido(unit_id, "ok", produto.id),
+        {"id_externo": "sem-data", "id_unidade": unit_id, "status": "Entregue"},
+        _pedido(outra.id, "outra-unidade", produto.id),
+        _pedido(unit_id, "produto-invalido", produto.id + 100),
+    ]
+
+    report = client.post("/ingest/pedidos", json=payload, headers=ingest_headers).json()
+    assert (report["recebidos"], report["aceitos"], report["rejeitados"]) == (4, 1, 3)
+    assert [e["indice"] for e in report["erros"]] == [1, 2, 3]
+    assert report["erros"][0]["erro"].startswith("data_pedido")
+    assert [p.id_externo for p in db.query(models.Pedido)] == ["ok"]
+
+    bad = client.post("/ingest/pedidos", content=b'{"id_externo": "x"}', headers={**ingest_headers, "Content-Type": "application/json"})
+    assert bad.status_code == 400
+
+
+def test_ingest_requires_role_and_keeps_other_units_orders(client, db, auth_headers, auth_unit, monkeypatch):
+    unit_id = auth_unit.id
+    outra = models.Unidade(nome="Outra Loja")
+    produto = models.Produto(nome="Esfiha")
+    db.add_all([outra, produto])
+    db.commit()
+    # Usuário comum não ingere
+    assert client.post("/ingest/pedidos", json=[_pedido(unit_id, "x", produto.id)], headers=auth_headers).status_code == 403
+
+    # Credencial de serviço: qualquer unidade
+    monkeypatch.setattr(main, "INGEST_TOKEN", "svc-token")
+    service = {"Authorization": "Bearer svc-token"}
+    assert client.post("/ingest/pedidos", json=[_pedido(outra.id, "X1", produto.id)], headers=service).json()["aceitos"] == 1
+
+    # O mesmo id_externo enviado pela outra unidade não move nem sobrescreve o pedido
+    user = db.query(models.Login).filter_by(email="auth@example.com").one()
+    user.role = "ingest"
+    db.commit()
+    report = client.post("/ingest/pedidos", json=[_pedido(unit_id, "X1", produto.id, status="Cancelado")], headers=auth_headers).json()
+    assert (report["aceitos"], report["rejeitados"]) == (0, 1)
+    assert report["erros"][0]["erro"] == "id_externo: order belongs to another unit"
+    db.expire_all()
+    pedido = db.query(models.Pedido).filter_by(id_externo="X1").one()
+    assert (pedido.id_unidade, pedido.status) == (outra.id, "Entregue")
+    assert db.query(models.ItemPedido).filter_by(id_pedido=pedido.id).count() == 1
@@ -0,0 +1,57 @@
+import logging
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from app import instrumentation
+
+
+def test_internal_metrics_reports_named_query_timings(client, auth_headers):
+    client.get("/metrics/orders-by-status", headers=auth_headers)
+
+    resp = client.get("/internal/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    labels = 'endpoint="/metrics/orders-by-status",query="metrics/orders-by-status"'
+    assert f"db_query_duration_seconds_count{{{labels}}}" in resp.text
+    assert f"db_query_rows_count{{{labels}}}" in resp.text
+    assert 'result_cache_requests_total{endpoint="metrics/orders-by-status",outcome="miss"}' in resp.text
+
+
+def test_pool_gauges_have_one_type_line_per_family(tmp_path, monkeypatch):
+    # Engine síncrona e a do caminho assíncrono (DB_ASYNC=1): o Prometheus rejeita TYPE repetido
+    monkeypatch.setattr(instrumentation, "_pools", list(instrumentation._pools))
+    for name in ("sync", "async"):
+        instrumentation.instrument_engine(create_engine(f"sqlite:///{tmp_path / name}.db", poolclass=QueuePool), name=name)
+    text = instrumentation.registry.render()
+    types = [line for line in text.splitlines() if line.startswith("# TYPE ")]
+    assert len(types) == len(set(types))
+    assert 'db_pool_checked_out{engine="sync"} 0' in text and 'db_pool_checked_out{engine="async"} 0' in text
+
+
+def test_internal_metrics_requires_token_when_configured(client, monkeypatch):
+    import app.main as main
+
+    monkeypatch.setattr(main, "INTERNAL_METRICS_TOKEN", "s3cret")
+    assert client.get("/internal/metrics").status_code == 401
+    assert client.get("/internal/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+
+def test_slow_query_logged_with_params_and_plan(db, monkeypatch, caplog):
+    from app.database import fetch_all
+
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", 1e-9)
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_EXPLAIN", True)
+    with caplog.at_level(logging.WARNING, logger="app.instrumentation"):
+        with instrumentation.query_name("teste/lenta"):
+            fetch_all(db, "SELECT id FROM pedidos WHERE id_unidade = :u", {"u": 7})
+
+    messages = "\n".join(r.getMessage() for r in caplog.records)
+    assert "query=teste/lenta" in messages
+    assert "params=(7,)" in messages
+    assert "plano:" in messages
+
+
+def test_default_query_name():
+    assert instrumentation.default_query_name("SELECT * FROM pedidos p") == "select pedidos"
+    assert instrumentation.default_query_name("UPDATE logins SET role = 'x'") == "update logins"
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from app import models
+from app.pagination import decode_cursor, encode_cursor
+
+
+def _seed_orders(db, unit_id, count, base=datetime(2024, 1, 1, 12, 0)):
+    for i in range(count):
+        # Pares de pedidos com o mesmo horário exercitam o desempate por id
+        db.add(models.Pedido(id_unidade=unit_id, data_pedido=base + timedelta(minutes=i // 2), status="Entregue", valor_total=10))
+    db.commit()
+
+
+def test_cursor_roundtrip():
+    token = encode_cursor(datetime(2024, 1, 1, 12, 30), 42)
+    assert decode_cursor(token) == ("2024-01-01 12:30:00", 42)
+
+
+def test_pedidos_keyset_pages_cover_all_rows_once(client, db, auth_headers):
+    unit = db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+    other = models.Unidade(nome="Outra Loja")
+    db.add(other)
+    db.commit()
+    _seed_orders(db, unit.id, 7)
+    _seed_orders(db, other.id, 3)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        body = client.get("/pedidos", params=params, headers=auth_headers).json()
+        seen.extend(body["items"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 7
+    assert len({p["id"] for p in seen}) == 7
+    assert all(p["id_unidade"] == unit.id for p in seen)
+    keys = [(p["data_pedido"], p["id"]) for p in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_pedidos_rejects_foreign_unit_and_bad_cursor(client, db, auth_headers):
+    assert client.get("/pedidos", params={"id_unidade": 999}, headers=auth_headers).status_code == 403
+    assert client.get("/pedidos", params={"cursor": "???"}, headers=auth_headers).status_code == 400
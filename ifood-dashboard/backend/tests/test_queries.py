@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app import models, queries
+from app.queries import Filtros
+
+
+def test_daily_endpoints_match_bundle_on_sqlite(client, db, auth_headers, auth_unit, make_order):
+    unit_id = auth_unit.id
+    day = datetime(2024, 8, 5, 12, 0)
+    make_order(db, unit_id, day - timedelta(days=3), "Entregue", 10, cliente=1)
+    make_order(db, unit_id, day, "Entregue", 40, cliente=1, aceite_min=4, entrega_min=34)
+    make_order(db, unit_id, day + timedelta(minutes=30), "Entregue", 60, cliente=2, aceite_min=6, entrega_min=26)
+    make_order(db, unit_id, day + timedelta(hours=2), "Cancelado", 25, cliente=3, motivo="Atraso")
+    db.commit()
+    get = lambda path: client.get(path, params={"date": "2024-08-05"}, headers=auth_headers).json()
+
+    bundle = get("/dashboard/daily")
+    overview = get("/metrics/daily-overview")
+    assert overview["total_pedidos"] == bundle["total_pedidos"]
+    assert float(overview["faturamento_dia"]) == bundle["faturamento_dia"]
+    assert round(overview["tempo_medio_aceite"], 6) == bundle["tempo_medio_aceite"]
+    assert round(overview["tempo_medio_entrega"], 6) == bundle["tempo_medio_entrega"]
+    assert overview["clientes"] == bundle["clientes"]
+    assert [(r["hora"], round(r["tempo_medio"], 6)) for r in get("/metrics/daily-accept-time-by-hour")] == [
+        (r["hora"], r["tempo_medio"]) for r in bundle["aceite_por_hora"]
+    ]
+    assert get("/metrics/daily-cancellations-by-hour") == bundle["cancelamentos_por_hora"]
+    assert len(get("/metrics/daily-cumulative-revenue")) == len(bundle["cumulativo"])
+
+
+def test_period_endpoints_run_on_sqlite(client, db, auth_headers, auth_unit, make_order):
+    unit_id = auth_unit.id
+    # 2024-09-01 é domingo (ISO 2024-35); 2024-09-02 abre a semana 36
+    pedidos = [
+        make_order(db, unit_id, datetime(2024, 9, 1, 19, 0), "Entregue", 30),
+        make_order(db, unit_id, datetime(2024, 9, 2, 20, 0), "Cancelado", 20),
+    ]
+    db.flush()
+    db.add(models.Feedback(id_pedido=pedidos[0].id, nota=5))
+    db.add(models.Feedback(id_pedido=pedidos[1].id, nota=4, tipo_feedback="Reclamação", comentario="Frio"))
+    db.commit()
+    params = {"start_date": "2024-09-01", "end_date": "2024-09-30"}
+    get = lambda path: client.get(path, params=params, headers=auth_headers).json()
+
+    assert get("/metrics/weekly-orders") == [
+        {"semana": "2024-35", "total_pedidos": 1},
+        {"semana": "2024-36", "total_pedidos": 1},
+    ]
+    assert get("/insights/orders-heatmap") == [
+        {"dow": 0, "hora": 19, "qtd": 1},
+        {"dow": 1, "hora": 20, "qtd": 1},
+    ]
+    assert [r["comentario"] for r in get("/insights/negative-feedbacks")] == ["Frio"]
+
+
+def test_compiled_sql_is_cached_per_shape():
+    before = queries.cache_info().hits
+    a = queries.build("metrics/orders-by-status", Filtros(unit_id=1, start_date="2024-01-01"), "postgresql")
+    b = queries.build("metrics/orders-by-status", Filtros(unit_id=2, start_date="2024-02-01"), "postgresql")
+    assert a[0] == b[0]
+    assert b[1] == {"unit_id": 2, "start": datetime(2024, 2, 1)}
+    assert queries.cache_info().hits >= before + 1
+
+    sqlite_sql, _ = queries.build("insights/orders-heatmap", Filtros(), "sqlite")
+    pg_sql, _ = queries.build("insights/orders-heatmap", Filtros(), "postgresql")
+    assert "strftime" in sqlite_sql and "EXTRACT(DOW" in pg_sql
+
+
+# Consultas dos caminhos quentes: nenhuma pode ler pedidos/itens/feedbacks inteiros
+HOT_QUERIES = {
+    "dashboard/daily:pedidos": Filtros(unit_id=1, date="2024-08-05"),
+    "dashboard/daily:recorrentes": Filtros(unit_id=1, date="2024-08-05"),
+    "metrics/daily-overview:kpis": Filtros(unit_id=1, date="2024-08-05"),
+    "metrics/daily-revenue": Filtros(unit_id=1, start_date="2024-08-01", end_date="2024-08-31"),
+    "metrics/orders-by-status": Filtros(unit_id=1, start_date="2024-08-01", end_date="2024-08-31"),
+    "metrics/top-products-revenue": Filtros(unit_id=1, start_date="2024-08-01", end_date="2024-08-31", limit=5),
+    "metrics/top-selling-products": Filtros(start_date="2024-08-01", end_date="2024-08-31"),
+    "metrics/average-ratings": Filtros(start_date="2024-08-01", end_date="2024-08-31"),
+    "insights/negative-feedbacks": Filtros(unit_id=1, start_date="2024-08-01", end_date="2024-08-31", limit=50),
+    "insights/orders-heatmap": Filtros(unit_id=1, start_date="2024-08-01", end_date="2024-08-31"),
+}
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_queries_do_not_scan_tables(db, name):
+    sql, params = queries.build(name, HOT_QUERIES[name], "sqlite")
+    plan = [row[-1] for row in db.execute(text("EXPLAIN QUERY PLAN " + sql), params)]
+    assert not [step for step in plan if step.startswith("SCAN ")], plan
@@ -0,0 +1,72 @@
+import asyncio
+import multiprocessing
+import sqlite3
+import time
+
+from app import ratelimit
+
+
+def _login(client, email):
+    return client.post("/auth/login", json={"email": email, "password": "secret"})
+
+
+def test_routes_limited_per_user_and_per_address(client, auth_headers):
+    client.post("/auth/register", json={"name": "Outro", "email": "outro@example.com", "password": "secret"})
+    token = client.post("/auth/token", data={"username": "outro@example.com", "password": "secret"}).json()
+    other = {"Authorization": f"Bearer {token['access_token']}"}
+    # /auth/login e /auth/token dividem o balde do endereço; auth_headers já fez um login
+    statuses = [_login(client, "outro@example.com").status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+    statuses = [client.get("/lojas", headers=auth_headers).status_code for _ in range(11)]
+    assert statuses == [200] * 10 + [429]
+    assert client.get("/lojas", headers=auth_headers).headers["Retry-After"] == "6"
+    # Balde separado por rota e por usuário
+    assert client.get("/pedidos", headers=auth_headers).status_code == 200
+    assert client.get("/lojas", headers=other).status_code == 200
+
+    metrics = client.get("/internal/metrics").text
+    assert 'rate_limit_requests_total{limit="lojas",outcome="rejected"} 2' in metrics
+
+
+def _take_many(path, attempts, results):
+    # Espera longa pela trava: aqui interessa a contagem exata, não liberar sob disputa
+    backend = ratelimit.SQLiteBackend(path, timeout_ms=5000)
+    results.put(sum(backend.take("login:1.2.3.4", 10, 10 / 60, 1000.0) == 0 for _ in range(attempts)))
+
+
+def test_sqlite_backend_shares_buckets_across_processes(tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    ratelimit.SQLiteBackend(path)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_take_many, args=(path, 8, results)) for _ in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    assert sum(results.get() for _ in procs) == 10
+
+    backend = ratelimit.SQLiteBackend(path)
+    assert backend.take("login:1.2.3.4", 10, 10 / 60, 1000.0) == 6.0
+    # Um token volta a cada 6 s
+    assert backend.take("login:1.2.3.4", 10, 10 / 60, 1006.0) == 0
+    assert ratelimit.MemoryBackend().take("x", 1, 1.0, 0.0) == 0
+    assert ratelimit.parse_rate("5/minute") == (5, 5 / 60)
+
+
+def test_sqlite_lock_contention_lets_the_request_through(tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    limiter = ratelimit.RateLimiter(ratelimit.SQLiteBackend(path, timeout_ms=20), enabled=True)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")  # outro worker com a trava de escrita
+    try:
+        started = time.perf_counter()
+        for _ in range(3):
+            asyncio.run(limiter.check_async("login", "1.2.3.4", "1/minute"))
+        assert time.perf_counter() - started < 1
+        assert limiter.allowed == {}
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+    asyncio.run(limiter.check_async("login", "1.2.3.4", "1/minute"))
+    assert limiter.allowed == {"login": 1}
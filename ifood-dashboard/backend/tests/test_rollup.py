@@ -0,0 +1,150 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrations, models, rollup
+
+
+def _seed(db, unit_id):
+    base = datetime(2024, 5, 1, 11, 0)
+    for day in range(3):
+        for i, (status, valor) in enumerate([("Entregue", 30), ("Entregue", 50), ("Cancelado", 20)]):
+            pedido = models.Pedido(
+                id_unidade=unit_id, data_pedido=base + timedelta(days=day, hours=i), status=status, valor_total=valor
+            )
+            db.add(pedido)
+            db.flush()
+            db.add(models.Feedback(id_pedido=pedido.id, nota=2 + i))
+    db.commit()
+
+
+def _age(db):
+    # Pedidos gravados "há uma hora": fora da janela que a passada incremental relê
+    db.execute(text("UPDATE pedidos SET updated_at = :ts"), {"ts": datetime.utcnow() - timedelta(hours=1)})
+    db.commit()
+
+
+def test_backfill_then_incremental_refreshes_only_changed_days(db):
+    unit = models.Unidade(nome="Loja Rollup")
+    db.add(unit)
+    db.commit()
+    _seed(db, unit.id)
+    _age(db)
+
+    assert rollup.backfill(db, date(2024, 5, 1), date(2024, 5, 3)) == 3
+    first = db.query(models.MetricaDiaria).filter_by(data_referencia=date(2024, 5, 1)).one()
+    assert (first.total_pedidos, first.pedidos_entregues, first.total_cancelamentos) == (3, 2, 1)
+    assert float(first.total_faturamento) == 80
+    assert float(first.custo_cancelamento) == 20
+    assert first.total_avaliacoes == 3
+
+    # Nada mudou: a passada incremental não recalcula nenhum dia
+    assert rollup.run_incremental(db) == []
+
+    # Escritas no mesmo segundo da passada anterior (updated_at com resolução de segundos)
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime(2024, 5, 2, 20, 0), status="Entregue", valor_total=100))
+    db.commit()
+    assert rollup.run_incremental(db) == [(unit.id, date(2024, 5, 2))]
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime(2024, 5, 3, 20, 0), status="Entregue", valor_total=5))
+    db.commit()
+    assert (unit.id, date(2024, 5, 3)) in rollup.run_incremental(db)
+    second = db.query(models.MetricaDiaria).filter_by(data_referencia=date(2024, 5, 2)).one()
+    third = db.query(models.MetricaDiaria).filter_by(data_referencia=date(2024, 5, 3)).one()
+    assert (float(second.total_faturamento), float(third.total_faturamento)) == (180, 85)
+
+
+def test_range_endpoints_match_raw_queries_when_served_from_rollup(client, db, auth_headers):
+    unit = db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+    _seed(db, unit.id)
+    params = {"start_date": "2024-05-01", "end_date": "2024-05-03"}
+    raw = client.get("/metrics/orders-by-status", params=params, headers=auth_headers).json()
+    raw_cost = client.get("/metrics/cancellation-cost", params=params, headers=auth_headers).json()
+
+    rollup.backfill(db, date(2024, 5, 1), date(2024, 5, 3))
+    f = rollup.parse_day(params["start_date"]), rollup.parse_day(params["end_date"])
+    assert rollup.covers(db, *f)
+    assert not rollup.covers(db, date(2024, 4, 30), f[1])
+
+    assert client.get("/metrics/orders-by-status", params=params, headers=auth_headers).json() == raw
+    assert client.get("/metrics/cancellation-cost", params=params, headers=auth_headers).json()["custo_cancelamento"] == float(raw_cost["custo_cancelamento"])
+    revenue = client.get("/metrics/daily-revenue", params=params, headers=auth_headers).json()
+    assert [(r["dia"], r["faturamento"], r["ticket_medio"]) for r in revenue] == [
+        ("2024-05-01", 80, 40.0),
+        ("2024-05-02", 80, 40.0),
+        ("2024-05-03", 80, 40.0),
+    ]
+    ratings = client.get("/metrics/average-ratings", params=params, headers=auth_headers).json()
+    assert ratings == [{"unidade": "Loja Auth", "media_nota": 3.0}]
+
+
+def test_migrations_are_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'm.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE metricas_diarias (id INTEGER PRIMARY KEY, id_unidade INTEGER, data_referencia DATE)"))
+        conn.execute(text("CREATE TABLE pedidos (id INTEGER PRIMARY KEY, id_unidade INTEGER, id_cliente INTEGER, status TEXT, data_pedido TIMESTAMP, updated_at TIMESTAMP)"))
+    assert migrations.upgrade(engine) == migrations.MIGRATIONS
+    assert migrations.upgrade(engine) == []
+    columns = {c["name"] for c in inspect(engine).get_columns("metricas_diarias")}
+    assert {"pedidos_entregues", "custo_cancelamento", "total_avaliacoes"} <= columns
+    indexes = {i["name"] for i in inspect(engine).get_indexes("pedidos")}
+    assert {"ix_pedidos_unidade_data", "ix_pedidos_status_data", "ux_pedidos_id_externo"} <= indexes
+    unidade_data = next(i for i in inspect(engine).get_indexes("pedidos") if i["name"] == "ix_pedidos_unidade_data")
+    assert unidade_data["column_names"] == ["id_unidade", "data_pedido", "updated_at"]
+    assert inspect(engine).has_table("rollup_estado")
+    assert inspect(engine).has_table("faturamento_mensal")
+
+
+def test_monthly_revenue_filters_and_follows_the_rollup(client, db, auth_headers):
+    unit = db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+    other = models.Unidade(nome="Outra Loja")
+    db.add(other)
+    db.commit()
+    _seed(db, unit.id)
+    _seed(db, other.id)
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime(2024, 6, 3, 12, 0), status="Entregue", valor_total=45))
+    db.commit()
+    params = {"start_date": "2024-05-15", "end_date": "2024-06-10"}
+
+    # Sem rollup: somado direto de pedidos, só da unidade do usuário
+    raw = client.get("/metrics/monthly-revenue", params=params, headers=auth_headers).json()
+    assert raw == [
+        {"unidade": "Loja Auth", "mes": "2024-05", "faturamento_total": 240.0},
+        {"unidade": "Loja Auth", "mes": "2024-06", "faturamento_total": 45.0},
+    ]
+
+    _age(db)
+    rollup.backfill(db, date(2024, 5, 1), date(2024, 6, 30))
+    assert rollup.months_covered(db, date(2024, 5, 1))
+    assert not rollup.months_covered(db, date(2024, 4, 1))
+    assert db.query(models.FaturamentoMensal).count() == 3
+    assert client.get("/metrics/monthly-revenue", params=params, headers=auth_headers).json() == raw
+    june = client.get("/metrics/monthly-revenue", params={"start_date": "2024-06-01"}, headers=auth_headers).json()
+    assert [r["mes"] for r in june] == ["2024-06"]
+
+    # Incremental: só o mês do dia alterado é recalculado
+    may = db.query(models.FaturamentoMensal).filter_by(id_unidade=unit.id, mes=date(2024, 5, 1)).one()
+    may_updated = may.updated_at
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime(2024, 6, 20, 12, 0), status="Entregue", valor_total=15))
+    db.commit()
+    assert rollup.run_incremental(db) == [(unit.id, date(2024, 6, 20))]
+    db.expire_all()
+    assert db.get(models.FaturamentoMensal, may.id).updated_at == may_updated
+    june = db.query(models.FaturamentoMensal).filter_by(id_unidade=unit.id, mes=date(2024, 6, 1)).one()
+    assert (float(june.total_faturamento), june.total_pedidos) == (60, 2)
+
+
+def test_monthly_revenue_cache_and_etag_cover_whole_months(client, db, auth_headers):
+    unit = db.query(models.Unidade).filter_by(nome="Loja Auth").one()
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime(2024, 6, 12, 12, 0), status="Entregue", valor_total=10))
+    db.commit()
+    params = {"start_date": "2024-06-10", "end_date": "2024-06-20"}
+    first = client.get("/metrics/monthly-revenue", params=params, headers=auth_headers)
+    assert first.json() == [{"unidade": "Loja Auth", "mes": "2024-06", "faturamento_total": 10.0}]
+
+    # Pedido do mesmo mês, fora dos dias pedidos: entra na soma, invalida o cache e muda a ETag
+    db.add(models.Pedido(id_unidade=unit.id, data_pedido=datetime(2024, 6, 25, 12, 0), status="Entregue", valor_total=90))
+    db.commit()
+    again = client.get("/metrics/monthly-revenue", params=params, headers={**auth_headers, "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 200
+    assert again.json()[0]["faturamento_total"] == 100.0
+    assert again.headers["ETag"] != first.headers["ETag"]
@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy.orm import sessionmaker
+
+from app import models, scheduling
+from app.scheduling import FileLock, LeaderElection
+
+
+def test_file_lock_elects_one_leader_and_fails_over(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    a, b = LeaderElection(FileLock(path)), LeaderElection(FileLock(path))
+    assert a.step() and not b.step()
+    assert a.step()  # renovação
+
+    # Líder morre (o SO solta o flock): o outro assume e o antigo percebe a perda
+    a.lock.release()
+    assert b.step()
+    assert not a.step() and not a.is_leader
+    b.lock.release()
+
+
+def test_jobs_run_on_leader_only_and_are_recorded(db, monkeypatch):
+    monkeypatch.setattr(scheduling, "history_session", sessionmaker(bind=db.get_bind()))
+    election = LeaderElection(lock=None)
+    calls = []
+
+    def rollup():
+        calls.append("rollup")
+
+    def broken():
+        raise RuntimeError("boom")
+
+    async def coleta():
+        calls.append("coleta")
+
+    scheduling.job("rollup", rollup, election)()
+    assert calls == [] and db.query(models.JobExecucao).count() == 0
+
+    election.is_leader = True
+    scheduling.job("rollup", rollup, election)()
+    scheduling.job("quebrado", broken, election)()
+    asyncio.run(scheduling.job("coleta", coleta, election)())
+
+    # Saltos: ignorados fora do líder; no event loop a gravação vai para uma thread
+    scheduling._on_max_instances(SimpleNamespace(job_id="quebrado"))
+    monkeypatch.setattr(scheduling, "leader", election)
+    scheduling._on_max_instances(SimpleNamespace(job_id="rollup"))
+
+    async def skipped_on_loop():
+        scheduling._on_max_instances(SimpleNamespace(job_id="coleta"))
+
+    asyncio.run(skipped_on_loop())
+
+    assert calls == ["rollup", "coleta"]
+    runs = {(r.job, r.status): r for r in db.query(models.JobExecucao)}
+    assert set(runs) == {
+        ("rollup", "ok"), ("quebrado", "erro"), ("coleta", "ok"), ("rollup", "ignorado"), ("coleta", "ignorado")
+    }
+    assert runs[("quebrado", "erro")].erro == "RuntimeError: boom"
+    assert runs[("rollup", "ok")].duracao_ms is not None
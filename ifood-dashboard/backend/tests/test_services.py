@@ -1,3 +1,5 @@
+from datetime import datetime, timezone
+
 import bcrypt
 
 from app import models
@@ -19,3 +21,92 @@ def test_create_access_token():
     token = create_access_token({"sub": "user@example.com"})
     assert isinstance(token, str)
 
+
+
+def test_current_user_resolved_from_claims_without_db(client, db, auth_headers, monkeypatch):
+    from app.principal import principal_cache
+
+    queries, hits = [], principal_cache.hits
+    monkeypatch.setattr(db, "query", lambda *a, **kw: queries.append(a) or (_ for _ in ()).throw(AssertionError("db hit")))
+    assert client.get("/lojas", headers=auth_headers).status_code == 200
+    assert client.get("/lojas", headers=auth_headers).status_code == 200
+    assert queries == []
+    assert principal_cache.hits == hits + 1
+
+
+def test_unit_change_invalidates_cached_principal(client, db, auth_headers):
+    from app.principal import principal_cache
+
+    user = db.query(models.Login).filter_by(email="auth@example.com").one()
+    client.get("/pedidos", headers=auth_headers)
+    misses = principal_cache.misses
+    other = models.Unidade(nome="Nova Loja")
+    db.add(other)
+    db.commit()
+    user.id_unidade = other.id
+    db.commit()
+
+    # O token antigo ainda carrega a unidade anterior, mas não é mais confiável
+    assert client.get("/pedidos", params={"id_unidade": other.id}, headers=auth_headers).status_code == 200
+    assert principal_cache.misses == misses + 1
+
+
+def test_login_upgrades_weak_password_hash(client, db):
+    from app.security import hash_cost, password_hasher
+
+    weak = bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode()
+    db.add(models.Login(name="Old", email="old@example.com", password_hash=weak))
+    db.commit()
+
+    resp = client.post("/auth/login", json={"email": "old@example.com", "password": "secret"})
+    assert resp.status_code == 200
+    db.expire_all()
+    user = db.query(models.Login).filter_by(email="old@example.com").one()
+    assert hash_cost(user.password_hash) == password_hasher.rounds
+    assert bcrypt.checkpw(b"secret", user.password_hash.encode())
+
+
+def test_login_rejected_with_503_when_hash_pool_is_full(client, db, monkeypatch):
+    from app.security import PasswordHasher
+    import app.main as main
+
+    db.add(models.Login(name="U", email="busy@example.com", password_hash=bcrypt.hashpw(b"x", bcrypt.gensalt(4)).decode()))
+    db.commit()
+    hasher = PasswordHasher(workers=0, max_pending=1)
+    hasher._slots.acquire()  # a única vaga já está ocupada
+    monkeypatch.setattr(main, "password_hasher", hasher)
+
+    resp = client.post("/auth/login", json={"email": "busy@example.com", "password": "x"})
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "1"
+
+
+def test_hash_max_pending_zero_means_unbounded():
+    from app.security import PasswordHasher
+
+    hasher = PasswordHasher(workers=0, max_pending=0, rounds=4)
+    hashed = hasher.hash("x")
+    assert hasher.verify("x", hashed)
+    assert hasher.rejected == 0
+
+
+def test_role_change_from_another_process_revokes_cached_claims(client, db, ingest_headers, monkeypatch):
+    from sqlalchemy import text
+
+    from app import principal
+    from app.principal import principal_cache
+
+    monkeypatch.setattr(principal, "PRINCIPAL_SYNC_SECONDS", 0)
+    assert client.post("/ingest/pedidos", json=[], headers=ingest_headers).status_code != 403
+
+    # Outro worker rebaixa o usuário: nenhum hook roda neste processo
+    db.execute(
+        text("UPDATE login SET role = 'user', claims_valid_after = :agora WHERE email = 'auth@example.com'"),
+        {"agora": datetime.now(timezone.utc)},
+    )
+    db.commit()
+    assert client.post("/ingest/pedidos", json=[], headers=ingest_headers).status_code == 403
+
+    # Depois de um reinício o token antigo continua sem as claims confiáveis
+    principal_cache.clear()
+    assert client.post("/ingest/pedidos", json=[], headers=ingest_headers).status_code == 403
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight, SingleFlightTimeout, query_key
+
+
+def test_concurrent_callers_share_one_execution():
+    flight, calls = SingleFlight(), []
+
+    async def query():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [{"total": 1}]
+
+    async def main():
+        key = query_key("SELECT  1\n FROM pedidos", {"u": 1})
+        assert key == query_key("SELECT 1 FROM pedidos", {"u": 1})
+        return await asyncio.gather(*(flight.do(key, query, copy=lambda rows: [dict(r) for r in rows]) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert results == [[{"total": 1}]] * 5
+    assert results[1] is not results[2]
+    assert flight.stats() == {"executions": 1, "coalesced": 4, "timeouts": 0, "in_flight": 0}
+
+
+def test_leader_error_reaches_every_waiter():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [type(e) for e in errors] == [RuntimeError] * 3
+    assert flight.executions == 1
+
+
+def test_waiter_times_out_and_cancelled_leader_is_replaced():
+    flight = SingleFlight(timeout=0.01)
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0)
+        with pytest.raises(SingleFlightTimeout):
+            await flight.do("k", slow)
+
+        flight.timeout = 5
+        waiter = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(main()) == "ok"
+    assert flight.executions == 2
+    assert flight.timeouts == 1
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import date, datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from app import models, stream
+
+
+def _events(body: str):
+    out = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line and not line.startswith(":"))
+        out.append({"id": fields.get("id"), "event": fields.get("event"), "data": json.loads(fields["data"]) if "data" in fields else None, "raw": block})
+    return out
+
+
+def test_daily_stream_snapshot_deltas_and_resume(client, db, auth_headers, ingest_headers, monkeypatch):
+    unit_id = db.query(models.Unidade).filter_by(nome="Loja Auth").one().id
+    other = models.Unidade(nome="Outra")
+    db.add(other)
+    db.flush()
+    today = datetime.combine(date.today(), datetime.min.time())
+    db.add_all([
+        models.Pedido(id_unidade=unit_id, data_pedido=today.replace(hour=9), status="Entregue", valor_total=40),
+        models.Pedido(id_unidade=unit_id, data_pedido=today.replace(hour=10), status="Em preparo", valor_total=25),
+        models.Pedido(id_unidade=other.id, data_pedido=today.replace(hour=10), status="Entregue", valor_total=99),
+    ])
+    db.commit()
+    hub = stream.StreamHub(
+        session_factory=sessionmaker(bind=db.get_bind()), poll_seconds=0.05, heartbeat_seconds=0.1, max_seconds=0.3
+    )
+    monkeypatch.setattr(stream, "hub", hub)
+
+    resp = client.get("/stream/daily", headers=auth_headers)
+    assert resp.status_code == 200 and resp.headers["content-type"].startswith("text/event-stream")
+    first = _events(resp.text)
+    assert first[0]["raw"].startswith("retry:") and any(e["raw"] == ": ping" for e in first)
+    snapshot = first[1]
+    assert snapshot["event"] == "snapshot"
+    assert snapshot["data"]["total_pedidos"] == 2 and snapshot["data"]["faturamento_dia"] == 40
+    assert snapshot["data"]["por_hora"] == [{"hora": 9, "total": 1}, {"hora": 10, "total": 1}]
+
+    # Pedido novo pela ingestão e mudança de status: um delta com os dois e os totais
+    order = {"id_externo": "s-1", "id_unidade": unit_id, "data_pedido": today.replace(hour=11).isoformat(), "status": "Entregue", "valor_total": 60}
+    assert client.post("/ingest/pedidos", json=[order], headers=ingest_headers).json()["aceitos"] == 1
+    preparo = db.query(models.Pedido).filter_by(status="Em preparo").one()
+    preparo.status = "Cancelado"
+    db.commit()
+    time.sleep(0.3)
+
+    # Reconexão com Last-Event-ID: só o que perdeu, sem novo snapshot
+    resumed = [e for e in _events(client.get("/stream/daily", headers={**auth_headers, "Last-Event-ID": snapshot["id"]}).text) if e["event"]]
+    assert resumed and all(e["event"] == "delta" for e in resumed)
+    novos = [o for e in resumed for o in e["data"]["novos"]]
+    alterados = [o for e in resumed for o in e["data"]["status"]]
+    assert [(o["valor_total"], o["hora"]) for o in novos] == [(60.0, 11)]
+    assert [(o["anterior"], o["status"], o["motivo"]) for o in alterados] == [("Em preparo", "Cancelado", "Sem motivo")]
+    last = resumed[-1]["data"]
+    assert last["total_pedidos"] == 3 and last["faturamento_dia"] == 100
+    assert {"status": "Cancelado", "total": 1} in last["por_status"]
+
+    # Id desconhecido: snapshot atual. Todos os streams da unidade dividem uma leitura
+    fresh = [e for e in _events(client.get("/stream/daily", headers={**auth_headers, "Last-Event-ID": "x:1"}).text) if e["event"]]
+    assert fresh[0]["event"] == "snapshot" and fresh[0]["data"]["total_pedidos"] == 3
+    assert list(hub.feeds) == [unit_id]
+
+
+def test_subscriber_cap(client, db, auth_headers, monkeypatch):
+    hub = stream.StreamHub(session_factory=sessionmaker(bind=db.get_bind()), max_subscribers=0)
+    monkeypatch.setattr(stream, "hub", hub)
+    resp = client.get("/stream/daily", headers=auth_headers)
+    assert resp.status_code == 503 and resp.headers["Retry-After"] == "5"
+    assert hub.stats()["rejected"] == 1
+
+
+def test_subscribe_waits_for_the_poll_in_progress(db, monkeypatch):
+    hub = stream.StreamHub(session_factory=sessionmaker(bind=db.get_bind()), poll_seconds=60)
+    placed = datetime.combine(date.today(), datetime.min.time())
+
+    async def scenario():
+        feed = (await hub.subscribe(None)).feed
+        started = threading.Event()
+
+        def slow_poll():
+            # Como o _poll: altera `orders` na thread enquanto a leitura não termina
+            started.set()
+            for i in range(20000):
+                feed.orders[i] = stream.Order("Entregue", 1.0, placed, None)
+            return []
+
+        monkeypatch.setattr(feed, "_run_poll", slow_poll)
+        polling = asyncio.create_task(feed.refresh())
+        while not started.is_set():
+            await asyncio.sleep(0)
+        subscription = await hub.subscribe(None)
+        await polling
+        await hub.close()
+        return subscription
+
+    subscription = asyncio.run(scenario())
+    snapshot = _events(subscription.backlog[0])[0]
+    assert snapshot["event"] == "snapshot" and snapshot["data"]["total_pedidos"] == 20000
@@ -0,0 +1,80 @@
+import unicodedata
+
+from sqlalchemy import text
+
+from app import cache, models, textfix
+
+
+def test_normalize_repairs_double_encoded_text():
+    assert textfix.normalize("HambÃºrguer") == "Hambúrguer"
+    # Passou duas vezes pela conversão
+    assert textfix.normalize("Hambúrguer".encode().decode("latin-1").encode().decode("latin-1")) == "Hambúrguer"
+    assert textfix.normalize("Pedido nÃ£o chegou â€“ atraso") == "Pedido não chegou – atraso"
+    assert textfix.normalize(unicodedata.normalize("NFD", "Pão")) == "Pão"
+    assert textfix.normalize("Água com gás") == "Água com gás"
+    assert textfix.normalize(None) is None
+
+
+def test_backfill_is_resumable_and_reports(client, db, auth_headers, ingest_headers):
+    unit_id = db.query(models.Unidade).filter_by(nome="Loja Auth").one().id
+    # SQL direto: simula linhas carregadas antes da normalização
+    db.execute(text("INSERT INTO produtos (id, nome) VALUES (1, 'HambÃºrguer'), (2, 'Suco'), (3, 'PÃ£o de queijo')"))
+    db.execute(
+        text("INSERT INTO pedidos (id, id_unidade, status, motivo_cancelamento) VALUES (1, :u, 'Cancelado', 'Cliente nÃ£o atendeu')"),
+        {"u": unit_id},
+    )
+    db.execute(text("INSERT INTO feedbacks (id, id_pedido, nota, comentario) VALUES (1, 1, 1, 'PÃ©ssimo')"))
+    db.commit()
+
+    assert textfix.repair_batch(db, "produtos.nome", batch_size=2) == (2, 1)
+    # Interrompido: a próxima execução continua do id 2
+    result = textfix.backfill(db, batch_size=2)
+    assert result["produtos.nome"] == {"verificados": 1, "reparados": 1}
+    assert result["feedbacks.comentario"]["reparados"] == 1
+    assert result["pedidos.motivo_cancelamento"]["reparados"] == 1
+    db.expire_all()
+    assert [p.nome for p in db.query(models.Produto).order_by(models.Produto.id)] == ["Hambúrguer", "Suco", "Pão de queijo"]
+    assert db.get(models.Pedido, 1).motivo_cancelamento == "Cliente não atendeu"
+
+    report = {r["alvo"]: r for r in textfix.report(db)}
+    assert report["produtos.nome"]["verificados"] == 3 and report["produtos.nome"]["reparados"] == 2
+    assert report["produtos.nome"]["concluido_em"] is not None
+    assert all(r["suspeitos"] == 0 for r in report.values())
+    assert textfix.backfill(db)["produtos.nome"] == {"verificados": 0, "reparados": 0}
+
+    # Escritas novas já chegam limpas: ORM e ingestão
+    db.add(models.Produto(nome="CafÃ©"))
+    db.commit()
+    assert db.query(models.Produto).filter_by(nome="Café").count() == 1
+    order = {
+        "id_externo": "x-1", "id_unidade": unit_id, "data_pedido": "2024-06-10T12:00:00", "status": "Cancelado",
+        "motivo_cancelamento": "Sem entregador disponÃ­vel", "feedback": {"nota": 1, "comentario": "NÃ£o chegou"},
+    }
+    assert client.post("/ingest/pedidos", json=[order], headers=ingest_headers).json()["aceitos"] == 1
+    pedido = db.query(models.Pedido).filter_by(id_externo="x-1").one()
+    assert pedido.motivo_cancelamento == "Sem entregador disponível"
+    assert db.query(models.Feedback).filter_by(id_pedido=pedido.id).one().comentario == "Não chegou"
+
+
+def test_backfill_invalidates_cached_responses_and_etags(client, db, auth_headers, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_GENERATION_SECONDS", 0)
+    unit_id = db.query(models.Unidade).filter_by(nome="Loja Auth").one().id
+    db.execute(
+        text(
+            "INSERT INTO pedidos (id, id_unidade, data_pedido, status, motivo_cancelamento) "
+            "VALUES (1, :u, '2024-06-10 12:00:00', 'Cancelado', 'Cliente nÃ£o atendeu')"
+        ),
+        {"u": unit_id},
+    )
+    db.commit()
+    url = "/metrics/daily-cancellations-by-hour?date=2024-06-10"
+
+    before = client.get(url, headers=auth_headers)
+    assert before.json()[0]["motivo"] == "Cliente nÃ£o atendeu"
+    assert client.get(url, headers={**auth_headers, "If-None-Match": before.headers["etag"]}).status_code == 304
+
+    # O reparo não move updated_at: quem avisa é a geração do cache
+    textfix.backfill(db)
+    after = client.get(url, headers={**auth_headers, "If-None-Match": before.headers["etag"]})
+    assert after.status_code == 200 and after.json()[0]["motivo"] == "Cliente não atendeu"
+    assert after.headers["etag"] != before.headers["etag"]
@@ -3,7 +3,7 @@
 import React, { useEffect, useMemo, useState } from 'react';
 import { GlobalLayout } from '@/components/Layout/GlobalLayout';
 import { useAuth } from '@/context/AuthContext';
-import { getDailyOverview, getDailyCumulativeRevenue, getDailyAcceptTimeByHour, getDailyCancellationsByHour } from '@/services/daily';
+import { getDailyBundle, streamDaily, StreamOrder } from '@/services/daily';
 import { GraficoPedidosPorStatus } from '@/components/Graficos/GraficoPedidosPorStatus';
 import { LineChart, Line, XAxis, YAxis, Tooltip, ResponsiveContainer, CartesianGrid, BarChart, Bar, Legend } from 'recharts';
 
@@ -22,24 +22,21 @@ export default function DiarioPage() {
   const [acceptByHour, setAcceptByHour] = useState<{ hora: number; tempo_medio: number }[]>([]);
   const [cancelByHour, setCancelByHour] = useState<{ hora: number; motivo: string; qtd: number }[]>([]);
 
+  const [reload, setReload] = useState<number>(0);
+
   useEffect(() => {
     const load = async () => {
       if (!isAuthenticated) return;
       setLoading(true);
       setError('');
       try {
-        const [ov, cr, at, ch] = await Promise.all([
-          getDailyOverview({ date }),
-          getDailyCumulativeRevenue({ date }),
-          getDailyAcceptTimeByHour({ date }),
-          getDailyCancellationsByHour({ date }),
-        ]);
-        setKpis(ov.data);
-        setPorStatus(ov.data?.por_status || []);
-        setClientes(ov.data?.clientes || null);
-        setCumulative(cr.data || []);
-        setAcceptByHour(at.data || []);
-        setCancelByHour(ch.data || []);
+        const { data } = await getDailyBundle({ date });
+        setKpis(data);
+        setPorStatus(data?.por_status || []);
+        setClientes(data?.clientes || null);
+        setCumulative(data?.cumulativo || []);
+        setAcceptByHour(data?.aceite_por_hora || []);
+        setCancelByHour(data?.cancelamentos_por_hora || []);
       } catch (e) {
         setError('Falha ao carregar dados do dia.');
       } finally {
@@ -47,6 +44,42 @@ export default function DiarioPage() {
       }
     };
     load();
+  }, [date, isAuthenticated, reload]);
+
+  // Hoje: o backend empurra pedidos novos e mudanças de status, sem refazer as consultas do dia
+  useEffect(() => {
+    if (!isAuthenticated || date !== todayISO()) return;
+    const controller = new AbortController();
+    const time = (ts: string) => new Date(ts).getTime();
+    let first = true;
+    const applyOrder = (o: StreamOrder) => {
+      if (o.status === 'Entregue' && o.anterior !== 'Entregue') {
+        setCumulative((prev) => [...prev, { ts: o.ts, valor_total: o.valor_total }].sort((a, b) => time(a.ts) - time(b.ts)));
+      } else if (o.anterior === 'Entregue' && o.status !== 'Entregue') {
+        setCumulative((prev) => prev.filter((r) => time(r.ts) !== time(o.ts) || Number(r.valor_total) !== o.valor_total));
+      }
+      if (o.status === 'Cancelado' && o.anterior !== 'Cancelado') {
+        const motivo = o.motivo || 'Sem motivo';
+        setCancelByHour((prev) => {
+          const found = prev.find((x) => x.hora === o.hora && x.motivo === motivo);
+          if (!found) return [...prev, { hora: o.hora, motivo, qtd: 1 }];
+          return prev.map((x) => (x === found ? { ...x, qtd: x.qtd + 1 } : x));
+        });
+      }
+    };
+    streamDaily((e) => {
+      setKpis((prev) => (prev ? { ...prev, total_pedidos: e.data.total_pedidos, faturamento_dia: e.data.faturamento_dia } : prev));
+      setPorStatus(e.data.por_status);
+      if (e.event === 'snapshot') {
+        // Reconexão sem como retomar (ou virada do dia): recarrega os painéis uma vez
+        if (!first) setReload((n) => n + 1);
+        first = false;
+      } else {
+        e.data.novos.forEach(applyOrder);
+        e.data.status.forEach(applyOrder);
+      }
+    }, controller.signal);
+    return () => controller.abort();
   }, [date, isAuthenticated]);
 
   // Preparos de gráfico
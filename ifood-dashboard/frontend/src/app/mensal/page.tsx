@@ -3,8 +3,7 @@
 import React, { useEffect, useMemo, useState } from 'react';
 import Link from 'next/link';
 import { GlobalLayout } from '@/components/Layout/GlobalLayout';
-import { getMonthlyRevenue, getOrdersByStatus, getAverageRatings } from '@/services/metrics';
-import { getTopProductsRevenue, getDailyRevenue, getCancellationCost } from '@/services/insights';
+import { getMonthlyRevenue, getMonthlyBundle } from '@/services/metrics';
 import { GraficoFaturamentoMensal } from '@/components/Graficos/GraficoFaturamentoMensal';
 import { GraficoPedidosPorStatus } from '@/components/Graficos/GraficoPedidosPorStatus';
 import { useAuth } from '@/context/AuthContext';
@@ -57,7 +56,12 @@ export default function MensalPage() {
       try {
         setLoading(true);
         setError('');
-        const res = await getMonthlyRevenue({});
+        // Só os meses exibidos no seletor: o backend filtra período e unidade
+        const last12 = genLastNMonths(12);
+        const res = await getMonthlyRevenue({
+          start_date: toDate(last12[0], false),
+          end_date: toDate(last12[last12.length - 1], true),
+        });
         const data: MR[] = res.data.map((x: any) => ({
           unidade: x.unidade,
           mes: x.mes,
@@ -65,7 +69,6 @@ export default function MensalPage() {
         }));
         setMr(data);
         const fromApi = Array.from(new Set(data.map((x) => fmtMonth(x.mes))));
-        const last12 = genLastNMonths(12);
         const union = Array.from(new Set([...fromApi, ...last12])).sort();
         setMonths(union);
         setSelected(union[union.length - 1] ?? '');
@@ -84,19 +87,13 @@ export default function MensalPage() {
     const end = toDate(selected, true);
     setError('');
     setLoading(true);
-    Promise.all([
-      getOrdersByStatus({ start_date: start, end_date: end }),
-      getAverageRatings({ start_date: start, end_date: end }),
-      getTopProductsRevenue({ start_date: start, end_date: end, limit: 5 }),
-      getDailyRevenue({ start_date: start, end_date: end }),
-      getCancellationCost({ start_date: start, end_date: end }),
-    ])
-      .then(([st, ar, top, dr, cc]) => {
-        setStatusData(st.data || []);
-        setAvgRatings(ar.data || []);
-        setTopRevenue(top.data || []);
-        setDaily(dr.data || []);
-        setCancelCost(Number(cc.data?.custo_cancelamento ?? 0));
+    getMonthlyBundle({ start_date: start, end_date: end, limit: 5 })
+      .then(({ data }) => {
+        setStatusData(data?.por_status || []);
+        setAvgRatings(data?.avaliacoes || []);
+        setTopRevenue(data?.top_produtos || []);
+        setDaily(data?.faturamento_diario || []);
+        setCancelCost(Number(data?.custo_cancelamento ?? 0));
         setLastUpdated(new Date().toLocaleString('pt-BR'));
       })
       .catch(() => setError('Falha ao carregar métricas.'))
@@ -105,8 +102,6 @@ export default function MensalPage() {
 
   const monthRevenue = useMemo(() => {
     if (!selected) return 0;
-    const start = toDate(selected, false);
-    const end = toDate(selected, true);
     // soma de todas unidades no mês
     return mr
       .filter((x) => {
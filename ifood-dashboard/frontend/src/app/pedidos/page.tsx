@@ -4,18 +4,28 @@ import React, { useEffect, useState } from 'react';
 import Link from 'next/link';
 import { GlobalLayout } from '@/components/Layout/GlobalLayout';
 import { getOrders } from '@/services/orders';
-import { Pedido } from '@/assets/types';
+import { Pedido, PedidosPage } from '@/assets/types';
+
+const PAGE_SIZE = 50;
 
 const PedidosPage = () => {
   const [pedidos, setPedidos] = useState<Pedido[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const fetchPage = async (cursor?: string) => {
+    const response = await getOrders({ limit: PAGE_SIZE, cursor });
+    const page: PedidosPage = response.data;
+    setPedidos((prev) => (cursor ? [...prev, ...page.items] : page.items));
+    setNextCursor(page.next_cursor);
+  };
 
   useEffect(() => {
     const fetchPedidos = async () => {
       try {
-        const response = await getOrders();
-        setPedidos(response.data);
+        await fetchPage();
       } catch (err) {
         setError('Falha ao carregar pedidos.');
       } finally {
@@ -25,6 +35,18 @@ const PedidosPage = () => {
     fetchPedidos();
   }, []);
 
+  const handleLoadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      await fetchPage(nextCursor);
+    } catch (err) {
+      setError('Falha ao carregar pedidos.');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   return (
     <GlobalLayout>
       {loading ? (
@@ -55,6 +77,18 @@ const PedidosPage = () => {
               ))}
             </tbody>
           </table>
+          {nextCursor && (
+            <div className="p-4 flex justify-center border-t border-slate-700">
+              <button
+                type="button"
+                onClick={handleLoadMore}
+                disabled={loadingMore}
+                className="px-4 py-2 bg-ifood-red text-white rounded-md hover:opacity-90 disabled:opacity-50"
+              >
+                {loadingMore ? 'Carregando...' : 'Carregar mais'}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </GlobalLayout>
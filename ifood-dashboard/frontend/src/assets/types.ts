@@ -38,3 +38,7 @@ export interface Pedido {
   valor_total: number;
   }
 
+export interface PedidosPage {
+  items: Pedido[];
+  next_cursor: string | null;
+}
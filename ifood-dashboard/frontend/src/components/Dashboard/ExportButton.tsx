@@ -2,17 +2,17 @@
 
 import { Download } from 'lucide-react';
 import React from 'react';
+import { api } from '@/api/api';
 
 interface ExportButtonProps {
-  data: Record<string, any>[];
+  data?: Record<string, any>[];
   filename?: string;
+  // Quando informado, o CSV é gerado em streaming pelo backend (ex.: '/export/metrics/daily-revenue')
+  path?: string;
+  params?: Record<string, string | number | undefined>;
 }
 
-function exportToCsv(rows: Record<string, any>[], filename: string) {
-  if (!rows.length) return;
-  const headers = Object.keys(rows[0]);
-  const csv = [headers.join(','), ...rows.map(row => headers.map(h => JSON.stringify(row[h] ?? '')).join(','))].join('\n');
-  const blob = new Blob([csv], { type: 'text/csv;charset=utf-8;' });
+function downloadBlob(blob: Blob, filename: string) {
   const url = URL.createObjectURL(blob);
   const link = document.createElement('a');
   link.href = url;
@@ -20,13 +20,34 @@ function exportToCsv(rows: Record<string, any>[], filename: string) {
   document.body.appendChild(link);
   link.click();
   document.body.removeChild(link);
+  URL.revokeObjectURL(url);
+}
+
+function exportToCsv(rows: Record<string, any>[], filename: string) {
+  if (!rows.length) return;
+  const headers = Object.keys(rows[0]);
+  const csv = [headers.join(','), ...rows.map(row => headers.map(h => JSON.stringify(row[h] ?? '')).join(','))].join('\n');
+  downloadBlob(new Blob([csv], { type: 'text/csv;charset=utf-8;' }), filename);
 }
 
-export const ExportButton: React.FC<ExportButtonProps> = ({ data, filename = 'relatorio.csv' }) => {
+async function exportFromServer(path: string, params: ExportButtonProps['params'], filename: string) {
+  const response = await api.get(path, { params: { ...params, format: 'csv' }, responseType: 'blob' });
+  downloadBlob(response.data, filename);
+}
+
+export const ExportButton: React.FC<ExportButtonProps> = ({ data = [], filename = 'relatorio.csv', path, params }) => {
+  const handleClick = () => {
+    if (path) {
+      exportFromServer(path, params, filename).catch(() => alert('Erro ao exportar relatório'));
+    } else {
+      exportToCsv(data, filename);
+    }
+  };
+
   return (
     <button
       type="button"
-      onClick={() => exportToCsv(data, filename)}
+      onClick={handleClick}
       className="flex items-center px-4 py-2 bg-ifood-red text-white rounded-md hover:opacity-90"
     >
       <Download className="w-4 h-4 mr-2" />
@@ -34,4 +55,3 @@ export const ExportButton: React.FC<ExportButtonProps> = ({ data, filename = 're
     </button>
   );
 };
-
@@ -12,3 +12,73 @@ export const getDailyAcceptTimeByHour = (params: { date: string }) =>
 export const getDailyCancellationsByHour = (params: { date: string }) =>
   api.get('/metrics/daily-cancellations-by-hour', { params });
 
+// Todos os painéis da página diária em uma requisição
+export const getDailyBundle = (params: { date: string }) =>
+  api.get('/dashboard/daily', { params });
+
+export type DailyTotals = {
+  data: string;
+  total_pedidos: number;
+  faturamento_dia: number;
+  por_status: { status: string; total: number }[];
+  por_hora: { hora: number; total: number }[];
+};
+
+export type StreamOrder = {
+  id: number;
+  status: string;
+  valor_total: number;
+  ts: string;
+  hora: number;
+  motivo: string | null;
+  anterior?: string;
+};
+
+export type DailyStreamEvent =
+  | { event: 'snapshot'; data: DailyTotals }
+  | { event: 'delta'; data: DailyTotals & { novos: StreamOrder[]; status: StreamOrder[] } };
+
+// KPIs de hoje por Server-Sent Events. fetch em vez de EventSource para mandar o
+// Authorization; reconecta sozinho com Last-Event-ID até o `signal` abortar.
+export async function streamDaily(onEvent: (e: DailyStreamEvent) => void, signal: AbortSignal) {
+  let lastEventId = '';
+  let retry = 3000;
+  while (!signal.aborted) {
+    try {
+      const headers: Record<string, string> = { Accept: 'text/event-stream' };
+      const token = localStorage.getItem('token');
+      if (token) headers.Authorization = `Bearer ${token}`;
+      if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL ?? ''}/stream/daily`, { headers, signal });
+      if (res.status === 401) return;
+      if (!res.ok || !res.body) throw new Error(`stream: HTTP ${res.status}`);
+      const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        let end;
+        while ((end = buffer.indexOf('\n\n')) >= 0) {
+          const block = buffer.slice(0, end);
+          buffer = buffer.slice(end + 2);
+          let event = '';
+          let data = '';
+          for (const line of block.split('\n')) {
+            const sep = line.indexOf(': ');
+            if (sep < 0 || line.startsWith(':')) continue; // comentário (heartbeat)
+            const [field, val] = [line.slice(0, sep), line.slice(sep + 2)];
+            if (field === 'id') lastEventId = val;
+            else if (field === 'event') event = val;
+            else if (field === 'data') data += val;
+            else if (field === 'retry') retry = Number(val) || retry;
+          }
+          if (event && data) onEvent({ event, data: JSON.parse(data) } as DailyStreamEvent);
+        }
+      }
+    } catch (e) {
+      if (signal.aborted) return;
+    }
+    await new Promise((resolve) => setTimeout(resolve, retry));
+  }
+}
@@ -11,3 +11,7 @@ export const getAverageRatings = (params?: { start_date?: string; end_date?: str
 
 export const getWeeklyOrders = (params?: { start_date?: string; end_date?: string }) =>
   api.get('/metrics/weekly-orders', { params });
+
+// Todos os painéis da página mensal em uma requisição
+export const getMonthlyBundle = (params: { start_date: string; end_date: string; limit?: number }) =>
+  api.get('/dashboard/monthly', { params });
@@ -1,8 +1,20 @@
 import { api } from '@/api/api';
 
-export const getOrders = () => api.get('/pedidos');
+export interface OrdersPageParams {
+  limit?: number;
+  cursor?: string;
+  status?: string;
+  id_unidade?: number;
+  start_date?: string;
+  end_date?: string;
+}
+
+export const getOrders = (params?: OrdersPageParams) => api.get('/pedidos', { params });
 
 export const getOrderById = (id: string | number) => api.get(`/pedidos/${id}`);
 
 export const exportOrder = (id: string | number) =>
   api.get(`/pedidos/${id}/export`, { responseType: 'blob' });
+
+export const exportOrders = (params?: Omit<OrdersPageParams, 'limit' | 'cursor'> & { format?: 'csv' | 'ndjson' }) =>
+  api.get('/pedidos/export', { params, responseType: 'blob' });